@@ -1,21 +1,79 @@
-from flask import Flask, render_template, send_from_directory, send_file, request, jsonify, session
+from flask import (Flask, Response, render_template, send_from_directory, send_file, request, jsonify, session,
+                   stream_with_context)
+import json
 import os
 import uuid
+from datetime import datetime
 from werkzeug.utils import secure_filename
-from database.database import Database
+from database.database import MATERIAL_COLUMNS, Database
 from services.auth_service import AuthService
-# Инициализация БД
-db = Database('database/tutoring.db')
+from services.extraction_service import ExtractionService
+from services.perf_service import PerfService
+from services.pregeneration_service import DEFAULT_CONCURRENCY, PregenerationService
+from services.session_service import LRUSessionStore, ServerSessionInterface, SqliteSessionStore
+from services.test_job_service import TestJobService
+from llm.chunking import format_questions, split_questions
+from llm.admission import AdmissionError
+from llm.llm_client import LLMError
+# Инициализация БД (путь можно переопределить, например для бенчмарков)
+db = Database(os.environ.get('TUTOR_DB_PATH', 'database/tutoring.db'))
 auth_service = AuthService(db)
+perf_service = PerfService(db)
 
-# Создаем таблицы при запуске
-db.create_tables()
-db.update_schema()
-# Гарантируем наличие пользователя tutor
-db.ensure_tutor_user()
+# Применяем недостающие миграции (для актуальной базы - одно чтение PRAGMA user_version)
+db.migrate()
+
+# Фоновая генерация тестов; незавершенные до перезапуска задачи продолжаются
+test_job_service = TestJobService(db)
+test_job_service.resume()
+
+# Заблаговременная генерация тестов, пока модель простаивает (TUTOR_PREGENERATION=1)
+pregeneration_service = PregenerationService(
+    db, test_job_service,
+    concurrency=int(os.environ.get('TUTOR_PREGENERATION_WORKERS', DEFAULT_CONCURRENCY)))
+if os.environ.get('TUTOR_PREGENERATION') == '1':
+    pregeneration_service.start()
+
+UPLOAD_FOLDER = 'uploads/materials'
+
+# Извлечение текста загруженных материалов в пуле процессов (TUTOR_EXTRACTION=1);
+# появившийся текст сразу попадает в заблаговременную генерацию
+extraction_service = ExtractionService(db, upload_dir=UPLOAD_FOLDER,
+                                       on_extracted=lambda material_id: pregeneration_service.trigger())
+if os.environ.get('TUTOR_EXTRACTION') == '1':
+    extraction_service.start()
 
 app = Flask(__name__)
 app.secret_key = 'tutoring-secret-key-2024'
+# Данные сессии хранятся в базе (с LRU-кэшем в памяти), в cookie - только id
+app.session_interface = ServerSessionInterface(LRUSessionStore(SqliteSessionStore(db)))
+# Заголовок Server-Timing с замерами запроса включается переменной окружения
+app.config['SERVER_TIMING'] = os.environ.get('TUTOR_SERVER_TIMING') == '1'
+
+# Интервал keep-alive комментариев в потоке SSE, пока модель обрабатывает промпт
+SSE_HEARTBEAT_SECONDS = 15
+
+
+@app.before_request
+def start_request_timing():
+    perf_service.start_request()
+
+
+@app.after_request
+def finish_request_timing(response):
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    sample = perf_service.finish_request(f'{request.method} {route}')
+    if sample and app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = perf_service.server_timing(sample)
+    return response
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Пересчет сводной статистики репетиторов: flask --app app rebuild-stats"""
+    db.rebuild_tutor_stats()
+
+
 @app.route('/timetable.js')
 def serve_timetable_js():
     return send_file('timetable.js', mimetype='application/javascript')
@@ -34,6 +92,8 @@ def api_login():
     success, message, user = auth_service.login(username, password)
 
     if success:
+        # Новый id сессии после входа
+        session.regenerate()
         session['user_id'] = user.id
         session['username'] = user.username
         session['role'] = user.role
@@ -179,33 +239,32 @@ def api_delete_student(student_id):
 
     try:
         # Проверяем, что ученик принадлежит текущему репетитору
-        connection = db.get_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT created_by FROM users WHERE id = ?", (student_id,))
-        student = cursor.fetchone()
+        with db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT created_by FROM users WHERE id = ?", (student_id,))
+            student = cursor.fetchone()
 
-        if not student:
-            return jsonify({'success': False, 'message': 'Ученик не найден'}), 404
+            if not student:
+                return jsonify({'success': False, 'message': 'Ученик не найден'}), 404
 
-        if student['created_by'] != session['user_id']:
-            return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
+            if student['created_by'] != session['user_id']:
+                return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
 
-        # Помечаем ученика как неактивного
-        cursor.execute("UPDATE users SET is_active = 0 WHERE id = ?", (student_id,))
+            # Помечаем ученика как неактивного
+            cursor.execute("UPDATE users SET is_active = 0 WHERE id = ?", (student_id,))
 
-        # Снимаем активные слоты расписания ученика
-        # (вариант А — «мягко»: пометить как cancelled)
-        cursor.execute("""
-            UPDATE schedule
-               SET status = 'cancelled'
-             WHERE student_id = ? AND status = 'active'
-        """, (student_id,))
+            # Снимаем активные слоты расписания ученика
+            # (вариант А — «мягко»: пометить как cancelled)
+            cursor.execute("""
+                UPDATE schedule
+                   SET status = 'cancelled'
+                 WHERE student_id = ? AND status = 'active'
+            """, (student_id,))
 
-        # Если хочешь прямо удалять слоты, вместо UPDATE можно:
-        # cursor.execute("DELETE FROM schedule WHERE student_id = ?", (student_id,))
+            # Если хочешь прямо удалять слоты, вместо UPDATE можно:
+            # cursor.execute("DELETE FROM schedule WHERE student_id = ?", (student_id,))
 
-        connection.commit()
-        connection.close()
+            connection.commit()
 
         print(f"✅ Ученик ID {student_id} удален")
         return jsonify({'success': True, 'message': 'Ученик успешно удален'})
@@ -215,6 +274,20 @@ def api_delete_student(student_id):
         return jsonify({'success': False, 'message': f'Ошибка при удалении ученика: {str(e)}'}), 500
 
 
+@app.route('/debug/perf', methods=['GET', 'DELETE'])
+def debug_perf():
+    """Замеры по маршрутам за скользящее окно; DELETE очищает статистику (только репетитору)"""
+    if 'user_id' not in session or session['role'] != 'tutor':
+        return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
+
+    if request.method == 'DELETE':
+        perf_service.reset()
+        return jsonify({'success': True})
+    return jsonify({'routes': perf_service.report(), 'single_flight': test_job_service.flights.stats(),
+                    'admission': test_job_service.admission.stats(),
+                    'llm_backends': test_job_service.client.router.stats()})
+
+
 @app.route('/debug/files')
 def debug_files():
     """Отладочная страница для проверки файлов"""
@@ -240,18 +313,16 @@ def debug_files():
 def debug_db():
     """Отладочная страница для проверки базы данных"""
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
-
-        # Проверка таблицы
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
+        with db.connection() as connection:
+            cursor = connection.cursor()
 
-        # Проверка пользователей
-        cursor.execute("SELECT * FROM users")
-        users = cursor.fetchall()
+            # Проверка таблицы
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            tables = cursor.fetchall()
 
-        connection.close()
+            # Проверка пользователей
+            cursor.execute("SELECT * FROM users")
+            users = cursor.fetchall()
 
         result = {
             'tables': [dict(table) for table in tables],
@@ -301,37 +372,10 @@ def test_1():
     if 'user_id' not in session:
         return "Доступ запрещен. Необходима авторизация.", 403
     
-    try:
-        # Загружаем материал z5.txt
-        # Путь относительно директории, где находится app.py (tutor/)
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        material_path = os.path.join(base_dir, 'llm', 'materials', 'z5.txt')
-        
-        if not os.path.exists(material_path):
-            return f"❌ Файл материала не найден: {material_path}\nТекущая директория: {os.getcwd()}", 404
-        
-        with open(material_path, 'r', encoding='utf-8') as f:
-            material_text = f.read()
-        
-        # Генерируем тест на основе материала
-        print(f"📝 Генерация теста из материала z5.txt...")
-        generated_test = generate_test_from_text(material_text, material_name="z5")
-        
-        # Сохраняем в сессии для отображения
-        session['generated_test'] = generated_test
-        session['test_material'] = material_text
-        session['test_material_name'] = 'z5'
-        
-        return render_template('test_1.html', 
-                             test=generated_test, 
-                             material=material_text,
-                             material_name='z5')
-    
-    except Exception as e:
-        print(f"❌ Ошибка при генерации теста: {e}")
-        import traceback
-        traceback.print_exc()
-        return f"Ошибка при генерации теста: {str(e)}", 500
+    # Тест генерируется в фоне: страница создает задачу и опрашивает /api/tests/jobs/<id>.
+    # ?fresh=1 - сгенерировать заново, не используя кэш
+    return render_template('test_1.html', test=None, material_name='z5',
+                           force_fresh=request.args.get('fresh') == '1')
 
 @app.route('/tests/2')
 def test_2():
@@ -509,19 +553,34 @@ def student_tests():
 
 @app.route('/test-result')
 def test_result():
-    """Страница с результатами генерации теста"""
-    generated_test = session.get('generated_test', '')
-    test_material = session.get('test_material', '')
-
+    """Страница с результатами генерации теста.
+
+    ?material_name=z5 - потоковая генерация (вопросы появляются по мере готовности),
+    иначе - результат последней задачи /generate-test из сессии.
+    """
+    material_name = request.args.get('material_name')
+    if material_name:
+        return render_template('test_result.html', questions=[], material_name=material_name,
+                               stream_url=f"/generate-test/stream?{request.query_string.decode()}")
+
+    # Результат последней фоновой задачи пользователя; незавершенную страница опрашивает
+    job = db.get_test_job(session['test_job_id']) if 'test_job_id' in session else None
+    if job and job['status'] in ('queued', 'running'):
+        return render_template('test_result.html', questions=[], job_url=f"/api/tests/jobs/{job['id']}")
+
+    generated_test = job['result'] if job and job['status'] == 'done' else None
     if not generated_test:
         return "Результаты не найдены. Пожалуйста, сгенерируйте тест сначала.", 404
 
-    return render_template('test_result.html', test=generated_test, material=test_material)
+    return render_template('test_result.html', test=generated_test, questions=split_questions(generated_test))
 
 
 @app.route('/generate-test', methods=['POST'])
 def generate_test():
     """Генерация теста из материала"""
+    if 'user_id' not in session:
+        return jsonify({"test": "❌ Ошибка: Не авторизован"}), 401
+
     data = request.get_json()
     material = data.get("text", "")
     material_name = data.get("material_name", "z5")  # По умолчанию "z5"
@@ -529,13 +588,143 @@ def generate_test():
     if not material:
         return jsonify({"test": "❌ Ошибка: Не указан материал для генерации теста"}), 400
 
-    result = generate_test_from_text(material, material_name=material_name)
+    try:
+        job_id = test_job_service.submit(session['user_id'], material, material_name)
+    except ValueError as e:
+        return jsonify({"test": f"❌ Ошибка: {e}"}), 400
+    except AdmissionError as e:
+        return _too_many_requests(e, {"test": f"❌ Ошибка: {e}"})
+    except RuntimeError as e:
+        return jsonify({"test": f"❌ Ошибка: {e}"}), 500
+
+    # Результат появится на /test-result, когда задача завершится. Материал хранится
+    # в задаче, в сессии - только ее id
+    session['test_job_id'] = job_id
+
+    return jsonify({"job_id": job_id, "status_url": f"/api/tests/jobs/{job_id}", "redirect": "/test-result"}), 202
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _too_many_requests(error, body):
+    """429 с Retry-After; если у пользователя уже есть задача в очереди - ссылка на нее"""
+    job_id = getattr(error, 'job_id', None)
+    if job_id:
+        body.update(job_id=job_id, status_url=f'/api/tests/jobs/{job_id}')
+    body['retry_after'] = error.retry_after
+    response = jsonify(body)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
 
-    # Сохраняем результат в сессии для отображения на отдельной странице
-    session['generated_test'] = result
-    session['test_material'] = material
 
-    return jsonify({"test": result, "redirect": "/test-result"})
+@app.route('/generate-test/stream')
+def generate_test_stream():
+    """Потоковая генерация теста (Server-Sent Events).
+
+    Материал - ?material_name=z5 или текст последнего /generate-test.
+    События: queued {position}, пока генерация ждет очереди, question {number, text}
+    по мере готовности вопросов, done {count, from_cache, test_id} или error {message}.
+    ?fresh=1 - без кэша. Если очередь генерации заполнена - 429 с Retry-After.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    material_name = request.args.get('material_name')
+    if material_name:
+        material = test_job_service.load_material(material_name)
+    else:
+        material = db.get_test_job_material(session.get('test_job_id'), session['user_id'])
+    if not material or not material.strip():
+        return jsonify({'success': False, 'message': 'Не указан материал для генерации теста'}), 400
+
+    user_id = session['user_id']
+    client = test_job_service.client
+    key = client.cache_key(material)
+    cached = None if request.args.get('fresh') == '1' else db.get_cached_test(key)
+
+    # Место в очереди генерации занимается до начала ответа, чтобы отказать кодом 429
+    admission = test_job_service.admission
+    ticket = None
+    if cached is None:
+        try:
+            ticket = admission.enqueue(user_id)
+        except AdmissionError as e:
+            return _too_many_requests(e, {'success': False, 'message': str(e)})
+
+    def replay(test_text, from_cache, test_id=None):
+        questions = split_questions(test_text)
+        for number, question in enumerate(questions, start=1):
+            yield _sse('question', {'number': number, 'text': question})
+        yield _sse('done', {'count': len(questions), 'from_cache': from_cache, 'test_id': test_id})
+
+    def events():
+        if cached is not None:
+            yield from replay(cached, True)
+            return
+
+        # Такой же тест уже генерируется (задачей или другим потоком) - ждем его результат
+        while True:
+            flight, leader = test_job_service.flights.begin(key)
+            if leader:
+                break
+            admission.release(ticket)
+            while not flight.wait(SSE_HEARTBEAT_SECONDS):
+                yield ": keep-alive\n\n"
+            if flight.abandoned:
+                # Ведущий отключился, не дождавшись теста - генерацию продолжает этот запрос
+                continue
+            test_text, test_id = flight.result
+            if not test_text or test_text.startswith('❌'):
+                yield _sse('error', {'message': test_text or 'Пустой ответ модели'})
+            else:
+                yield from replay(test_text, True, test_id)
+            return
+
+        questions = []
+        result = None
+        abandoned = False
+        try:
+            # Первая проверка без ожидания; пока генерация в очереди, сообщаем место в ней
+            timeout = 0
+            while not admission.acquire(ticket, timeout=timeout):
+                yield _sse('queued', {'position': admission.position(ticket)})
+                timeout = SSE_HEARTBEAT_SECONDS
+
+            for question in client.stream_test(material, heartbeat=SSE_HEARTBEAT_SECONDS):
+                if question is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                questions.append(question)
+                yield _sse('question', {'number': len(questions), 'text': question})
+
+            test_text = format_questions(questions)
+            db.save_cached_test(key, client.model, material_name, test_text)
+            test_id = test_job_service.save_to_bank(test_text, material_name, user_id)
+            result = (test_text, test_id)
+            yield _sse('done', {'count': len(questions), 'from_cache': False, 'test_id': test_id})
+        except LLMError as e:
+            result = (str(e), None)
+            yield _sse('error', {'message': str(e)})
+        except GeneratorExit:
+            # Браузер закрыл соединение до конца генерации - для ожидающих это не ошибка,
+            # генерацию продолжит один из них
+            abandoned = result is None
+            raise
+        finally:
+            admission.release(ticket)
+            if abandoned:
+                test_job_service.flights.abandon(flight)
+            else:
+                test_job_service.flights.finish(flight, result=result or ('❌ Ошибка: генерация прервана', None))
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if ticket:
+        # Если соединение закрыто до начала потока, events() не освободит место сам
+        response.call_on_close(lambda: admission.release(ticket))
+    return response
 
 
 @app.route('/student-schedule')
@@ -556,6 +745,14 @@ def student_materials():
     return render_template('student_materials.html')
 
 
+# Колонки списка материалов: извлеченный текст (до MAX_TEXT_CHARS) в список не попадает
+MATERIAL_LIST_COLUMNS = ', '.join('{alias}' + column for column in MATERIAL_COLUMNS)
+
+# Размер страницы поиска материалов: по умолчанию и наибольший
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+
+
 @app.route('/api/materials')
 def api_get_materials():
     """API для получения учебных материалов"""
@@ -563,28 +760,27 @@ def api_get_materials():
         return jsonify({'error': 'Не авторизован'}), 401
 
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
-
-        if session['role'] == 'tutor':
-            # Репетитор видит все свои материалы
-            cursor.execute("""
-                SELECT * FROM materials 
-                WHERE tutor_id = ? 
-                ORDER BY created_at DESC
-            """, (session['user_id'],))
-        else:
-            # Ученик видит материалы своего репетитора
-            cursor.execute("""
-                SELECT m.* 
-                FROM materials m
-                JOIN users u ON m.tutor_id = u.created_by
-                WHERE u.id = ?
-                ORDER BY m.created_at DESC
-            """, (session['user_id'],))
+        with db.connection() as connection:
+            cursor = connection.cursor()
 
-        materials = [dict(row) for row in cursor.fetchall()]
-        connection.close()
+            if session['role'] == 'tutor':
+                # Репетитор видит все свои материалы
+                cursor.execute(f"""
+                    SELECT {MATERIAL_LIST_COLUMNS.format(alias='')} FROM materials 
+                    WHERE tutor_id = ? 
+                    ORDER BY created_at DESC
+                """, (session['user_id'],))
+            else:
+                # Ученик видит материалы своего репетитора
+                cursor.execute(f"""
+                    SELECT {MATERIAL_LIST_COLUMNS.format(alias='m.')} 
+                    FROM materials m
+                    JOIN users u ON m.tutor_id = u.created_by
+                    WHERE u.id = ?
+                    ORDER BY m.created_at DESC
+                """, (session['user_id'],))
+
+            materials = [dict(row) for row in cursor.fetchall()]
 
         return jsonify({
             'success': True,
@@ -599,6 +795,34 @@ def api_get_materials():
             'materials': []
         })
 
+@app.route('/api/materials/search')
+def api_search_materials():
+    """Поиск материалов: ?q=&exam_type=&category=&page=&per_page=
+
+    С q - полнотекстовый поиск по названию, описанию и тексту файла,
+    лучшие совпадения первыми, snippet - фрагмент с найденными словами.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(MAX_SEARCH_PAGE_SIZE, max(1, request.args.get('per_page', SEARCH_PAGE_SIZE, type=int)))
+    result = db.search_materials(session['user_id'], session['role'], request.args.get('q'),
+                                 request.args.get('exam_type'), request.args.get('category'),
+                                 limit=per_page, offset=(page - 1) * per_page)
+    if result is None:
+        return jsonify({'success': False, 'message': 'Ошибка поиска материалов'}), 500
+
+    return jsonify({
+        'success': True,
+        'materials': result['materials'],
+        'total': result['total'],
+        'page': page,
+        'per_page': per_page,
+        'pages': (result['total'] + per_page - 1) // per_page,
+    })
+
+
 @app.route('/api/tutor/materials', methods=['POST'])
 def api_create_material():
     """API для создания учебного материала (только для репетитора)"""
@@ -608,26 +832,25 @@ def api_create_material():
     data = request.get_json()
 
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
-
-        cursor.execute("""
-            INSERT INTO materials (tutor_id, title, description, file_type, file_size, file_path, category, exam_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            session['user_id'],
-            data['title'],
-            data.get('description', ''),
-            data['file_type'],
-            data.get('file_size', '0 MB'),
-            data.get('file_path', ''),
-            data.get('category', 'other'),
-            data.get('exam_type', 'both')
-        ))
-
-        material_id = cursor.lastrowid
-        connection.commit()
-        connection.close()
+        with db.connection() as connection:
+            cursor = connection.cursor()
+
+            cursor.execute("""
+                INSERT INTO materials (tutor_id, title, description, file_type, file_size, file_path, category, exam_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                session['user_id'],
+                data['title'],
+                data.get('description', ''),
+                data['file_type'],
+                data.get('file_size', '0 MB'),
+                data.get('file_path', ''),
+                data.get('category', 'other'),
+                data.get('exam_type', 'both')
+            ))
+
+            material_id = cursor.lastrowid
+            connection.commit()
 
         return jsonify({
             'success': True,
@@ -640,7 +863,6 @@ def api_create_material():
         return jsonify({'success': False, 'message': 'Ошибка создания материала'}), 500
 
 
-UPLOAD_FOLDER = 'uploads/materials'
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'ppt', 'pptx', 'txt', 'zip', 'rar'}
 
 
@@ -687,28 +909,28 @@ def api_upload_material():
             file_type = filename.rsplit('.', 1)[1].lower()
 
             # Сохраняем в базу данных
-            connection = db.get_connection()
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                INSERT INTO materials (tutor_id, title, description, file_type, file_size, file_path, category, exam_type)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                session['user_id'],
-                title,
-                description,
-                file_type,
-                file_size,
-                file_path,
-                category,
-                exam_type
-            ))
-
-            material_id = cursor.lastrowid
-            connection.commit()
-            connection.close()
+            with db.connection() as connection:
+                cursor = connection.cursor()
+
+                cursor.execute("""
+                    INSERT INTO materials (tutor_id, title, description, file_type, file_size, file_path, category, exam_type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    session['user_id'],
+                    title,
+                    description,
+                    file_type,
+                    file_size,
+                    file_path,
+                    category,
+                    exam_type
+                ))
+
+                material_id = cursor.lastrowid
+                connection.commit()
 
             print(f"✅ Материал загружен: {title} (ID: {material_id})")
+            extraction_service.submit(material_id)
 
             return jsonify({
                 'success': True,
@@ -727,29 +949,25 @@ def api_upload_material():
 def download_material(material_id):
     """Скачивание материала"""
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM materials WHERE id = ?", (material_id,))
-        material = cursor.fetchone()
-
-        if not material:
-            connection.close()
-            return jsonify({'error': 'Материал не найден'}), 404
+        with db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT * FROM materials WHERE id = ?", (material_id,))
+            material = cursor.fetchone()
 
-        material_dict = dict(material)
+            if not material:
+                return jsonify({'error': 'Материал не найден'}), 404
 
-        # Проверяем права доступа
-        if session['role'] == 'student':
-            # Ученик может скачивать только материалы своего репетитора
-            cursor.execute("""
-                SELECT u.created_by FROM users u 
-                WHERE u.id = ? AND u.created_by = ?
-            """, (session['user_id'], material_dict['tutor_id']))
-            if not cursor.fetchone():
-                connection.close()
-                return jsonify({'error': 'Доступ запрещен'}), 403
+            material_dict = dict(material)
 
-        connection.close()
+            # Проверяем права доступа
+            if session['role'] == 'student':
+                # Ученик может скачивать только материалы своего репетитора
+                cursor.execute("""
+                    SELECT u.created_by FROM users u 
+                    WHERE u.id = ? AND u.created_by = ?
+                """, (session['user_id'], material_dict['tutor_id']))
+                if not cursor.fetchone():
+                    return jsonify({'error': 'Доступ запрещен'}), 403
 
         file_path = material_dict['file_path']
 
@@ -780,11 +998,10 @@ def download_material(material_id):
 def preview_material(material_id):
     """Просмотр материала"""
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM materials WHERE id = ?", (material_id,))
-        material = cursor.fetchone()
-        connection.close()
+        with db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT * FROM materials WHERE id = ?", (material_id,))
+            material = cursor.fetchone()
 
         if not material:
             return jsonify({'error': 'Материал не найден'}), 404
@@ -820,27 +1037,26 @@ def delete_material(material_id):
         return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
 
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
+        with db.connection() as connection:
+            cursor = connection.cursor()
 
-        # Проверяем, что материал принадлежит текущему репетитору
-        cursor.execute("SELECT * FROM materials WHERE id = ? AND tutor_id = ?", (material_id, session['user_id']))
-        material = cursor.fetchone()
+            # Проверяем, что материал принадлежит текущему репетитору
+            cursor.execute("SELECT * FROM materials WHERE id = ? AND tutor_id = ?", (material_id, session['user_id']))
+            material = cursor.fetchone()
 
-        if not material:
-            return jsonify({'success': False, 'message': 'Материал не найден'}), 404
+            if not material:
+                return jsonify({'success': False, 'message': 'Материал не найден'}), 404
 
-        material_dict = dict(material)
+            material_dict = dict(material)
 
-        # Удаляем файл с диска
-        file_path = material_dict['file_path']
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+            # Удаляем файл с диска
+            file_path = material_dict['file_path']
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
 
-        # Удаляем запись из базы данных
-        cursor.execute("DELETE FROM materials WHERE id = ?", (material_id,))
-        connection.commit()
-        connection.close()
+            # Удаляем запись из базы данных
+            cursor.execute("DELETE FROM materials WHERE id = ?", (material_id,))
+            connection.commit()
 
         print(f"✅ Материал удален: {material_dict['title']} (ID: {material_id})")
 
@@ -858,16 +1074,15 @@ def delete_material(material_id):
 def update_download_stats(material_id):
     """Обновление статистики скачиваний"""
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
+        with db.connection() as connection:
+            cursor = connection.cursor()
 
-        # Здесь можно добавить логику для отслеживания статистики скачиваний
-        # Например, создать таблицу download_stats или обновлять поле в materials
-        cursor.execute("UPDATE materials SET download_count = COALESCE(download_count, 0) + 1 WHERE id = ?",
-                       (material_id,))
+            # Здесь можно добавить логику для отслеживания статистики скачиваний
+            # Например, создать таблицу download_stats или обновлять поле в materials
+            cursor.execute("UPDATE materials SET download_count = COALESCE(download_count, 0) + 1 WHERE id = ?",
+                           (material_id,))
 
-        connection.commit()
-        connection.close()
+            connection.commit()
 
         return jsonify({'success': True})
 
@@ -886,13 +1101,17 @@ def api_income_stats():
 
     try:
         tutor_id = session['user_id']
-        stats = db.get_income_statistics(tutor_id)
+        # Необязательный период для помесячной разбивки: ?from=YYYY-MM-DD&to=YYYY-MM-DD
+        stats = db.get_income_statistics(tutor_id, request.args.get('from'), request.args.get('to'))
 
         return jsonify({
             'success': True,
             'stats': stats
         })
 
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Некорректный период: {e}'}), 400
+
     except Exception as e:
         print(f"❌ Ошибка получения статистики доходов: {e}")
         return jsonify({'success': False, 'message': 'Ошибка загрузки статистики'}), 500
@@ -905,30 +1124,29 @@ def api_income_details():
         return jsonify({'error': 'Доступ запрещен'}), 403
 
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor()
-
-        cursor.execute("""
-            SELECT 
-                i.id,
-                i.amount,
-                i.payment_date,
-                i.status,
-                u.first_name,
-                u.last_name,
-                u.exam_type,
-                s.day_of_week,
-                s.start_time
-            FROM income i
-            JOIN users u ON i.student_id = u.id
-            JOIN schedule s ON i.schedule_id = s.id
-            WHERE s.tutor_id = ?
-            ORDER BY i.payment_date DESC
-            LIMIT 50
-        """, (session['user_id'],))
-
-        income_details = [dict(row) for row in cursor.fetchall()]
-        connection.close()
+        with db.connection() as connection:
+            cursor = connection.cursor()
+
+            cursor.execute("""
+                SELECT 
+                    i.id,
+                    i.amount,
+                    i.payment_date,
+                    i.status,
+                    u.first_name,
+                    u.last_name,
+                    u.exam_type,
+                    s.day_of_week,
+                    s.start_time
+                FROM income i
+                JOIN users u ON i.student_id = u.id
+                JOIN schedule s ON i.schedule_id = s.id
+                WHERE s.tutor_id = ?
+                ORDER BY i.payment_date DESC
+                LIMIT 50
+            """, (session['user_id'],))
+
+            income_details = [dict(row) for row in cursor.fetchall()]
 
         return jsonify({
             'success': True,
@@ -1002,49 +1220,47 @@ def api_create_schedule_entry():
             if not data.get(field):
                 return jsonify({'success': False, 'message': f'Поле {field} обязательно'}), 400
 
-        connection = db.get_connection()
-        cursor = connection.cursor()
-
-        # Создаем тему если не указана
-        topic_title = data.get('topic', f'Занятие с учеником {data["student_id"]}')
-        cursor.execute('''
-            INSERT INTO topics (title, description, created_by)
-            VALUES (?, ?, ?)
-        ''', (topic_title, 'Индивидуальное занятие', tutor_id))
-        topic_id = cursor.lastrowid
-
-        # Определяем день недели
-        if data['lesson_type'] == 'single':
-            # Для разовых занятий определяем день недели из даты
-            from datetime import datetime
-            lesson_date = data['lesson_date']
-            date_obj = datetime.strptime(lesson_date, '%Y-%m-%d')
-            day_map = {
-                0: 'monday', 1: 'tuesday', 2: 'wednesday', 3: 'thursday',
-                4: 'friday', 5: 'saturday', 6: 'sunday'
-            }
-            day_of_week = day_map[date_obj.weekday()]
-        else:
-            # Для регулярных занятий берем день недели из формы
-            day_of_week = data['day_of_week']
+        with db.connection() as connection:
+            cursor = connection.cursor()
 
-        # Создаем запись в расписании
-        cursor.execute('''
-            INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status, lesson_type)
-            VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
-        ''', (data['student_id'], tutor_id, topic_id, day_of_week, data['start_time'], data['end_time'], data['lesson_type']))
+            # Создаем тему если не указана
+            topic_title = data.get('topic', f'Занятие с учеником {data["student_id"]}')
+            cursor.execute('''
+                INSERT INTO topics (title, description, created_by)
+                VALUES (?, ?, ?)
+            ''', (topic_title, 'Индивидуальное занятие', tutor_id))
+            topic_id = cursor.lastrowid
+
+            # Определяем день недели
+            if data['lesson_type'] == 'single':
+                # Для разовых занятий определяем день недели из даты
+                lesson_date = data['lesson_date']
+                date_obj = datetime.strptime(lesson_date, '%Y-%m-%d')
+                day_map = {
+                    0: 'monday', 1: 'tuesday', 2: 'wednesday', 3: 'thursday',
+                    4: 'friday', 5: 'saturday', 6: 'sunday'
+                }
+                day_of_week = day_map[date_obj.weekday()]
+            else:
+                # Для регулярных занятий берем день недели из формы
+                day_of_week = data['day_of_week']
+
+            # Создаем запись в расписании
+            cursor.execute('''
+                INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status, lesson_type)
+                VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
+            ''', (data['student_id'], tutor_id, topic_id, day_of_week, data['start_time'], data['end_time'], data['lesson_type']))
 
-        schedule_id = cursor.lastrowid
+            schedule_id = cursor.lastrowid
 
-        # Для разовых занятий создаем запись в single_lessons
-        if data['lesson_type'] == 'single':
-            cursor.execute('''
-                INSERT INTO single_lessons (schedule_id, lesson_date)
-                VALUES (?, ?)
-            ''', (schedule_id, data['lesson_date']))
+            # Для разовых занятий создаем запись в single_lessons
+            if data['lesson_type'] == 'single':
+                cursor.execute('''
+                    INSERT INTO single_lessons (schedule_id, lesson_date)
+                    VALUES (?, ?)
+                ''', (schedule_id, data['lesson_date']))
 
-        connection.commit()
-        connection.close()
+            connection.commit()
 
         return jsonify({
             'success': True,
@@ -1062,15 +1278,19 @@ def api_get_schedule_for_date(date):
     if 'user_id' not in session or session['role'] != 'tutor':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
+    try:
+        datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Некорректная дата, ожидается YYYY-MM-DD'}), 400
+
     try:
         tutor_id = session['user_id']
-        schedule = db.get_schedule_for_date(tutor_id, date)
-        stats = db.get_schedule_statistics(tutor_id, date)
+        day_view = db.get_schedule_day_view(tutor_id, date)
 
         return jsonify({
             'success': True,
-            'schedule': schedule,
-            'stats': stats
+            'schedule': day_view['lessons'],
+            'stats': day_view['stats']
         })
 
     except Exception as e:
@@ -1078,6 +1298,185 @@ def api_get_schedule_for_date(date):
         return jsonify({'success': False, 'message': 'Ошибка загрузки расписания'}), 500
 
 
+@app.route('/api/tutor/schedule/range')
+def api_get_schedule_for_range():
+    """API для получения расписания и статистики по дням за период (?from=YYYY-MM-DD&to=YYYY-MM-DD)"""
+    if 'user_id' not in session or session['role'] != 'tutor':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if not date_from or not date_to:
+        return jsonify({'success': False, 'message': 'Параметры from и to обязательны'}), 400
+
+    try:
+        days = db.get_schedule_for_range(session['user_id'], date_from, date_to)
+
+        return jsonify({
+            'success': True,
+            'days': days
+        })
+
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Некорректный период: {e}'}), 400
+
+    except Exception as e:
+        print(f"❌ Ошибка получения расписания за период: {e}")
+        return jsonify({'success': False, 'message': 'Ошибка загрузки расписания'}), 500
+
+def _can_access_material(material_id):
+    """Материал свой (репетитор) или своего репетитора (ученик)"""
+    with db.connection() as connection:
+        if session['role'] == 'tutor':
+            row = connection.execute("SELECT 1 FROM materials WHERE id = ? AND tutor_id = ?",
+                                     (material_id, session['user_id'])).fetchone()
+        else:
+            row = connection.execute("""
+                SELECT 1 FROM materials m
+                JOIN users u ON m.tutor_id = u.created_by
+                WHERE m.id = ? AND u.id = ?
+            """, (material_id, session['user_id'])).fetchone()
+    return row is not None
+
+
+@app.route('/api/tests/jobs', methods=['POST'])
+def api_create_test_job():
+    """Постановка генерации теста в очередь: {text}, {material_name} (llm/materials)
+    или {material_id} (загруженный материал с извлеченным текстом)"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        material_text = data.get('text')
+        material_id = None
+        if not material_text and data.get('material_id') is not None:
+            material_id = int(data['material_id'])
+            if not _can_access_material(material_id):
+                return jsonify({'success': False, 'message': 'Материал не найден'}), 404
+            material_text = test_job_service.load_uploaded_material(material_id,
+                                                                    extracting=extraction_service.running)
+        job_id = test_job_service.submit(session['user_id'], material_text, data.get('material_name'),
+                                         force_fresh=bool(data.get('force_fresh')), material_id=material_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except AdmissionError as e:
+        return _too_many_requests(e, {'success': False, 'message': str(e)})
+    except RuntimeError as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+    # Тест из кэша готов сразу - клиенту не нужно опрашивать статус
+    job = db.get_test_job(job_id)
+    job.pop('user_id')
+    job['position'] = test_job_service.position(job_id)
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': job['status'],
+        'job': job,
+        'status_url': f'/api/tests/jobs/{job_id}'
+    }), 200 if job['status'] == 'done' else 202
+
+
+@app.route('/api/tests/jobs/<job_id>')
+def api_get_test_job(job_id):
+    """Статус и результат задачи генерации теста"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    job = db.get_test_job(job_id)
+    if not job or job['user_id'] != session['user_id']:
+        return jsonify({'success': False, 'message': 'Задача не найдена'}), 404
+
+    job.pop('user_id')
+    # Место в очереди генерации: 1 - следующая, 0 - уже выполняется
+    job['position'] = test_job_service.position(job_id)
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/api/tests/bank')
+def api_question_bank():
+    """Количество вопросов банка по материалам"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    return jsonify({'success': True, 'materials': db.get_question_bank_summary()})
+
+
+def _can_access_test(test):
+    """Тест свой, по доступному загруженному материалу или общий (llm/materials, без автора)"""
+    if test['created_by'] == session['user_id']:
+        return True
+    if test['material_id'] is not None:
+        return _can_access_material(test['material_id'])
+    return test['created_by'] is None
+
+
+def _test_for_session(test):
+    """Тест для ответа: ученик не получает правильные ответы"""
+    if session['role'] == 'student':
+        for question in test['questions']:
+            question.pop('correct_option', None)
+    return test
+
+
+@app.route('/api/tests/assemble', methods=['POST'])
+def api_assemble_test():
+    """Сборка теста из банка вопросов без модели: {material_name | material_id, count}"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 7))
+        material_id = int(data['material_id']) if data.get('material_id') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Некорректные параметры'}), 400
+    if not 1 <= count <= 50:
+        return jsonify({'success': False, 'message': 'Количество вопросов должно быть от 1 до 50'}), 400
+    if material_id is not None and not _can_access_material(material_id):
+        return jsonify({'success': False, 'message': 'Материал не найден'}), 404
+
+    test_id = db.assemble_test(data.get('material_name'), material_id, count, created_by=session['user_id'])
+    if not test_id:
+        return jsonify({'success': False, 'message': 'В банке нет вопросов по этому материалу'}), 404
+
+    return jsonify({'success': True, 'test_id': test_id, 'test': _test_for_session(db.get_test(test_id))}), 201
+
+
+@app.route('/api/tests/<int:test_id>')
+def api_get_test(test_id):
+    """Тест из банка с вопросами и вариантами ответов (правильные ответы - только репетитору)"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Не авторизован'}), 401
+
+    test = db.get_test(test_id)
+    if not test or not _can_access_test(test):
+        return jsonify({'success': False, 'message': 'Тест не найден'}), 404
+    return jsonify({'success': True, 'test': _test_for_session(test)})
+
+
+@app.route('/api/tests/cache', methods=['DELETE'])
+def api_invalidate_test_cache():
+    """Сброс кэша сгенерированных тестов: всего или ?material_name=..."""
+    if 'user_id' not in session or session['role'] != 'tutor':
+        return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
+
+    deleted = db.invalidate_cached_tests(request.args.get('material_name'))
+    return jsonify({'success': True, 'deleted': deleted})
+
+
+@app.route('/api/tests/pregeneration', methods=['GET', 'POST'])
+def api_test_pregeneration():
+    """Прогресс заблаговременной генерации тестов; POST запускает внеочередной проход"""
+    if 'user_id' not in session or session['role'] != 'tutor':
+        return jsonify({'success': False, 'message': 'Доступ запрещен'}), 403
+
+    if request.method == 'POST' and not pregeneration_service.start():
+        pregeneration_service.trigger()
+    return jsonify({'success': True, 'pregeneration': pregeneration_service.status()})
+
+
 if __name__ == '__main__':
     print("Flask сервер запущен!")
     print("Откройте: http://localhost:5000")
@@ -0,0 +1,95 @@
+"""Бенчмарк Database.get_tutor_students для разного числа учеников.
+
+Запуск из директории tutor/:
+    python -m bench.bench_tutor_students
+"""
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from database.database import Database
+
+STUDENT_COUNTS = (10, 100, 500, 2000)
+LESSONS_PER_STUDENT = 20
+REPEATS = 20
+
+
+def seed(db, tutor_id, student_count):
+    """Заполнение базы учениками, расписанием, уроками и прогрессом"""
+    with db.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+            INSERT INTO users (username, password_hash, role, first_name, last_name, lesson_price)
+            VALUES (?, 'x', 'tutor', 'Бенч', 'Репетитор', 1500)
+        """, (f'bench_tutor_{tutor_id}',))
+        tutor_id = cursor.lastrowid
+        cursor.execute("INSERT INTO topics (title, created_by) VALUES ('Бенчмарк', ?)", (tutor_id,))
+        topic_id = cursor.lastrowid
+
+        for i in range(student_count):
+            cursor.execute("""
+                INSERT INTO users (username, password_hash, role, first_name, last_name,
+                                   exam_type, lesson_price, created_by, is_active)
+                VALUES (?, 'x', 'student', 'Ученик', ?, ?, 1000, ?, 1)
+            """, (f'bench_{tutor_id}_{i}', str(i), 'oge' if i % 2 else 'ege', tutor_id))
+            student_id = cursor.lastrowid
+            cursor.execute("""
+                INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status)
+                VALUES (?, ?, ?, 'monday', '10:00', '11:00', 'active')
+            """, (student_id, tutor_id, topic_id))
+            schedule_id = cursor.lastrowid
+            cursor.executemany("""
+                INSERT INTO lessons (schedule_id, topic_id, lesson_date) VALUES (?, ?, '2025-01-01')
+            """, [(schedule_id, topic_id)] * LESSONS_PER_STUDENT)
+            cursor.execute("""
+                INSERT INTO student_progress (student_id, topic_id, overall_progress) VALUES (?, ?, ?)
+            """, (student_id, topic_id, 50 + i % 50))
+        connection.commit()
+    return tutor_id
+
+
+def count_statements(db, func):
+    """Количество SQL-выражений, выполненных за один вызов func"""
+    statements = []
+    with db.connection() as connection:
+        connection.set_trace_callback(statements.append)
+        try:
+            func()
+        finally:
+            connection.set_trace_callback(None)
+    return len(statements)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = Database(os.path.join(tmp, 'bench.db'))
+            db.create_tables()
+
+        print(f"{'учеников':>10} {'p50, мс':>10} {'p95, мс':>10} {'мкс/ученик':>12} {'SQL/вызов':>10}")
+        for number, student_count in enumerate(STUDENT_COUNTS):
+            tutor_id = seed(db, number, student_count)
+
+            timings = []
+            # Отладочные print() внутри Database не должны влиять на замеры
+            with contextlib.redirect_stdout(io.StringIO()):
+                db.get_tutor_students(tutor_id)  # прогрев
+                for _ in range(REPEATS):
+                    started = time.perf_counter()
+                    students = db.get_tutor_students(tutor_id)
+                    timings.append((time.perf_counter() - started) * 1000)
+                statements = count_statements(db, lambda: db.get_tutor_students(tutor_id))
+            assert len(students) == student_count
+
+            p50 = statistics.median(timings)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            print(f"{student_count:>10} {p50:>10.2f} {p95:>10.2f} {p50 * 1000 / student_count:>12.1f} {statements:>10}")
+
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Проверка миграций на базе из репозитория (database/tutoring.db).
+
+Поставляемая база создана до появления миграций: income в ней ссылается
+на lessons (lesson_id), а не на schedule. Скрипт мигрирует копию этой
+базы и сравнивает итоговую схему (колонки таблиц и имена индексов) со
+схемой новой базы. Код возврата 1, если миграция не прошла или схемы
+различаются.
+
+Запуск из директории tutor/:
+    python -m bench.check_legacy_migration
+"""
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from database.database import Database
+
+LEGACY_DB = os.path.join(os.path.dirname(__file__), '..', '..', 'database', 'tutoring.db')
+
+
+def schema(db_path):
+    """Колонки таблиц, имена индексов и триггеров и версия схемы базы"""
+    with contextlib.closing(sqlite3.connect(db_path)) as connection:
+        objects = connection.execute(
+            "SELECT type, name FROM sqlite_master "
+            "WHERE name NOT LIKE 'sqlite_%' AND name NOT LIKE 'materials_fts_%' "
+            "ORDER BY type, name").fetchall()
+        tables = {}
+        for object_type, name in objects:
+            if object_type == 'table':
+                # ALTER TABLE ADD COLUMN добавляет колонку в конец - порядок не сравниваем
+                tables[name] = sorted((row[1], row[2].upper(), row[3], row[5])
+                                      for row in connection.execute(f'PRAGMA table_info("{name}")'))
+        indexes = {name for object_type, name in objects if object_type in ('index', 'trigger')}
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+    return tables, indexes, version
+
+
+def migrate(db_path):
+    """Миграция базы; (успех, вывод миграций)"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        db = Database(db_path)
+        try:
+            db.migrate()
+            migrated = True
+        except Exception:
+            migrated = False
+        finally:
+            db.close_all()
+    return migrated, output.getvalue()
+
+
+def main():
+    if not os.path.isfile(LEGACY_DB):
+        print(f"❌ Не найдена база {os.path.normpath(LEGACY_DB)}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        fresh_path = os.path.join(tmp, 'fresh.db')
+        shutil.copyfile(LEGACY_DB, legacy_path)
+
+        legacy_migrated, legacy_output = migrate(legacy_path)
+        migrate(fresh_path)
+
+        legacy_tables, legacy_indexes, legacy_version = schema(legacy_path)
+        fresh_tables, fresh_indexes, fresh_version = schema(fresh_path)
+
+    failures = []
+    if not legacy_migrated:
+        failures.append(f"миграция завершилась ошибкой:\n{legacy_output.strip()}")
+    if legacy_version != fresh_version:
+        failures.append(f"версия схемы {legacy_version}, ожидалась {fresh_version}")
+    for name in sorted(fresh_tables.keys() - legacy_tables.keys()):
+        failures.append(f"нет таблицы {name}")
+    for name in sorted(legacy_tables.keys() & fresh_tables.keys()):
+        if legacy_tables[name] != fresh_tables[name]:
+            failures.append(f"колонки {name} отличаются:\n   было  {legacy_tables[name]}"
+                            f"\n   нужно {fresh_tables[name]}")
+    for name in sorted(fresh_indexes - legacy_indexes):
+        failures.append(f"нет индекса или триггера {name}")
+
+    extra = sorted(legacy_tables.keys() - fresh_tables.keys())
+    if extra:
+        print(f"⚠️ Таблицы только в старой базе: {', '.join(extra)}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print(f"✅ База из репозитория мигрирована до версии {legacy_version}, схема совпадает с новой")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
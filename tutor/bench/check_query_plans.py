@@ -0,0 +1,217 @@
+"""Проверка планов запросов: ни одно выражение Database и app.py не должно
+полностью сканировать таблицу на большой синтетической базе.
+
+Скрипт генерирует базу, прогоняет через Flask test client все JSON-маршруты
+и вызывает публичные методы Database, перехватывая выполненный SQL
+(set_trace_callback). Для каждого SELECT/UPDATE/DELETE выполняется
+EXPLAIN QUERY PLAN; строки вида "SCAN <таблица>" без индекса считаются
+ошибкой. Код возврата 1, если найдены полные сканирования.
+
+Запуск из директории tutor/:
+    python -m bench.check_query_plans [--preset large]
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+from bench.synthetic import PRESETS, generate, pick_accounts
+
+# Выражения, которым полное сканирование разрешено, и причина
+ALLOWED_FULL_SCANS = (
+    (re.compile(r'^SELECT \* FROM users$'), '/debug/db выводит всех пользователей'),
+    (re.compile(r'sqlite_master'), 'служебный каталог SQLite'),
+)
+
+CHECKED_STATEMENT = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE)\b', re.IGNORECASE)
+TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN|UPDATE)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?', re.IGNORECASE)
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+SQL_KEYWORDS = {'where', 'join', 'left', 'inner', 'on', 'order', 'group', 'set', 'limit', 'union', 'using'}
+
+
+def normalize(statement):
+    return ' '.join(line.strip() for line in statement.strip().splitlines() if line.strip())
+
+
+def table_aliases(statement, tables):
+    """Отображение псевдоним -> таблица для настоящих таблиц выражения"""
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(statement):
+        if table.lower() in tables:
+            aliases[table.lower()] = table.lower()
+            if alias and alias.lower() not in SQL_KEYWORDS:
+                aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def full_scans(connection, statement, tables):
+    """Список таблиц, которые выражение читает полным сканированием"""
+    plan = connection.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    aliases = table_aliases(statement, tables)
+    scans = []
+    for row in plan:
+        match = FULL_SCAN.match(row[3])
+        if match and match.group(1).lower() in aliases:
+            scans.append(aliases[match.group(1).lower()])
+    return scans
+
+
+def exercise_app(app_module, tutor, student):
+    """Вызов всех маршрутов app.py, работающих с базой"""
+    db = app_module.db
+    client = app_module.app.test_client()
+    today = '2025-03-12'
+
+    client.post('/api/login', json={'username': tutor['username'], 'password': tutor['password']})
+    for url in ('/api/check-auth', '/api/schedule', '/debug/students', '/debug/db', '/api/tutor/students',
+                '/api/tutor/income-stats', '/api/tutor/income-stats?from=2023-01-01&to=2025-12-31',
+                '/api/tutor/income-details', '/api/tutor/quick-stats', '/api/tutor/schedule/students',
+                f'/api/tutor/schedule/date/{today}', '/api/tutor/schedule/range?from=2025-03-01&to=2025-03-31',
+                '/api/materials', '/api/materials/search?q=материал', '/api/materials/search?exam_type=oge&page=3',
+                '/api/materials/search?q=текст&category=theory&page=1000'):
+        client.get(url)
+
+    material = client.post('/api/tutor/materials', json={'title': 'План', 'file_type': 'txt'}).get_json()
+    material_id = material.get('material_id')
+    client.get(f'/api/materials/{material_id}/preview')
+    client.post(f'/api/materials/{material_id}/download-stats')
+    client.delete(f'/api/tutor/materials/{material_id}')
+
+    created = client.post('/api/tutor/create-student', json={
+        'last_name': 'Проверка', 'first_name': 'План', 'birth_date': '2010-01-01', 'exam_type': 'oge',
+        'username': 'plan_check_student', 'password': 'x', 'lesson_price': 1000,
+        'day_of_week': 'monday', 'lesson_time': '10:00'}).get_json()
+    new_student_id = created.get('student_id')
+    client.post('/api/tutor/schedule/create', json={
+        'student_id': new_student_id, 'start_time': '12:00', 'end_time': '13:00',
+        'lesson_type': 'single', 'lesson_date': today})
+    client.delete(f'/api/tutor/delete-student/{new_student_id}')
+    client.post('/api/logout')
+
+    client.post('/api/login', json={'username': student['username'], 'password': student['password']})
+    job_id = db.create_test_job(student['id'], 'z5', 'Материал')
+    client.get('/api/schedule')
+    client.get('/api/materials')
+    client.get('/api/materials/search?q=материал&exam_type=ege')
+    client.get(f'/api/tests/jobs/{job_id}')
+    client.get('/api/tests/bank')
+    client.get('/api/tests/pregeneration')
+    client.post('/api/tests/assemble', json={'material_name': 'z5', 'count': 3})
+    # Несуществующий материал: проверка доступа без обращения к модели
+    client.post('/api/tests/jobs', json={'material_id': 10 ** 9})
+    client.get('/api/tests/1')
+
+    # Методы Database, которые не вызываются маршрутами напрямую
+    tutor_id, student_id = tutor['id'], student['id']
+    db.get_monthly_income(tutor_id, 2025, 3)
+    db.get_yearly_income(tutor_id, 2025)
+    db.get_average_lesson_price(tutor_id)
+    db.get_monthly_income_forecast(tutor_id, 2025, 3)
+    db.get_active_students_count(tutor_id)
+    db.get_student_lesson_count(student_id)
+    db.calculate_student_progress(student_id)
+    db.get_schedule_for_date(tutor_id, today)
+    db.get_schedule_statistics(tutor_id, today)
+    db.get_student_schedule(student_id)
+    db.get_tutor_schedule(tutor_id)
+    db.create_schedule_entry(tutor_id, student_id, 'friday', '18:00', '19:00')
+    db.start_test_job(job_id, owner='plans')
+    db.renew_test_job_leases('plans')
+    db.finish_test_job(job_id, result='1. Вопрос', owner='plans')
+    db.requeue_unfinished_test_jobs()
+    db.save_cached_test('0' * 64, 'model', 'z5', '1. Вопрос')
+    db.get_cached_test('0' * 64)
+    db.invalidate_cached_tests('z5')
+    question = {'text': 'Сколько бит в байте?', 'options': {'A': '4', 'B': '8', 'C': '16', 'D': '2'},
+                'correct': 'B', 'normalized': 'байте бит в сколько'}
+    test_id = db.save_generated_test([question], material_name='z5', created_by=tutor_id)
+    db.set_test_job_test(job_id, test_id)
+    db.save_generated_test([question], material_id=1)
+    db.assemble_test('z5', count=5)
+    db.assemble_test(material_id=1, count=5)
+    db.get_test(test_id)
+    db.get_question_bank_summary()
+    db.get_text_materials()
+    db.get_material_text(1)
+    db.get_material_file(1)
+    db.get_pending_text_materials()
+    db.find_text_by_hash('0' * 64)
+    db.save_material_text([1], '0' * 64, 'done', 'Текст')
+    db.get_test_job_counts()
+    db.get_test_job_material(job_id, student['id'])
+    db.save_session('bench' * 8, '{}', 0)
+    db.get_session('bench' * 8)
+    db.get_session_version('bench' * 8)
+    db.delete_expired_sessions()
+    db.delete_session('bench' * 8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка планов запросов на синтетической базе')
+    # План зависит от статистики таблиц (ANALYZE) - проверяем на базе рабочего размера
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='large')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'plans.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, info = generate(db_path, PRESETS[args.preset])
+
+        os.environ['TUTOR_DB_PATH'] = db_path
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as app_module
+        db = app_module.db
+
+        statements = []
+        # Трассировка всех соединений пула, созданных после этой точки
+        db.close_all()
+        open_connection = db.get_connection
+
+        def traced_connection():
+            connection = open_connection()
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        db.get_connection = traced_connection
+
+        tutor, student = pick_accounts(db, info)
+        statements.clear()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            exercise_app(app_module, tutor, student)
+
+        checked = {}
+        for statement in statements:
+            statement = normalize(statement)
+            if CHECKED_STATEMENT.match(statement):
+                checked.setdefault(statement, None)
+
+        failures = []
+        with contextlib.closing(sqlite3.connect(db_path)) as connection:
+            tables = {row[0].lower() for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for statement in checked:
+                if any(pattern.search(statement) for pattern, _ in ALLOWED_FULL_SCANS):
+                    continue
+                scans = full_scans(connection, statement, tables)
+                if scans:
+                    failures.append((statement, scans))
+
+        db.close_all()
+
+    print(f"Проверено выражений: {len(checked)}")
+    for statement, scans in failures:
+        print(f"\n❌ Полное сканирование {', '.join(scans)}:\n   {statement[:400]}")
+    if failures:
+        print(f"\nВыражений с полным сканированием: {len(failures)}")
+        return 1
+    print("✅ Полных сканирований не найдено")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
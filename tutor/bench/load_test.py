@@ -0,0 +1,256 @@
+"""Нагрузочный тест генерации тестов от HTTP-запроса до готового теста.
+
+Виртуальные ученики одновременно открывают /tests/1 (страница создает
+задачу POST /api/tests/jobs с material_name=z5 и опрашивает ее) или
+отправляют /generate-test со своим материалом. Модель заменяет заглушка
+bench.mock_llm (или --llm-url, несколько серверов - через запятую).
+Для каждой комбинации настроек повторов и очереди (--retries,
+--max-in-flight, --max-queue) печатает p50/p95/p99 времени до готового
+теста, пропускную способность и причины отказов. --backends N запускает
+N заглушек; --max-in-flight задается на один сервер.
+
+Запуск из директории tutor/:
+    python -m bench.load_test --concurrency 30 --retries 0,2 --max-in-flight 1,2,4
+    python -m bench.load_test --scenario generate --error-503 0.2 --timeout-rate 0.05 --read-timeout 3
+    python -m bench.load_test --scenario generate --backends 3 --concurrency 30
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from bench.mock_llm import add_mock_arguments, mock_from_args
+from bench.run_benchmarks import git_commit
+from bench.synthetic import generate
+
+SCENARIOS = ('tests1', 'generate', 'mixed')
+POLL_SECONDS = 0.05
+
+# Причина отказа по тексту ошибки задачи (llm_client сообщает ошибки строками с ❌)
+FAILURE_KINDS = (
+    (re.compile(r'ответил (\d{3})'), 'http_{0}'),
+    (re.compile(r'Внутренняя ошибка LM Studio \((\d{3})\)'), 'http_{0}'),
+    (re.compile(r'Таймаут'), 'timeout'),
+    (re.compile(r'временно недоступен'), 'circuit_open'),
+    (re.compile(r'Ошибка подключения'), 'connection'),
+)
+
+
+def failure_kind(error):
+    for pattern, kind in FAILURE_KINDS:
+        match = pattern.search(error or '')
+        if match:
+            return kind.format(*match.groups())
+    return 'other'
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def run_user(client, scenario, index, args, results):
+    """Один запрос виртуального ученика: создание задачи и ожидание результата"""
+    started = time.perf_counter()
+    if scenario == 'tests1':
+        client.get('/tests/1')
+        response = client.post('/api/tests/jobs', json={'material_name': 'z5', 'force_fresh': args.fresh})
+    else:
+        # Свой материал у каждого ученика - модель вызывается для каждого запроса
+        text = f'Материал ученика номер {index}. ' + ' '.join(f'понятие{index}x{i}' for i in range(40))
+        response = client.post('/generate-test', json={'text': text, 'material_name': None})
+
+    if response.status_code == 429:
+        results.append({'scenario': scenario, 'outcome': 'rejected_429',
+                        'latency': time.perf_counter() - started})
+        return
+    data = response.get_json(silent=True) or {}
+    status_url = data.get('status_url')
+    if response.status_code not in (200, 202) or not status_url:
+        results.append({'scenario': scenario, 'outcome': f'http_{response.status_code}',
+                        'latency': time.perf_counter() - started})
+        return
+
+    deadline = started + args.deadline
+    while time.perf_counter() < deadline:
+        job = client.get(status_url).get_json()['job']
+        if job['status'] == 'done':
+            results.append({'scenario': scenario, 'outcome': 'ok', 'from_cache': bool(job['from_cache']),
+                            'latency': time.perf_counter() - started})
+            return
+        if job['status'] == 'failed':
+            results.append({'scenario': scenario, 'outcome': failure_kind(job['error']),
+                            'latency': time.perf_counter() - started})
+            return
+        time.sleep(POLL_SECONDS)
+    results.append({'scenario': scenario, 'outcome': 'deadline', 'latency': time.perf_counter() - started})
+
+
+def run_combination(app_module, clients, mocks, llm_url, retries, max_in_flight, max_queue, args):
+    """Прогон с одной комбинацией настроек; возвращает сводку"""
+    from llm.admission import AdmissionController
+    from llm.llm_client import LLMClient
+    from services.test_job_service import TestJobService
+
+    # Новые клиент, очередь и обработчик задач, чтобы счетчики и размыкатель не переходили между прогонами
+    client = LLMClient(url=llm_url, max_retries=retries, read_timeout=args.read_timeout,
+                       backoff_base=args.backoff_base)
+    admission = AdmissionController(max_in_flight=max_in_flight * len(client.router.backends), max_queue=max_queue)
+    app_module.test_job_service = TestJobService(app_module.db, client=client, admission=admission)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app_module.db.invalidate_cached_tests()
+    for mock in mocks:
+        mock.reset_stats()
+
+    results = []
+    barrier = threading.Barrier(len(clients))
+
+    def user(index, test_client):
+        barrier.wait()
+        for request_number in range(args.requests_per_user):
+            scenario = args.scenario
+            if scenario == 'mixed':
+                scenario = SCENARIOS[(index + request_number) % 2]
+            run_user(test_client, scenario, index * args.requests_per_user + request_number, args, results)
+
+    threads = [threading.Thread(target=user, args=(index, test_client)) for index, test_client in enumerate(clients)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(result['latency'] for result in results if result['outcome'] == 'ok')
+    outcomes = {}
+    for result in results:
+        outcomes[result['outcome']] = outcomes.get(result['outcome'], 0) + 1
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    model_requests = {}
+    for mock in mocks:
+        for key, count in mock.stats.items():
+            model_requests[key] = model_requests.get(key, 0) + count
+
+    return {
+        'backends': len(client.router.backends),
+        'retries': retries,
+        'max_in_flight': max_in_flight,
+        'max_queue': max_queue,
+        'requests': len(results),
+        'ok': outcomes.get('ok', 0),
+        'from_cache': sum(1 for result in results if result.get('from_cache')),
+        'failures': {outcome: count for outcome, count in outcomes.items() if outcome != 'ok'},
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(outcomes.get('ok', 0) / elapsed, 3) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'coalesced': app_module.test_job_service.flights.stats()['coalesced'],
+        'model_requests': model_requests or None,
+        'model_max_concurrency': [mock.max_concurrency for mock in mocks] or None,
+        'backend_requests': [backend['requests'] for backend in client.router.stats()],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест генерации тестов через заглушку LM Studio')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='tests1',
+                        help='tests1 - все открывают /tests/1, generate - /generate-test со своим материалом')
+    parser.add_argument('--concurrency', type=int, default=20, help='одновременных учеников')
+    parser.add_argument('--requests-per-user', type=int, default=1)
+    parser.add_argument('--fresh', action='store_true', help='tests1 без кэша (force_fresh)')
+    parser.add_argument('--retries', default='2', help='значения max_retries через запятую')
+    parser.add_argument('--max-in-flight', default='2', help='значения LMSTUDIO_MAX_IN_FLIGHT через запятую')
+    parser.add_argument('--max-queue', default='30', help='значения LMSTUDIO_MAX_QUEUE через запятую')
+    parser.add_argument('--read-timeout', type=float, default=10.0, help='таймаут чтения клиента, с')
+    parser.add_argument('--backoff-base', type=float, default=0.5)
+    parser.add_argument('--deadline', type=float, default=300.0, help='сколько ученик ждет тест, с')
+    parser.add_argument('--llm-url', help='свои серверы вместо заглушки (через запятую)')
+    parser.add_argument('--backends', type=int, default=1, help='сколько заглушек запустить')
+    parser.add_argument('--output', help='JSON с результатами')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mocks = [] if args.llm_url else [mock_from_args(args) for _ in range(args.backends)]
+    llm_url = args.llm_url or ','.join(mock.start() for mock in mocks)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'load.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, info = generate(db_path, {'tutors': 1, 'students': args.concurrency, 'schedule': 0,
+                                         'single_lessons': 0, 'lessons': 0, 'income': 0, 'materials': 0,
+                                         'progress': 0})
+            os.environ['TUTOR_DB_PATH'] = db_path
+            import app as app_module
+
+        with app_module.db.connection() as connection:
+            usernames = [row[0] for row in connection.execute(
+                "SELECT username FROM users WHERE role = 'student' AND username LIKE 'bench_%' ORDER BY id")]
+        clients = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for username in usernames[:args.concurrency]:
+                client = app_module.app.test_client()
+                client.post('/api/login', json={'username': username, 'password': info['password']})
+                clients.append(client)
+
+        print(f"🤖 Модель: {llm_url}; учеников: {len(clients)}, сценарий {args.scenario}")
+        summaries = []
+        for retries, max_in_flight, max_queue in itertools.product(
+                parse_list(args.retries), parse_list(args.max_in_flight), parse_list(args.max_queue)):
+            summary = run_combination(app_module, clients, mocks, llm_url, retries, max_in_flight, max_queue, args)
+            summaries.append(summary)
+            failures = ', '.join(f'{kind} {count}' for kind, count in sorted(summary['failures'].items())) or '-'
+            print(f"retries={retries} in_flight={max_in_flight} queue={max_queue}: "
+                  f"ok {summary['ok']}/{summary['requests']}  p50 {summary['p50_ms']}  p95 {summary['p95_ms']}  "
+                  f"p99 {summary['p99_ms']} мс  {summary['throughput_rps']} тест/с  отказы: {failures}")
+        app_module.db.close_all()
+
+    for mock in mocks:
+        mock.stop()
+
+    if args.output:
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'scenario': args.scenario,
+                'concurrency': args.concurrency,
+                'requests_per_user': args.requests_per_user,
+                'llm_url': llm_url,
+                'mock': None if args.llm_url else {
+                    'latency': args.latency, 'tokens_per_second': args.tokens_per_second,
+                    'error_503': args.error_503, 'error_500': args.error_500, 'timeout_rate': args.timeout_rate,
+                },
+            },
+            'results': summaries,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
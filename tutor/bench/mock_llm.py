@@ -0,0 +1,246 @@
+"""Заглушка LM Studio: OpenAI-совместимый сервер chat/completions без модели.
+
+Отвечает тестом в формате build_prompt (вопросы по словам материала),
+имитирует время обработки промпта (--latency), скорость генерации
+(--tokens-per-second), ошибки 503/500 и зависания дольше таймаута клиента.
+Поддерживает stream: true (SSE) и GET /v1/models.
+
+Запуск из директории tutor/ вместо LM Studio:
+    python -m bench.mock_llm --port 12345 --latency 1 --tokens-per-second 40 --error-503 0.1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL = 'mock/test-generator'
+QUESTIONS_REQUESTED = re.compile(r'Создай (\d+)(?:\s*[–-]\s*(\d+))?')
+MATERIAL_SECTION = re.compile(r'Материал для анализа:\s*(.*?)\s*Формат вывода:', re.DOTALL)
+MATERIAL_WORD = re.compile(r'[^\W\d_]{4,}')
+TOKEN = re.compile(r'\S+\s*')
+
+
+def build_test(prompt, default_questions=7):
+    """Тест в формате build_prompt: столько вопросов, сколько просит промпт,
+    по разным словам материала (чтобы вопросы не считались повторами)"""
+    requested = QUESTIONS_REQUESTED.search(prompt)
+    count = int(requested.group(2) or requested.group(1)) if requested else default_questions
+    section = MATERIAL_SECTION.search(prompt)
+    words = list(dict.fromkeys(word.lower() for word in MATERIAL_WORD.findall(section.group(1) if section else prompt)))
+    words = words or ['материал']
+
+    questions = []
+    for number in range(1, count + 1):
+        term = words[(number - 1) % len(words)]
+        options = [words[(number + shift) % len(words)] for shift in range(4)]
+        questions.append(
+            f'{number}. Что означает термин «{term}» в материале?\n'
+            f'   A) {term}\n   B) {options[1]}\n   C) {options[2]}\n   D) {options[3]}\n'
+            f'   Правильный ответ: A')
+    return '\n\n'.join(questions)
+
+
+class MockLLMServer:
+    """Сервер заглушки в фоновом потоке; url - адрес chat/completions.
+
+    Вероятности error_503, error_500 и timeout_rate задают долю запросов,
+    которые получат 503 (с Retry-After), 500 или не получат ответа hang_seconds
+    секунд. stats - счетчики запросов и исходов, max_concurrency - наибольшее
+    число одновременно обрабатываемых запросов.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.5, tokens_per_second=100.0, error_503=0.0,
+                 error_500=0.0, timeout_rate=0.0, hang_seconds=30.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_503 = error_503
+        self.error_500 = error_500
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.reset_stats()
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1/chat/completions'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-llm', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'requests': 0, 'streamed': 0, 'ok': 0, 'http_503': 0, 'http_500': 0, 'timeout': 0}
+            self.max_concurrency = 0
+
+    def outcome(self):
+        """Исход очередного запроса: ok, http_503, http_500 или timeout"""
+        with self._lock:
+            roll = self._random.random()
+        for kind, rate in (('http_503', self.error_503), ('http_500', self.error_500),
+                           ('timeout', self.timeout_rate)):
+            if roll < rate:
+                return kind
+            roll -= rate
+        return 'ok'
+
+    def record(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def enter(self):
+        with self._lock:
+            self._in_flight += 1
+            self.max_concurrency = max(self.max_concurrency, self._in_flight)
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/v1/models':
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+        self._send_json(200, {'object': 'list', 'data': [{'id': MODEL, 'object': 'model'}]})
+
+    def do_POST(self):
+        mock = self.server.mock
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+            return
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        mock.enter()
+        try:
+            self._complete(mock, payload)
+        finally:
+            mock.leave()
+
+    def _complete(self, mock, payload):
+        mock.record('requests')
+        outcome = mock.outcome()
+        mock.record(outcome)
+        if outcome == 'http_503':
+            self._send_json(503, {'error': {'message': 'Model is loading'}},
+                            {'Retry-After': str(mock.retry_after)})
+            return
+        if outcome == 'http_500':
+            self._send_json(500, {'error': {'message': 'Internal error'}})
+            return
+        if outcome == 'timeout':
+            # Клиент получит таймаут чтения; соединение потом просто закрывается
+            time.sleep(mock.hang_seconds)
+            self.close_connection = True
+            return
+
+        prompt = '\n'.join(message.get('content', '') for message in payload.get('messages', []))
+        tokens = TOKEN.findall(build_test(prompt))
+        time.sleep(mock.latency)
+        delay = 1.0 / mock.tokens_per_second if mock.tokens_per_second > 0 else 0.0
+
+        if not payload.get('stream'):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion',
+                'model': payload.get('model', MODEL),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': len(TOKEN.findall(prompt)), 'completion_tokens': len(tokens)},
+            })
+            return
+
+        mock.record('streamed')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for token in tokens:
+                time.sleep(delay)
+                chunk = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def add_mock_arguments(parser):
+    """Параметры заглушки (общие с bench.load_test)"""
+    parser.add_argument('--latency', type=float, default=0.5, help='обработка промпта, с')
+    parser.add_argument('--tokens-per-second', type=float, default=100.0)
+    parser.add_argument('--error-503', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--error-500', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='доля запросов без ответа')
+    parser.add_argument('--hang-seconds', type=float, default=30.0, help='сколько длится "зависание"')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def mock_from_args(args, host='127.0.0.1', port=0):
+    return MockLLMServer(host, port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                         error_503=args.error_503, error_500=args.error_500, timeout_rate=args.timeout_rate,
+                         hang_seconds=args.hang_seconds, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка LM Studio (OpenAI-совместимый chat/completions)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12345)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock = mock_from_args(args, args.host, args.port)
+    print(f"🤖 Заглушка LM Studio: {mock.url}")
+    try:
+        mock.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.httpd.server_close()
+        print(f"📊 {mock.stats}, одновременно до {mock.max_concurrency}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""Бенчмарк всех публичных методов Database и JSON-маршрутов app.py.
+
+Скрипт генерирует синтетическую базу (или использует готовую, --db),
+замеряет каждый вызов и сохраняет перцентили задержки в JSON, чтобы
+результаты разных коммитов можно было сравнить (--compare).
+
+Запуск из директории tutor/:
+    python -m bench.run_benchmarks --preset small
+    python -m bench.run_benchmarks --db bench.db --compare bench/results/abc1234.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from bench.synthetic import PRESETS, generate, pick_accounts
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Методы пула соединений замеряются косвенно, через остальные методы
+NOT_BENCHMARKED = {'get_connection', 'connect', 'connection', 'close_all'}
+
+# Маршруты без бенчмарка и причина
+ENDPOINTS_NOT_BENCHMARKED = {
+    '/api/logout': 'завершает сессию клиента бенчмарка',
+    '/api/tutor/upload-material': 'сохраняет файлы в uploads/materials',
+    '/api/tests/jobs': 'отправляет задачу модели (LM Studio)',
+}
+
+# Разница p50 меньше этой величины считается шумом при сравнении
+MIN_DELTA_MS = 0.1
+
+DAY = '2025-03-12'
+
+
+def database_benchmarks(db, tutor, student):
+    """Имя -> вызов для каждого публичного метода Database"""
+    tutor_id, student_id = tutor['id'], student['id']
+    counter = itertools.count()
+
+    job_id = db.create_test_job(tutor_id, 'z5', 'Материал')
+
+    def bank_question(i):
+        text = f'Вопрос банка номер {i} о материале'
+        return {'text': text, 'options': {'A': '1', 'B': '2', 'C': '3', 'D': '4'}, 'correct': 'A',
+                'normalized': ' '.join(sorted(set(text.lower().split())))}
+
+    bank_counter = itertools.count()
+    test_id = db.save_generated_test([bank_question(next(bank_counter)) for _ in range(50)], material_name='z5')
+
+    def run_test_job():
+        running_job_id = db.create_test_job(tutor_id, 'z5', 'Материал')
+        db.start_test_job(running_job_id)
+        db.finish_test_job(running_job_id, result='1. Вопрос')
+
+    def create_student():
+        i = next(counter)
+        db.create_student(f'bench_new_{os.getpid()}_{i}', 'x', 'Новый', str(i), tutor_id, '', 'oge', 1000,
+                          'monday', '10:00')
+
+    return {
+        'authenticate_user': lambda: db.authenticate_user(tutor['username'], tutor['password']),
+        'create_student': create_student,
+        'get_tutor_students': lambda: db.get_tutor_students(tutor_id),
+        'get_student_schedule': lambda: db.get_student_schedule(student_id),
+        'get_tutor_schedule': lambda: db.get_tutor_schedule(tutor_id),
+        'calculate_student_progress': lambda: db.calculate_student_progress(student_id),
+        'get_student_lesson_count': lambda: db.get_student_lesson_count(student_id),
+        'get_monthly_income': lambda: db.get_monthly_income(tutor_id, 2025, 3),
+        'get_yearly_income': lambda: db.get_yearly_income(tutor_id, 2025),
+        'get_average_lesson_price': lambda: db.get_average_lesson_price(tutor_id),
+        'get_monthly_income_forecast': lambda: db.get_monthly_income_forecast(tutor_id, 2025, 3),
+        'get_income_statistics': lambda: db.get_income_statistics(tutor_id),
+        'get_income_statistics[range]': lambda: db.get_income_statistics(tutor_id, '2024-01-01', '2024-12-31'),
+        'get_active_students_count': lambda: db.get_active_students_count(tutor_id),
+        'get_tutor_quick_stats': lambda: db.get_tutor_quick_stats(tutor_id),
+        'rebuild_tutor_stats': db.rebuild_tutor_stats,
+        'get_tutor_students_for_schedule': lambda: db.get_tutor_students_for_schedule(tutor_id),
+        'create_schedule_entry': lambda: db.create_schedule_entry(tutor_id, student_id, 'friday', '18:00', '19:00'),
+        'get_schedule_for_date': lambda: db.get_schedule_for_date(tutor_id, DAY),
+        'get_schedule_statistics': lambda: db.get_schedule_statistics(tutor_id, DAY),
+        'get_schedule_day_view': lambda: db.get_schedule_day_view(tutor_id, DAY),
+        'get_schedule_for_range': lambda: db.get_schedule_for_range(tutor_id, '2025-03-10', '2025-03-16'),
+        'create_test_job': lambda: db.create_test_job(tutor_id, 'z5', 'Материал'),
+        'get_test_job': lambda: db.get_test_job(job_id),
+        'get_test_job_material': lambda: db.get_test_job_material(job_id, tutor_id),
+        'save_session': lambda: db.save_session(f'bench-session-{next(counter)}', '{"user_id": 1}', 0),
+        'get_session': lambda: db.get_session('bench-session-0'),
+        'get_session_version': lambda: db.get_session_version('bench-session-0'),
+        'delete_session': lambda: db.delete_session(f'bench-missing-{next(counter)}'),
+        'delete_expired_sessions': db.delete_expired_sessions,
+        'start_test_job+finish_test_job': run_test_job,
+        'requeue_unfinished_test_jobs': db.requeue_unfinished_test_jobs,
+        'renew_test_job_leases': lambda: db.renew_test_job_leases('bench'),
+        'save_cached_test': lambda: db.save_cached_test(f'{next(counter):064d}', 'model', 'z5', '1. Вопрос' * 200),
+        'get_cached_test': lambda: db.get_cached_test('0' * 64),
+        'invalidate_cached_tests': lambda: db.invalidate_cached_tests('bench_missing'),
+        'save_generated_test': lambda: db.save_generated_test(
+            [bank_question(next(bank_counter)) for _ in range(7)], material_name='z5'),
+        'assemble_test': lambda: db.assemble_test('z5', count=7),
+        'get_test': lambda: db.get_test(test_id),
+        'get_question_bank_summary': db.get_question_bank_summary,
+        'get_text_materials': db.get_text_materials,
+        'search_materials': lambda: db.search_materials(tutor_id, 'tutor', 'материал 15'),
+        'search_materials[list]': lambda: db.search_materials(tutor_id, 'tutor', exam_type='oge', offset=20),
+        'search_materials[student]': lambda: db.search_materials(student_id, 'student', 'текст', category='theory'),
+        'get_material_text': lambda: db.get_material_text(1),
+        'get_material_file': lambda: db.get_material_file(1),
+        'get_pending_text_materials': db.get_pending_text_materials,
+        'find_text_by_hash': lambda: db.find_text_by_hash(f'{1:064x}'),
+        'save_material_text': lambda: db.save_material_text([1], f'{1:064x}', 'done', 'Текст материала 1. ' * 20),
+        'get_test_job_counts': db.get_test_job_counts,
+        'set_test_job_test': lambda: db.set_test_job_test(job_id, test_id),
+        'create_tables': db.create_tables,
+        'migrate': db.migrate,
+    }
+
+
+def endpoint_benchmarks(client, tutor):
+    """Имя -> вызов для JSON-маршрутов app.py (клиент уже вошел как репетитор)"""
+    counter = itertools.count()
+
+    def create_student():
+        i = next(counter)
+        client.post('/api/tutor/create-student', json={
+            'last_name': 'Бенч', 'first_name': str(i), 'birth_date': '2010-01-01', 'exam_type': 'oge',
+            'username': f'bench_api_{os.getpid()}_{i}', 'password': 'x', 'lesson_price': 1000,
+            'day_of_week': 'monday', 'lesson_time': '10:00'})
+
+    def create_material():
+        client.post('/api/tutor/materials', json={'title': 'Бенч', 'file_type': 'txt'})
+
+    benchmarks = {
+        'POST /api/login': lambda: client.post('/api/login', json={
+            'username': tutor['username'], 'password': tutor['password']}),
+        'POST /api/tutor/create-student': create_student,
+        'POST /api/tutor/materials': create_material,
+        'POST /api/tutor/schedule': lambda: client.post('/api/tutor/schedule', json={
+            'student_id': tutor['student_id'], 'day_of_week': 'friday', 'start_time': '18:00', 'end_time': '19:00'}),
+        'POST /api/tutor/schedule/create': lambda: client.post('/api/tutor/schedule/create', json={
+            'student_id': tutor['student_id'], 'start_time': '12:00', 'end_time': '13:00',
+            'lesson_type': 'single', 'lesson_date': DAY}),
+        'POST /api/tests/assemble': lambda: client.post('/api/tests/assemble', json={'material_name': 'z5'}),
+        'DELETE /api/tests/cache?material_name=bench_missing':
+            lambda: client.delete('/api/tests/cache?material_name=bench_missing'),
+    }
+    for url in ('/api/check-auth', '/api/schedule', '/api/tutor/students', '/api/tutor/income-stats',
+                '/api/tutor/income-stats?from=2024-01-01&to=2024-12-31', '/api/tutor/income-details',
+                '/api/tutor/quick-stats', '/api/tutor/schedule/students', f'/api/tutor/schedule/date/{DAY}',
+                '/api/tutor/schedule/range?from=2025-03-10&to=2025-03-16', '/api/materials', '/api/tests/bank',
+                '/api/tests/pregeneration', '/api/tests/1', '/api/materials/search',
+                '/api/materials/search?q=материал 15', '/api/materials/search?q=текст&exam_type=oge&category=theory&page=2'):
+        benchmarks[f'GET {url}'] = lambda url=url: client.get(url)
+    return benchmarks
+
+
+def measure(db, func, iterations, warmup):
+    """Задержки (мс) и число SQL-выражений одного вызова"""
+    for _ in range(warmup):
+        func()
+
+    statements = []
+    with db.connection() as connection:
+        connection.set_trace_callback(statements.append)
+        try:
+            func()
+        finally:
+            connection.set_trace_callback(None)
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, len(statements)
+
+
+def summarize(timings, statements):
+    percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'iterations': len(timings),
+        'statements': statements,
+        'min_ms': round(min(timings), 4),
+        'mean_ms': round(statistics.fmean(timings), 4),
+        'p50_ms': round(percentiles[49], 4),
+        'p90_ms': round(percentiles[89], 4),
+        'p95_ms': round(percentiles[94], 4),
+        'p99_ms': round(percentiles[98], 4),
+        'max_ms': round(max(timings), 4),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def uncovered(app_module, db, methods, endpoints):
+    """Публичные методы Database и JSON-маршруты без бенчмарка"""
+    benchmarked = {part for name in methods for part in name.split('[')[0].split('+')}
+    missing = [f'Database.{name}' for name in dir(db)
+               if not name.startswith('_') and callable(getattr(db, name))
+               and name not in NOT_BENCHMARKED and name not in benchmarked]
+    covered = {name.split(' ', 1)[1].split('?')[0] for name in endpoints}
+    for rule in app_module.app.url_map.iter_rules():
+        if (rule.rule.startswith('/api/') and '<' not in rule.rule and rule.rule not in covered
+                and rule.rule not in ENDPOINTS_NOT_BENCHMARKED):
+            missing.append(rule.rule)
+    return sorted(missing)
+
+
+def compare(results, baseline_path, threshold):
+    """Печать замедлений относительно сохраненного результата"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    regressions = 0
+    print(f"\nСравнение с {baseline_path} (коммит {baseline['meta'].get('commit')}):")
+    for group, entries in results.items():
+        for name, entry in entries.items():
+            old = baseline['results'].get(group, {}).get(name)
+            if not old or not old['p50_ms']:
+                continue
+            ratio = entry['p50_ms'] / old['p50_ms']
+            if abs(entry['p50_ms'] - old['p50_ms']) < MIN_DELTA_MS:
+                continue
+            if ratio >= threshold:
+                regressions += 1
+                print(f"   ❌ {name}: p50 {old['p50_ms']:.3f} -> {entry['p50_ms']:.3f} мс (x{ratio:.2f})")
+            elif ratio <= 1 / threshold:
+                print(f"   ✅ {name}: p50 {old['p50_ms']:.3f} -> {entry['p50_ms']:.3f} мс (x{ratio:.2f})")
+    print(f"Замедлений больше x{threshold}: {regressions}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк методов Database и JSON-маршрутов')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--db', help='готовая база (python -m bench.synthetic); будет изменена')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help='файл результатов (по умолчанию bench/results/<коммит>.json)')
+    parser.add_argument('--compare', help='предыдущий файл результатов')
+    parser.add_argument('--threshold', type=float, default=1.25, help='порог замедления p50 для --compare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, 'bench.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            if args.db:
+                info = {'sizes': None, 'password': 'bench'}
+            else:
+                _, info = generate(db_path, PRESETS[args.preset])
+
+            os.environ['TUTOR_DB_PATH'] = db_path
+            import app as app_module
+        db = app_module.db
+        tutor, student = pick_accounts(db, info)
+        tutor['student_id'] = student['id']
+
+        client = app_module.app.test_client()
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.post('/api/login', json={'username': tutor['username'], 'password': tutor['password']})
+
+        methods = database_benchmarks(db, tutor, student)
+        endpoints = endpoint_benchmarks(client, tutor)
+        results = {'database': {}, 'endpoints': {}}
+        for group, benchmarks in (('database', methods), ('endpoints', endpoints)):
+            for name, func in benchmarks.items():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    timings, statements = measure(db, func, args.iterations, args.warmup)
+                results[group][name] = summarize(timings, statements)
+                entry = results[group][name]
+                print(f"{name:<60} p50 {entry['p50_ms']:>9.3f}  p95 {entry['p95_ms']:>9.3f}  "
+                      f"p99 {entry['p99_ms']:>9.3f} мс  SQL {statements}")
+
+        missing = uncovered(app_module, db, methods, endpoints)
+        db.close_all()
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'preset': None if args.db else args.preset,
+            'db': args.db,
+            'sizes': info['sizes'],
+            'iterations': args.iterations,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'results': results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты сохранены в {output}")
+
+    if missing:
+        print(f"⚠️ Без бенчмарка: {', '.join(missing)}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
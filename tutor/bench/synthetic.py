@@ -0,0 +1,225 @@
+"""Генератор синтетических баз данных с воспроизводимым (seed) содержимым.
+
+Используется бенчмарками и проверкой планов запросов, чтобы поведение
+Database можно было оценить на объемах больше тестовой базы.
+
+Запуск из директории tutor/:
+    python -m bench.synthetic bench.db --preset large
+    python -m bench.synthetic bench.db --students 50000 --income 200000
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from database.database import Database, WEEKDAYS
+
+# Готовые размеры баз (количество строк по таблицам)
+PRESETS = {
+    'small': {
+        'tutors': 20,
+        'students': 2000,
+        'schedule': 10000,
+        'single_lessons': 2000,
+        'lessons': 50000,
+        'income': 20000,
+        'materials': 2000,
+        'progress': 2000,
+    },
+    'medium': {
+        'tutors': 200,
+        'students': 20000,
+        'schedule': 100000,
+        'single_lessons': 20000,
+        'lessons': 200000,
+        'income': 100000,
+        'materials': 20000,
+        'progress': 20000,
+    },
+    'large': {
+        'tutors': 1000,
+        'students': 100000,
+        'schedule': 1000000,
+        'single_lessons': 100000,
+        'lessons': 1000000,
+        'income': 500000,
+        'materials': 100000,
+        'progress': 100000,
+    },
+}
+
+DEFAULT_SIZES = PRESETS['small']
+
+# Пароль всех сгенерированных пользователей
+PASSWORD = 'bench'
+
+CHUNK_SIZE = 10000
+FIRST_DAY = date(2023, 1, 1)
+DAYS_SPAN = 3 * 365
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert(cursor, sql, rows):
+    for chunk in _chunks(rows):
+        cursor.executemany(sql, chunk)
+
+
+def generate(db_path, sizes=None, seed=42):
+    """Создание базы по пути db_path с заданным числом строк в таблицах.
+
+    sizes дополняет DEFAULT_SIZES. Возвращает (Database, сводка), где
+    сводка содержит размеры, id репетиторов, учеников и пароль для входа.
+    """
+    sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+    rnd = random.Random(seed)
+
+    db = Database(db_path)
+    db.migrate()
+
+    def random_day():
+        return FIRST_DAY + timedelta(days=rnd.randrange(DAYS_SPAN))
+
+    with db.connection() as connection:
+        cursor = connection.cursor()
+        # Данные одноразовые - надежность записи не нужна
+        cursor.execute("PRAGMA synchronous = OFF")
+
+        next_user_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+        next_topic_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM topics").fetchone()[0]
+        next_schedule_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM schedule").fetchone()[0]
+
+        tutor_ids = list(range(next_user_id, next_user_id + sizes['tutors']))
+        _insert(cursor, """
+            INSERT INTO users (id, username, password_hash, role, first_name, last_name, lesson_price, is_active)
+            VALUES (?, ?, ?, 'tutor', 'Репетитор', ?, 1500, 1)
+        """, ((tutor_id, f'bench_tutor_{tutor_id}', PASSWORD, str(tutor_id)) for tutor_id in tutor_ids))
+
+        # Одна тема на репетитора
+        topic_by_tutor = {tutor_id: next_topic_id + i for i, tutor_id in enumerate(tutor_ids)}
+        _insert(cursor, "INSERT INTO topics (id, title, created_by) VALUES (?, 'Подготовка', ?)",
+                ((topic_id, tutor_id) for tutor_id, topic_id in topic_by_tutor.items()))
+
+        first_student_id = tutor_ids[-1] + 1 if tutor_ids else next_user_id
+        student_ids = list(range(first_student_id, first_student_id + sizes['students']))
+        tutor_by_student = {student_id: rnd.choice(tutor_ids) for student_id in student_ids}
+        _insert(cursor, """
+            INSERT INTO users (id, username, password_hash, role, first_name, last_name,
+                               exam_type, lesson_price, created_by, is_active, created_at)
+            VALUES (?, ?, ?, 'student', 'Ученик', ?, ?, ?, ?, ?, ?)
+        """, ((student_id, f'bench_student_{student_id}', PASSWORD, str(student_id),
+               rnd.choice(('oge', 'ege')), rnd.choice((1000, 1200, 1500, 2000)),
+               tutor_by_student[student_id], int(rnd.random() < 0.9),
+               f'{random_day().isoformat()} 12:00:00')
+              for student_id in student_ids))
+
+        # Расписание: первые single_lessons записей - разовые занятия.
+        # Для уроков и доходов запоминаем только (id, ученик, тема) каждой записи.
+        schedule_refs = []
+
+        def schedule_row(i):
+            student_id = rnd.choice(student_ids)
+            tutor_id = tutor_by_student[student_id]
+            hour = rnd.randint(9, 20)
+            schedule_refs.append((next_schedule_id + i, student_id, topic_by_tutor[tutor_id]))
+            return (next_schedule_id + i, student_id, tutor_id, topic_by_tutor[tutor_id],
+                    rnd.choice(WEEKDAYS), f'{hour:02d}:00', f'{hour + 1:02d}:00',
+                    'active' if rnd.random() < 0.85 else 'cancelled',
+                    'single' if i < sizes['single_lessons'] else 'regular')
+
+        _insert(cursor, """
+            INSERT INTO schedule (id, student_id, tutor_id, topic_id, day_of_week, start_time, end_time,
+                                  status, lesson_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (schedule_row(i) for i in range(sizes['schedule'] if student_ids else 0)))
+
+        _insert(cursor, "INSERT INTO single_lessons (schedule_id, lesson_date) VALUES (?, ?)",
+                ((ref[0], random_day().isoformat()) for ref in schedule_refs[:sizes['single_lessons']]))
+
+        if schedule_refs:
+            _insert(cursor, """
+                INSERT INTO lessons (schedule_id, topic_id, lesson_date, is_paid) VALUES (?, ?, ?, ?)
+            """, ((ref[0], ref[2], random_day().isoformat(), int(rnd.random() < 0.8))
+                  for ref in (rnd.choice(schedule_refs) for _ in range(sizes['lessons']))))
+
+            def income_row(ref):
+                payment_date = random_day()
+                return (ref[0], ref[1], rnd.choice((1000, 1200, 1500, 2000)), payment_date.isoformat(),
+                        payment_date.strftime('%Y-%m'), rnd.choice(('paid', 'paid', 'paid', 'pending', 'overdue')))
+
+            _insert(cursor, """
+                INSERT INTO income (schedule_id, student_id, amount, payment_date, month_year, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (income_row(rnd.choice(schedule_refs)) for _ in range(sizes['income'])))
+
+        if tutor_ids:
+            _insert(cursor, """
+                INSERT INTO materials (tutor_id, title, description, file_type, file_path, category,
+                                       exam_type, created_at, content_hash, extracted_text, text_status)
+                VALUES (?, ?, ?, 'pdf', '', ?, ?, ?, ?, ?, 'done')
+            """, ((rnd.choice(tutor_ids), f'Материал {i}', f'Описание материала {i}',
+                   rnd.choice(('theory', 'practice', 'tests', 'other')), rnd.choice(('oge', 'ege', 'both')),
+                   f'{random_day().isoformat()} 12:00:00', f'{i:064x}', f'Текст материала {i}. ' * 20)
+                  for i in range(sizes['materials'])))
+
+        # Не больше одной записи прогресса на ученика (UNIQUE(student_id, topic_id))
+        _insert(cursor, """
+            INSERT INTO student_progress (student_id, topic_id, overall_progress) VALUES (?, ?, ?)
+        """, ((student_id, topic_by_tutor[tutor_by_student[student_id]], rnd.randint(0, 100))
+              for student_id in student_ids[:sizes['progress']]))
+
+        connection.commit()
+        cursor.execute("PRAGMA synchronous = NORMAL")
+
+    return db, {'sizes': sizes, 'tutor_ids': tutor_ids, 'student_ids': student_ids, 'password': PASSWORD}
+
+
+def pick_accounts(db, info):
+    """Репетитор с наибольшим числом учеников и его ученик с активным занятием.
+
+    Возвращает два словаря с ключами id, username, password.
+    """
+    with db.connection() as connection:
+        tutor_id = connection.execute("""
+            SELECT created_by FROM users WHERE role = 'student' AND is_active = 1
+            GROUP BY created_by ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()[0]
+        student_id = connection.execute("""
+            SELECT student_id FROM schedule WHERE tutor_id = ? AND status = 'active' LIMIT 1
+        """, (tutor_id,)).fetchone()[0]
+
+    tutor = {'id': tutor_id, 'username': f'bench_tutor_{tutor_id}', 'password': info['password']}
+    student = {'id': student_id, 'username': f'bench_student_{student_id}', 'password': info['password']}
+    return tutor, student
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генерация синтетической базы данных')
+    parser.add_argument('db_path', help='путь к создаваемой базе')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    for table in DEFAULT_SIZES:
+        parser.add_argument(f'--{table.replace("_", "-")}', type=int, dest=table,
+                            help=f'количество строк ({table})')
+    args = parser.parse_args()
+
+    sizes = dict(PRESETS[args.preset])
+    sizes.update({table: getattr(args, table) for table in DEFAULT_SIZES if getattr(args, table) is not None})
+
+    started = time.perf_counter()
+    generate(args.db_path, sizes, seed=args.seed)
+    print(f"✅ База {args.db_path} создана за {time.perf_counter() - started:.1f} с: {sizes}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
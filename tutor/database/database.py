@@ -1,10 +1,229 @@
 import sqlite3
+import html
 import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from typing import Optional, Dict, Any
 
+from utils.text import similar_words
+
+
+# Дни недели в порядке datetime.weekday()
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Максимальная длина периода для get_schedule_for_range
+MAX_SCHEDULE_RANGE_DAYS = 92
+
+# Ожидание блокировки базы: обычное и при применении миграций
+BUSY_TIMEOUT_MS = 5000
+MIGRATION_LOCK_TIMEOUT_MS = 120000
+
+# PRAGMA, которые применяются один раз при создании соединения
+CONNECTION_PRAGMAS = (
+    # busy_timeout первым: переключение в WAL тоже может ждать блокировку
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    # Включает ON DELETE из схемы: удаление слота расписания удаляет его уроки,
+    # разовые занятия и заявки на перенос, удаление материала обнуляет material_id
+    # в банке вопросов. Платежи (income) удалить со слотом или учеником нельзя
+    # (RESTRICT, миграция 0011); приложение слоты отменяет, а учеников деактивирует
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA mmap_size = 268435456",  # 256 МБ
+    "PRAGMA cache_size = -16000",    # ~16 МБ
+)
+
+# Предельный суммарный размер кэша сгенерированных тестов (test_cache)
+TEST_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+# Задача генерации, владелец которой столько секунд не продлевал аренду, считается прерванной
+TEST_JOB_LEASE_SECONDS = 60
+
+# Поиск материалов: слов запроса не больше, веса bm25 для title, description, extracted_text
+MAX_SEARCH_TERMS = 8
+SEARCH_RANK = 'bm25(10.0, 5.0, 1.0)'
+SEARCH_TERM = re.compile(r'\w+')
+# Длина фрагмента с найденными словами в результатах поиска, символов
+SNIPPET_CHARS = 160
+
+# Колонки материала в списке и в результатах поиска (без извлеченного текста)
+MATERIAL_COLUMNS = ('id', 'tutor_id', 'title', 'description', 'file_type', 'file_size', 'file_path', 'category',
+                    'exam_type', 'created_at', 'updated_at', 'download_count', 'text_status')
+
+# Нумерованные миграции схемы: NNNN_описание.sql или NNNN_описание.py
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+# Пересчет tutor_stats с нуля; в остальное время таблицу поддерживают триггеры (миграция 0001)
+REBUILD_TUTOR_STATS_SQL = """
+    INSERT INTO tutor_stats (
+        tutor_id, total_students, oge_students, ege_students, total_lesson_price,
+        weekly_lessons, """ + ', '.join(f'{day}_lessons' for day in WEEKDAYS) + """
+    )
+    SELECT
+        ids.tutor_id,
+        COALESCE(st.total_students, 0),
+        COALESCE(st.oge_students, 0),
+        COALESCE(st.ege_students, 0),
+        COALESCE(st.total_lesson_price, 0),
+        COALESCE(sc.weekly_lessons, 0),
+        """ + ',\n        '.join(f'COALESCE(sc.{day}_lessons, 0)' for day in WEEKDAYS) + """
+    FROM (
+        SELECT created_by as tutor_id FROM users
+        WHERE role = 'student' AND is_active = 1 AND created_by IS NOT NULL
+        UNION
+        SELECT tutor_id FROM schedule WHERE status = 'active'
+    ) ids
+    LEFT JOIN (
+        SELECT created_by,
+               COUNT(*) as total_students,
+               SUM(exam_type IS 'oge') as oge_students,
+               SUM(exam_type IS 'ege') as ege_students,
+               SUM(COALESCE(lesson_price, 0)) as total_lesson_price
+        FROM users
+        WHERE role = 'student' AND is_active = 1 AND created_by IS NOT NULL
+        GROUP BY created_by
+    ) st ON st.created_by = ids.tutor_id
+    LEFT JOIN (
+        SELECT tutor_id,
+               COUNT(*) as weekly_lessons,
+               """ + ',\n               '.join(f"SUM(day_of_week IS '{day}') as {day}_lessons" for day in WEEKDAYS) + """
+        FROM schedule
+        WHERE status = 'active'
+        GROUP BY tutor_id
+    ) sc ON sc.tutor_id = ids.tutor_id
+"""
+
+
+def _load_migrations():
+    """Список миграций [(версия, имя файла, путь)], отсортированный по версии"""
+    migrations = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        prefix, _, rest = name.partition('_')
+        if prefix.isdigit() and rest and name.endswith(('.sql', '.py')):
+            migrations.append((int(prefix), name, os.path.join(MIGRATIONS_DIR, name)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Повторяющиеся номера миграций в {MIGRATIONS_DIR}")
+    return migrations
+
+
+def _split_sql(sql_script):
+    """Разбиение SQL-скрипта на отдельные выражения (с учетом тел триггеров)"""
+    statement = ''
+    for line in sql_script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    # Остаток без точки с запятой допустим только из комментариев
+    remainder = '\n'.join(line for line in statement.splitlines()
+                          if line.strip() and not line.strip().startswith('--'))
+    if remainder:
+        yield statement.strip()
+
+def _snippet(pattern, *texts):
+    """Фрагмент первого из текстов, где есть совпадение с pattern, длиной около
+    SNIPPET_CHARS: HTML с совпадениями в <mark>. Без совпадений - начало описания."""
+    for text in texts:
+        match = pattern.search(text or '')
+        if match:
+            break
+    else:
+        text = texts[1] or ''
+        match = None
+
+    start = 0
+    if match and match.start() > SNIPPET_CHARS // 3:
+        start = match.start() - SNIPPET_CHARS // 3
+        # Фрагмент начинается с целого слова
+        space = text.find(' ', start, match.start())
+        start = space + 1 if space != -1 else start
+    end = min(len(text), start + SNIPPET_CHARS)
+    fragment = text[start:end]
+
+    parts = []
+    position = 0
+    for found in pattern.finditer(fragment):
+        parts.append(html.escape(fragment[position:found.start()]))
+        parts.append(f'<mark>{html.escape(found.group())}</mark>')
+        position = found.end()
+    parts.append(html.escape(fragment[position:]))
+    snippet = ' '.join(''.join(parts).split())
+    return ('…' if start else '') + snippet + ('…' if end < len(text) else '')
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, сообщающий наблюдателю базы время выполнения и выборки выражений"""
+
+    def execute(self, sql, parameters=()):
+        observer = self.connection.database.observer
+        if observer is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.sql = sql
+            observer.on_execute(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        observer = self.connection.database.observer
+        if observer is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.sql = sql
+            observer.on_execute(sql, time.perf_counter() - started)
+
+    def _timed_fetch(self, fetch, *args):
+        observer = self.connection.database.observer
+        if observer is None or not hasattr(self, 'sql'):
+            return fetch(*args)
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            observer.on_fetch(self.sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого - TimedCursor.
+
+    Connection.execute() создает курсор в обход cursor(), поэтому
+    execute/executemany переопределены явно.
+    """
+    database = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
 
 class Database:
-    def __init__(self, db_path='database/tutoring.db'):
+    def __init__(self, db_path='database/tutoring.db', pool_size=8):
         # Если путь относительный, делаем его абсолютным относительно текущего файла
         if not os.path.isabs(db_path):
             current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,81 +236,162 @@ class Database:
             self.db_path = db_path
         print(f"📂 Путь к базе данных: {self.db_path}")
 
+        # Создаем директорию для базы данных один раз, а не при каждом подключении
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        # Пул "теплых" соединений, общий для всех потоков
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # Соединение, выданное текущему потоку, и глубина вложенности
+        self._local = threading.local()
+        # Наблюдатель за SQL и соединениями (например, services.perf_service.PerfService):
+        # on_execute(sql, seconds), on_fetch(sql, seconds), on_checkout(opened)
+        self.observer = None
+
     def get_connection(self):
-        try:
-            # Создаем директорию для базы данных, если её нет
-            db_dir = os.path.dirname(self.db_path)
-            if db_dir:
-                os.makedirs(db_dir, exist_ok=True)
-            connection = sqlite3.connect(self.db_path)
-            connection.row_factory = sqlite3.Row
-            return connection
-        except sqlite3.Error as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return None
+        """Открытие нового соединения с настроенными PRAGMA (используется пулом)"""
+        connection = sqlite3.connect(self.db_path, check_same_thread=False, factory=TimedConnection)
+        connection.database = self
+        connection.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            connection.execute(pragma)
+        return connection
 
     def connect(self):
         return self.get_connection()
 
-    def create_tables(self):
-        """Создание таблиц из SQL скрипта"""
-        connection = self.get_connection()
-        if not connection:
-            print("❌ Не удалось подключиться к базе данных")
+    @contextmanager
+    def connection(self):
+        """Соединение из пула на время блока with.
+
+        Вложенные вызовы в одном потоке получают то же соединение, поэтому
+        методы, вызывающие друг друга, не открывают новых подключений.
+        При возврате в пул незафиксированная транзакция откатывается,
+        как это происходило раньше при connection.close().
+        """
+        local = self._local
+        if getattr(local, 'depth', 0):
+            local.depth += 1
+            try:
+                yield local.connection
+            finally:
+                local.depth -= 1
             return
 
+        opened = False
         try:
-            # Определяем путь к schema.sql относительно текущего файла database.py
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            schema_path = os.path.join(current_dir, 'schema.sql')
-            
-            if not os.path.exists(schema_path):
-                print(f"❌ Файл schema.sql не найден!")
-                print(f"   Искали в: {schema_path}")
-                print(f"   Текущая директория файла: {current_dir}")
-                print(f"   Рабочая директория: {os.getcwd()}")
-                print(f"   Содержимое директории database: {os.listdir(current_dir) if os.path.exists(current_dir) else 'не существует'}")
-                return
-
-            print(f"📁 Чтение {schema_path}...")
-            with open(schema_path, 'r', encoding='utf-8') as f:
-                sql_script = f.read()
-                print(f"📄 Размер скрипта: {len(sql_script)} символов")
-
-            cursor = connection.cursor()
-            cursor.executescript(sql_script)
-            connection.commit()
-            print("✅ Таблицы созданы")
-
-            # Проверка, создалась ли таблица users
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-            table_exists = cursor.fetchone()
-            if table_exists:
-                print("✅ Таблица users существует")
-                # Проверка, создался ли пользователь tutor
-                cursor.execute("SELECT COUNT(*) as count FROM users WHERE username = 'tutor'")
-                result = cursor.fetchone()
-                print(f"👤 Пользователей 'tutor' в базе: {result['count']}")
-            else:
-                print("❌ Таблица users не создана!")
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self.get_connection()
+            opened = True
+        if self.observer is not None:
+            self.observer.on_checkout(opened)
+
+        local.connection = connection
+        local.depth = 1
+        try:
+            yield connection
+        finally:
+            local.depth = 0
+            local.connection = None
+            self._release(connection)
+
+    def _release(self, connection):
+        """Возврат соединения в пул (или закрытие, если пул заполнен)"""
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            self._pool.put_nowait(connection)
+        except (sqlite3.Error, queue.Full):
+            connection.close()
+
+    def close_all(self):
+        """Закрытие всех простаивающих соединений пула"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def create_tables(self):
+        """Создание таблиц (применение всех миграций)"""
+        return self.migrate()
+
+    def migrate(self):
+        """Применение недостающих миграций из database/migrations.
+
+        Версия схемы хранится в PRAGMA user_version, поэтому для актуальной
+        базы запуск стоит одного чтения PRAGMA. Миграции выполняются под
+        BEGIN EXCLUSIVE: если несколько процессов стартуют одновременно,
+        остальные дождутся блокировки и увидят уже обновленную версию.
+        """
+        migrations = _load_migrations()
+        latest_version = migrations[-1][0] if migrations else 0
+
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                if current_version >= latest_version:
+                    return current_version
+
+                # Миграция может занять время - ждем блокировку дольше обычного
+                cursor.execute(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT_MS}")
+                cursor.execute("BEGIN EXCLUSIVE")
+                applied = []
+                try:
+                    # Перечитываем версию уже под блокировкой
+                    current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                    for version, name, path in migrations:
+                        if version <= current_version:
+                            continue
+                        print(f"📝 Применяем миграцию {name}...")
+                        self._apply_migration(connection, path)
+                        cursor.execute(f"PRAGMA user_version = {int(version)}")
+                        current_version = version
+                        applied.append(name)
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+
+                if applied:
+                    print(f"✅ Схема базы данных обновлена до версии {current_version}")
+                return current_version
 
         except Exception as e:
-            print(f"❌ Ошибка создания таблиц: {e}")
+            print(f"❌ Ошибка применения миграций: {e}")
             import traceback
             traceback.print_exc()
-        finally:
-            connection.close()
+            raise
+
+    def _apply_migration(self, connection, path):
+        """Выполнение одной миграции (.sql или .py с функцией upgrade) в текущей транзакции"""
+        if path.endswith('.py'):
+            import importlib.util
+            spec = importlib.util.spec_from_file_location(f'migration_{os.path.basename(path)[:-3]}', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.upgrade(self, connection)
+            return
+
+        with open(path, 'r', encoding='utf-8') as f:
+            sql_script = f.read()
+        # executescript() фиксирует транзакцию, поэтому выполняем по одному выражению
+        cursor = connection.cursor()
+        for statement in _split_sql(sql_script):
+            cursor.execute(statement)
 
     def authenticate_user(self, username: str, password: str):
         """Аутентификация пользователя"""
-        connection = self.get_connection()
-        if not connection:
-            return None
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-            user = cursor.fetchone()
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+                user = cursor.fetchone()
 
             if not user:
                 print(f"❌ Пользователь '{username}' не найден")
@@ -112,57 +412,52 @@ class Database:
         except sqlite3.Error as e:
             print(f"❌ Ошибка аутентификации: {e}")
             return None
-        finally:
-            connection.close()
 
     def create_student(self, username, password, first_name, last_name, tutor_id, contact_info, exam_type, lesson_price,
                        day_of_week, lesson_time):
         """Создание нового ученика с автоматическим расписанием"""
-        connection = self.get_connection()
-        if not connection:
-            return False
-
         try:
-            cursor = connection.cursor()
-
-            # Проверяем, существует ли уже пользователь с таким логином
-            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-            if cursor.fetchone():
-                print(f"❌ Пользователь с логином '{username}' уже существует")
-                return False
-
-            # Создаем пользователя
-            cursor.execute('''
-                INSERT INTO users (
-                    username, password_hash, role, first_name, last_name, 
-                    exam_type, lesson_price, contact_info, created_by, is_active
-                ) VALUES (?, ?, 'student', ?, ?, ?, ?, ?, ?, 1)
-            ''', (username, password, first_name, last_name, exam_type, lesson_price, contact_info, tutor_id))
-
-            student_id = cursor.lastrowid
-
-            # Создаем тему для занятий
-            cursor.execute('''
-                INSERT INTO topics (title, description, created_by)
-                VALUES (?, ?, ?)
-            ''', (
-            f'Занятия с {first_name} {last_name}', f'Регулярные занятия по подготовке к {exam_type.upper()}', tutor_id))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+
+                # Проверяем, существует ли уже пользователь с таким логином
+                cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+                if cursor.fetchone():
+                    print(f"❌ Пользователь с логином '{username}' уже существует")
+                    return False
+
+                # Создаем пользователя
+                cursor.execute('''
+                    INSERT INTO users (
+                        username, password_hash, role, first_name, last_name, 
+                        exam_type, lesson_price, contact_info, created_by, is_active
+                    ) VALUES (?, ?, 'student', ?, ?, ?, ?, ?, ?, 1)
+                ''', (username, password, first_name, last_name, exam_type, lesson_price, contact_info, tutor_id))
+
+                student_id = cursor.lastrowid
+
+                # Создаем тему для занятий
+                cursor.execute('''
+                    INSERT INTO topics (title, description, created_by)
+                    VALUES (?, ?, ?)
+                ''', (
+                f'Занятия с {first_name} {last_name}', f'Регулярные занятия по подготовке к {exam_type.upper()}', tutor_id))
 
-            topic_id = cursor.lastrowid
+                topic_id = cursor.lastrowid
 
-            # Вычисляем время окончания (занятие длится 1 час)
-            from datetime import datetime, timedelta
-            start_dt = datetime.strptime(lesson_time, '%H:%M')
-            end_dt = start_dt + timedelta(hours=1)
-            end_time = end_dt.strftime('%H:%M')
+                # Вычисляем время окончания (занятие длится 1 час)
+                from datetime import datetime, timedelta
+                start_dt = datetime.strptime(lesson_time, '%H:%M')
+                end_dt = start_dt + timedelta(hours=1)
+                end_time = end_dt.strftime('%H:%M')
 
-            # Создаем РЕГУЛЯРНОЕ расписание
-            cursor.execute('''
-                INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status, lesson_type)
-                VALUES (?, ?, ?, ?, ?, ?, 'active', 'regular')
-            ''', (student_id, tutor_id, topic_id, day_of_week, lesson_time, end_time))
+                # Создаем РЕГУЛЯРНОЕ расписание
+                cursor.execute('''
+                    INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status, lesson_type)
+                    VALUES (?, ?, ?, ?, ?, ?, 'active', 'regular')
+                ''', (student_id, tutor_id, topic_id, day_of_week, lesson_time, end_time))
 
-            connection.commit()
+                connection.commit()
 
             print(f"✅ Ученик создан: {first_name} {last_name} (ID: {student_id})")
             print(f"📅 Автоматическое расписание: {day_of_week} {lesson_time}-{end_time} (регулярное)")
@@ -171,36 +466,48 @@ class Database:
         except sqlite3.Error as e:
             print(f"❌ Ошибка при создании ученика: {e}")
             return False
-        finally:
-            connection.close()
 
 
     def get_tutor_students(self, tutor_id: int):
         """Получение всех учеников репетитора с информацией о расписании"""
-        connection = self.get_connection()
-        if not connection:
-            return []
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT 
-                    u.id, u.username, u.first_name, u.last_name, 
-                    u.exam_type, u.lesson_price, u.contact_info, u.created_at,
-                    s.day_of_week, s.start_time as lesson_time
-                FROM users u
-                LEFT JOIN schedule s ON u.id = s.student_id AND s.status = 'active'
-                WHERE u.created_by = ? AND u.role = 'student' AND u.is_active = 1
-                ORDER BY u.created_at DESC
-            """, (tutor_id,))
-
-            students = []
-            for row in cursor.fetchall():
-                student = dict(row)
-                # Добавляем вычисляемые поля для отображения
-                student['progress'] = self.calculate_student_progress(student['id'])
-                student['lesson_count'] = self.get_student_lesson_count(student['id'])
-                students.append(student)
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                # Количество занятий и прогресс считаются агрегатами в том же
+                # запросе, а не отдельным запросом на каждого ученика
+                cursor.execute("""
+                    WITH tutor_students AS (
+                        SELECT id FROM users
+                        WHERE created_by = :tutor_id AND role = 'student' AND is_active = 1
+                    ),
+                    lesson_counts AS (
+                        SELECT sc.student_id, COUNT(*) as lesson_count
+                        FROM schedule sc
+                        JOIN lessons l ON l.schedule_id = sc.id
+                        WHERE sc.student_id IN (SELECT id FROM tutor_students)
+                        GROUP BY sc.student_id
+                    ),
+                    progress AS (
+                        SELECT sp.student_id, ROUND(AVG(sp.overall_progress)) as progress
+                        FROM student_progress sp
+                        WHERE sp.student_id IN (SELECT id FROM tutor_students)
+                        GROUP BY sp.student_id
+                    )
+                    SELECT 
+                        u.id, u.username, u.first_name, u.last_name, 
+                        u.exam_type, u.lesson_price, u.contact_info, u.created_at,
+                        s.day_of_week, s.start_time as lesson_time,
+                        CAST(COALESCE(p.progress, 0) AS INTEGER) as progress,
+                        COALESCE(lc.lesson_count, 0) as lesson_count
+                    FROM users u
+                    LEFT JOIN schedule s ON u.id = s.student_id AND s.status = 'active'
+                    LEFT JOIN lesson_counts lc ON lc.student_id = u.id
+                    LEFT JOIN progress p ON p.student_id = u.id
+                    WHERE u.created_by = :tutor_id AND u.role = 'student' AND u.is_active = 1
+                    ORDER BY u.created_at DESC
+                """, {'tutor_id': tutor_id})
+
+                students = [dict(row) for row in cursor.fetchall()]
 
             print(f"📊 Найдено учеников: {len(students)}")
             return students
@@ -208,641 +515,1246 @@ class Database:
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения учеников: {e}")
             return []
-        finally:
-            connection.close()
-
-    def update_schema(self):
-        """Обновление схемы базы данных - добавление exam_type"""
-        connection = self.get_connection()
-        if not connection:
-            return False
-
-        try:
-            cursor = connection.cursor()
-
-            # Проверяем существование колонки exam_type
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            # Добавляем exam_type если его нет
-            if 'exam_type' not in columns:
-                print("📝 Добавляем колонку exam_type в таблицу users...")
-                cursor.execute('ALTER TABLE users ADD COLUMN exam_type VARCHAR(10) CHECK (exam_type IN ("oge", "ege"))')
-                connection.commit()
-                print("✅ Колонка exam_type добавлена")
-
-            return True
-
-        except sqlite3.Error as e:
-            print(f"❌ Ошибка обновления схемы: {e}")
-            return False
-        finally:
-            connection.close()
-
-    def ensure_tutor_user(self):
-        """Создание пользователя tutor, если его нет"""
-        connection = self.get_connection()
-        if not connection:
-            return False
-
-        try:
-            cursor = connection.cursor()
-            
-            # Проверяем, существует ли пользователь tutor
-            cursor.execute("SELECT id FROM users WHERE username = 'tutor'")
-            tutor = cursor.fetchone()
-            
-            if not tutor:
-                print("👤 Создаем пользователя tutor...")
-                cursor.execute("""
-                    INSERT INTO users (username, password_hash, role, first_name, last_name, lesson_price, contact_info, is_active)
-                    VALUES ('tutor', 'tutor', 'tutor', 'Главный', 'Репетитор', 1500.00, 'tutor@example.com', 1)
-                """)
-                connection.commit()
-                print("✅ Пользователь tutor создан")
-                return True
-            else:
-                tutor_dict = dict(tutor)
-                print(f"✅ Пользователь tutor уже существует (ID: {tutor_dict['id']})")
-                # Обновляем пароль и статус на случай, если они были изменены
-                cursor.execute("""
-                    UPDATE users 
-                    SET password_hash = 'tutor', 
-                        is_active = 1,
-                        role = 'tutor'
-                    WHERE username = 'tutor'
-                """)
-                connection.commit()
-                print("✅ Данные пользователя tutor обновлены")
-                return True
-
-        except sqlite3.Error as e:
-            print(f"❌ Ошибка создания пользователя tutor: {e}")
-            return False
-        finally:
-            connection.close()
 
     def get_student_schedule(self, student_id: int):
         """Получение расписания ученика"""
-        connection = self.get_connection()
-        if not connection:
-            return []
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT s.id, s.day_of_week, s.start_time, s.end_time, s.lesson_link, s.status,
-                       t.title as topic_title, u.first_name as tutor_name
-                FROM schedule s
-                JOIN topics t ON s.topic_id = t.id
-                JOIN users u ON s.tutor_id = u.id
-                WHERE s.student_id = ? AND s.status = 'active'
-                ORDER BY 
-                    CASE s.day_of_week
-                        WHEN 'monday' THEN 1
-                        WHEN 'tuesday' THEN 2
-                        WHEN 'wednesday' THEN 3
-                        WHEN 'thursday' THEN 4
-                        WHEN 'friday' THEN 5
-                        WHEN 'saturday' THEN 6
-                        WHEN 'sunday' THEN 7
-                    END,
-                    s.start_time
-            """, (student_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT s.id, s.day_of_week, s.start_time, s.end_time, s.lesson_link, s.status,
+                           t.title as topic_title, u.first_name as tutor_name
+                    FROM schedule s
+                    JOIN topics t ON s.topic_id = t.id
+                    JOIN users u ON s.tutor_id = u.id
+                    WHERE s.student_id = ? AND s.status = 'active'
+                    ORDER BY 
+                        CASE s.day_of_week
+                            WHEN 'monday' THEN 1
+                            WHEN 'tuesday' THEN 2
+                            WHEN 'wednesday' THEN 3
+                            WHEN 'thursday' THEN 4
+                            WHEN 'friday' THEN 5
+                            WHEN 'saturday' THEN 6
+                            WHEN 'sunday' THEN 7
+                        END,
+                        s.start_time
+                """, (student_id,))
+                return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения расписания: {e}")
             return []
-        finally:
-            connection.close()
 
     def get_tutor_schedule(self, tutor_id: int):
         """Получение расписания репетитора"""
-        connection = self.get_connection()
-        if not connection:
-            return []
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT s.id, s.day_of_week, s.start_time, s.end_time, s.lesson_link, s.status,
-                       t.title as topic_title, 
-                       u.first_name as student_name, u.last_name as student_last_name
-                FROM schedule s
-                JOIN topics t ON s.topic_id = t.id
-                JOIN users u ON s.student_id = u.id
-                WHERE s.tutor_id = ? AND s.status = 'active'
-                ORDER BY 
-                    CASE s.day_of_week
-                        WHEN 'monday' THEN 1
-                        WHEN 'tuesday' THEN 2
-                        WHEN 'wednesday' THEN 3
-                        WHEN 'thursday' THEN 4
-                        WHEN 'friday' THEN 5
-                        WHEN 'saturday' THEN 6
-                        WHEN 'sunday' THEN 7
-                    END,
-                    s.start_time
-            """, (tutor_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT s.id, s.day_of_week, s.start_time, s.end_time, s.lesson_link, s.status,
+                           t.title as topic_title, 
+                           u.first_name as student_name, u.last_name as student_last_name
+                    FROM schedule s
+                    JOIN topics t ON s.topic_id = t.id
+                    JOIN users u ON s.student_id = u.id
+                    WHERE s.tutor_id = ? AND s.status = 'active'
+                    ORDER BY 
+                        CASE s.day_of_week
+                            WHEN 'monday' THEN 1
+                            WHEN 'tuesday' THEN 2
+                            WHEN 'wednesday' THEN 3
+                            WHEN 'thursday' THEN 4
+                            WHEN 'friday' THEN 5
+                            WHEN 'saturday' THEN 6
+                            WHEN 'sunday' THEN 7
+                        END,
+                        s.start_time
+                """, (tutor_id,))
+                return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения расписания репетитора: {e}")
             return []
-        finally:
-            connection.close()
 
     def calculate_student_progress(self, student_id: int):
-        """Расчет прогресса ученика (заглушка)"""
-        # В реальном приложении здесь будет расчет прогресса на основе выполненных заданий
-        import random
-        return random.randint(50, 95)
+        """Расчет прогресса ученика (среднее overall_progress по темам)"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT CAST(COALESCE(ROUND(AVG(overall_progress)), 0) AS INTEGER) as progress
+                    FROM student_progress
+                    WHERE student_id = ?
+                """, (student_id,))
 
-    def get_student_lesson_count(self, student_id: int):
-        """Получение количества занятий ученика"""
-        connection = self.get_connection()
-        if not connection:
+                result = cursor.fetchone()
+                return result['progress'] if result else 0
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка расчета прогресса: {e}")
             return 0
 
+    def get_student_lesson_count(self, student_id: int):
+        """Получение количества занятий ученика"""
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM lessons 
-                WHERE schedule_id IN (
-                    SELECT id FROM schedule WHERE student_id = ?
-                )
-            """, (student_id,))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT COUNT(*) as count 
+                    FROM lessons 
+                    WHERE schedule_id IN (
+                        SELECT id FROM schedule WHERE student_id = ?
+                    )
+                """, (student_id,))
 
-            result = cursor.fetchone()
-            return result['count'] if result else 0
+                result = cursor.fetchone()
+                return result['count'] if result else 0
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения количества занятий: {e}")
             return 0
-        finally:
-            connection.close()
 
     # Добавьте в класс Database следующие методы:
 
     def get_monthly_income(self, tutor_id, year, month):
         """Получение дохода за конкретный месяц"""
-        connection = self.get_connection()
-        if not connection:
-            return 0
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT COALESCE(SUM(l.amount), 0) as total_income
-                FROM income l
-                JOIN schedule s ON l.schedule_id = s.id
-                WHERE s.tutor_id = ? 
-                AND strftime('%Y', l.payment_date) = ?
-                AND strftime('%m', l.payment_date) = ?
-            """, (tutor_id, str(year), str(month).zfill(2)))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT COALESCE(SUM(l.amount), 0) as total_income
+                    FROM income l
+                    JOIN schedule s ON l.schedule_id = s.id
+                    WHERE s.tutor_id = ? 
+                    AND strftime('%Y', l.payment_date) = ?
+                    AND strftime('%m', l.payment_date) = ?
+                """, (tutor_id, str(year), str(month).zfill(2)))
 
-            result = cursor.fetchone()
-            return result['total_income'] if result else 0
+                result = cursor.fetchone()
+                return result['total_income'] if result else 0
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения дохода за месяц: {e}")
             return 0
-        finally:
-            connection.close()
 
     def get_yearly_income(self, tutor_id, year):
         """Получение дохода за год"""
-        connection = self.get_connection()
-        if not connection:
-            return 0
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT COALESCE(SUM(l.amount), 0) as total_income
-                FROM income l
-                JOIN schedule s ON l.schedule_id = s.id
-                WHERE s.tutor_id = ? 
-                AND strftime('%Y', l.payment_date) = ?
-            """, (tutor_id, str(year)))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT COALESCE(SUM(l.amount), 0) as total_income
+                    FROM income l
+                    JOIN schedule s ON l.schedule_id = s.id
+                    WHERE s.tutor_id = ? 
+                    AND strftime('%Y', l.payment_date) = ?
+                """, (tutor_id, str(year)))
 
-            result = cursor.fetchone()
-            return result['total_income'] if result else 0
+                result = cursor.fetchone()
+                return result['total_income'] if result else 0
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения дохода за год: {e}")
             return 0
-        finally:
-            connection.close()
 
     def get_average_lesson_price(self, tutor_id):
         """Получение средней стоимости занятия"""
-        connection = self.get_connection()
-        if not connection:
-            return 0
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT AVG(lesson_price) as avg_price
-                FROM users 
-                WHERE created_by = ? AND role = 'student' AND is_active = 1
-            """, (tutor_id,))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT AVG(lesson_price) as avg_price
+                    FROM users 
+                    WHERE created_by = ? AND role = 'student' AND is_active = 1
+                """, (tutor_id,))
 
-            result = cursor.fetchone()
-            return result['avg_price'] if result and result['avg_price'] else 0
+                result = cursor.fetchone()
+                return result['avg_price'] if result and result['avg_price'] else 0
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения средней стоимости: {e}")
             return 0
-        finally:
-            connection.close()
 
     def get_monthly_income_forecast(self, tutor_id, year, month):
         """Прогноз дохода на месяц"""
-        connection = self.get_connection()
-        if not connection:
-            return 0
-
         try:
-            cursor = connection.cursor()
-            # Получаем количество активных учеников
-            cursor.execute("""
-                SELECT COUNT(*) as student_count
-                FROM users 
-                WHERE created_by = ? AND role = 'student' AND is_active = 1
-            """, (tutor_id,))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                # Получаем количество активных учеников
+                cursor.execute("""
+                    SELECT COUNT(*) as student_count
+                    FROM users 
+                    WHERE created_by = ? AND role = 'student' AND is_active = 1
+                """, (tutor_id,))
 
-            student_count = cursor.fetchone()['student_count']
+                student_count = cursor.fetchone()['student_count']
 
-            # Получаем среднюю стоимость занятия
-            avg_price = self.get_average_lesson_price(tutor_id)
+                # Получаем среднюю стоимость занятия
+                avg_price = self.get_average_lesson_price(tutor_id)
 
-            # Прогноз: 4 занятия в месяц на ученика
-            forecast = student_count * 4 * avg_price
+                # Прогноз: 4 занятия в месяц на ученика
+                forecast = student_count * 4 * avg_price
 
-            return forecast
+                return forecast
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка расчета прогноза: {e}")
             return 0
-        finally:
-            connection.close()
 
-    def get_income_statistics(self, tutor_id):
-        """Полная статистика по доходам"""
-        from datetime import datetime
+    def get_income_statistics(self, tutor_id, date_from=None, date_to=None):
+        """Полная статистика по доходам за один проход.
+
+        Все показатели считаются в одной транзакции двумя запросами: суммы
+        дохода, сгруппированные по месяцам, и агрегаты по активным ученикам.
+        date_from/date_to ('YYYY-MM-DD', включительно) задают период для
+        помесячной и годовой разбивки; по умолчанию - текущий год.
+        """
+        from datetime import date, datetime, timedelta
+
+        today = datetime.now().date()
+        month_key = today.strftime('%Y-%m')
+        year_key = str(today.year)
 
-        current_year = datetime.now().year
-        current_month = datetime.now().month
+        period_start = date.fromisoformat(date_from) if date_from else date(today.year, 1, 1)
+        period_end = date.fromisoformat(date_to) if date_to else date(today.year, 12, 31)
+        if period_end < period_start:
+            raise ValueError('Дата окончания периода раньше даты начала')
+
+        # Сканируем объединение запрошенного периода и текущего года,
+        # чтобы текущий месяц и год всегда были посчитаны
+        scan_start = min(period_start, date(today.year, 1, 1))
+        scan_end = max(period_end, date(today.year, 12, 31)) + timedelta(days=1)
+
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                own_transaction = not connection.in_transaction
+                if own_transaction:
+                    # Оба запроса читают один и тот же снимок базы
+                    cursor.execute("BEGIN")
+
+                cursor.execute("""
+                    SELECT strftime('%Y-%m', i.payment_date) as month,
+                           COALESCE(SUM(i.amount), 0) as income,
+                           COUNT(*) as payments
+                    FROM income i
+                    JOIN schedule s ON i.schedule_id = s.id
+                    WHERE s.tutor_id = ?
+                    AND i.payment_date >= ? AND i.payment_date < ?
+                    GROUP BY month
+                    ORDER BY month
+                """, (tutor_id, scan_start.isoformat(), scan_end.isoformat()))
+                monthly_rows = cursor.fetchall()
+
+                cursor.execute("""
+                    SELECT COUNT(*) as student_count,
+                           AVG(lesson_price) as avg_price
+                    FROM users
+                    WHERE created_by = ? AND role = 'student' AND is_active = 1
+                """, (tutor_id,))
+                students = cursor.fetchone()
+
+                if own_transaction:
+                    connection.commit()
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения статистики доходов: {e}")
+            return {
+                'current_month_income': 0,
+                'monthly_forecast': 0,
+                'average_lesson_price': 0,
+                'yearly_income': 0,
+                'student_count': 0
+            }
+
+        period_first_month = period_start.strftime('%Y-%m')
+        period_last_month = period_end.strftime('%Y-%m')
+
+        current_month_income = 0
+        yearly_income = 0
+        monthly = []
+        yearly = {}
+        for row in monthly_rows:
+            month, income = row['month'], row['income']
+            if month == month_key:
+                current_month_income = income
+            if month.startswith(year_key):
+                yearly_income += income
+            if period_first_month <= month <= period_last_month:
+                monthly.append({'month': month, 'income': income, 'payments': row['payments']})
+                yearly[month[:4]] = yearly.get(month[:4], 0) + income
+
+        student_count = students['student_count'] if students else 0
+        average_lesson_price = students['avg_price'] if students and students['avg_price'] else 0
 
         return {
-            'current_month_income': self.get_monthly_income(tutor_id, current_year, current_month),
-            'monthly_forecast': self.get_monthly_income_forecast(tutor_id, current_year, current_month),
-            'average_lesson_price': self.get_average_lesson_price(tutor_id),
-            'yearly_income': self.get_yearly_income(tutor_id, current_year),
-            'student_count': self.get_active_students_count(tutor_id)
+            'current_month_income': current_month_income,
+            # Прогноз: 4 занятия в месяц на ученика
+            'monthly_forecast': student_count * 4 * average_lesson_price,
+            'average_lesson_price': average_lesson_price,
+            'yearly_income': yearly_income,
+            'student_count': student_count,
+            'period': {'from': period_start.isoformat(), 'to': period_end.isoformat()},
+            'monthly': monthly,
+            'yearly': [{'year': year, 'income': income} for year, income in sorted(yearly.items())]
         }
 
     def get_active_students_count(self, tutor_id):
         """Количество активных учеников"""
-        connection = self.get_connection()
-        if not connection:
-            return 0
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT COUNT(*) as count
-                FROM users 
-                WHERE created_by = ? AND role = 'student' AND is_active = 1
-            """, (tutor_id,))
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT COUNT(*) as count
+                    FROM users 
+                    WHERE created_by = ? AND role = 'student' AND is_active = 1
+                """, (tutor_id,))
 
-            result = cursor.fetchone()
-            return result['count'] if result else 0
+                result = cursor.fetchone()
+                return result['count'] if result else 0
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения количества учеников: {e}")
             return 0
-        finally:
-            connection.close()
-
-    # Добавьте в класс Database следующие методы:
-
-    # ЗАМЕНИТЕ метод get_tutor_quick_stats в database.py на этот:
 
     def get_tutor_quick_stats(self, tutor_id):
-        """Получение быстрой статистики для репетитора - УПРОЩЕННАЯ ВЕРСИЯ БЕЗ ТАБЛИЦЫ INCOME"""
-        connection = self.get_connection()
-        if not connection:
-            return {}
-
+        """Получение быстрой статистики для репетитора из сводной таблицы tutor_stats"""
         try:
-            cursor = connection.cursor()
-
-            print(f"🔍 Получение статистики для репетитора ID: {tutor_id}")
-
-            # 1. Количество активных учеников
-            cursor.execute("""
-                SELECT COUNT(*) as total_students
-                FROM users 
-                WHERE created_by = ? AND role = 'student' AND is_active = 1
-            """, (tutor_id,))
-            total_students_result = cursor.fetchone()
-            total_students = total_students_result['total_students'] if total_students_result else 0
-            print(f"📊 Всего учеников: {total_students}")
-
-            # 2. Количество учеников по типам экзаменов
-            cursor.execute("""
-                SELECT exam_type, COUNT(*) as count
-                FROM users 
-                WHERE created_by = ? AND role = 'student' AND is_active = 1
-                GROUP BY exam_type
-            """, (tutor_id,))
-
-            exam_stats = cursor.fetchall()
-            oge_count = 0
-            ege_count = 0
-            for stat in exam_stats:
-                if stat['exam_type'] == 'oge':
-                    oge_count = stat['count']
-                elif stat['exam_type'] == 'ege':
-                    ege_count = stat['count']
-            print(f"🎯 ОГЭ: {oge_count}, ЕГЭ: {ege_count}")
-
-            # 3. Занятия на неделю
-            cursor.execute("""
-                SELECT COUNT(*) as weekly_lessons
-                FROM schedule 
-                WHERE tutor_id = ? AND status = 'active'
-            """, (tutor_id,))
-            weekly_lessons_result = cursor.fetchone()
-            weekly_lessons = weekly_lessons_result['weekly_lessons'] if weekly_lessons_result else 0
-            print(f"📅 Занятий на неделю: {weekly_lessons}")
-
-            # 4. Занятия на завтра
-            from datetime import datetime, timedelta
-            tomorrow_date = datetime.now() + timedelta(days=1)
-            day_map = {
-                0: 'monday', 1: 'tuesday', 2: 'wednesday', 3: 'thursday',
-                4: 'friday', 5: 'saturday', 6: 'sunday'
-            }
-            tomorrow_weekday = day_map[tomorrow_date.weekday()]
-
-            cursor.execute("""
-                SELECT COUNT(*) as tomorrow_lessons
-                FROM schedule 
-                WHERE tutor_id = ? AND day_of_week = ? AND status = 'active'
-            """, (tutor_id, tomorrow_weekday))
-            tomorrow_result = cursor.fetchone()
-            tomorrow_lessons = tomorrow_result['tomorrow_lessons'] if tomorrow_result else 0
-            print(f"📆 Занятий на завтра: {tomorrow_lessons}")
-
-            # 5. Расчет доходов на основе учеников (без таблицы income)
-            cursor.execute("""
-                SELECT COALESCE(SUM(lesson_price), 0) as total_lesson_price
-                FROM users 
-                WHERE created_by = ? AND role = 'student' AND is_active = 1
-            """, (tutor_id,))
-            total_price_result = cursor.fetchone()
-            total_lesson_price = total_price_result['total_lesson_price'] if total_price_result else 0
-
-            # Прогноз: 4 занятия в месяц на ученика
-            monthly_forecast = total_lesson_price * 4
-            # Текущий доход: 70% от прогноза (имитация проведенных занятий)
-            monthly_income = monthly_forecast * 0.7
-
-            print(f"💰 Прогноз дохода: {monthly_forecast}, Текущий: {monthly_income}")
-
-            stats = {
-                'total_students': total_students,
-                'oge_students': oge_count,
-                'ege_students': ege_count,
-                'weekly_lessons': weekly_lessons,
-                'tomorrow_lessons': tomorrow_lessons,
-                'monthly_income': monthly_income,
-                'monthly_forecast': monthly_forecast
-            }
-
-            print(f"✅ Статистика собрана: {stats}")
-            return stats
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT * FROM tutor_stats WHERE tutor_id = ?", (tutor_id,))
+                row = cursor.fetchone()
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения быстрой статистики: {e}")
             import traceback
             traceback.print_exc()
             return {}
-        finally:
-            if connection:
-                connection.close()
+
+        # Нет строки - у репетитора еще нет учеников и занятий
+        summary = dict(row) if row else {}
+
+        from datetime import datetime, timedelta
+        tomorrow_weekday = WEEKDAYS[(datetime.now() + timedelta(days=1)).weekday()]
+
+        # Прогноз: 4 занятия в месяц на ученика
+        monthly_forecast = summary.get('total_lesson_price', 0) * 4
+        # Текущий доход: 70% от прогноза (имитация проведенных занятий)
+        monthly_income = monthly_forecast * 0.7
+
+        stats = {
+            'total_students': summary.get('total_students', 0),
+            'oge_students': summary.get('oge_students', 0),
+            'ege_students': summary.get('ege_students', 0),
+            'weekly_lessons': summary.get('weekly_lessons', 0),
+            'tomorrow_lessons': summary.get(f'{tomorrow_weekday}_lessons', 0),
+            'monthly_income': monthly_income,
+            'monthly_forecast': monthly_forecast
+        }
+
+        print(f"✅ Статистика собрана: {stats}")
+        return stats
+
+    def rebuild_tutor_stats(self):
+        """Полный пересчет сводной таблицы tutor_stats (исправление расхождений)"""
+        try:
+            with self.connection() as connection:
+                # Внутри миграции фиксацию выполняет сам мигратор
+                own_transaction = not connection.in_transaction
+                cursor = connection.cursor()
+                cursor.execute("DELETE FROM tutor_stats")
+                cursor.execute(REBUILD_TUTOR_STATS_SQL)
+                rebuilt = cursor.rowcount
+                if own_transaction:
+                    connection.commit()
+
+            print(f"✅ Статистика пересчитана для {rebuilt} репетиторов")
+            return rebuilt
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка пересчета статистики: {e}")
+            return False
 
 
     def get_tutor_students_for_schedule(self, tutor_id):
         """Получение учеников репетитора для выбора в расписании"""
-        connection = self.get_connection()
-        if not connection:
-            return []
-
         try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                SELECT 
-                    u.id, 
-                    u.first_name, 
-                    u.last_name,
-                    u.exam_type,
-                    u.lesson_price
-                FROM users u
-                WHERE u.created_by = ? AND u.role = 'student' AND u.is_active = 1
-                ORDER BY u.first_name, u.last_name
-            """, (tutor_id,))
-
-            students = [dict(row) for row in cursor.fetchall()]
-            return students
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT 
+                        u.id, 
+                        u.first_name, 
+                        u.last_name,
+                        u.exam_type,
+                        u.lesson_price
+                    FROM users u
+                    WHERE u.created_by = ? AND u.role = 'student' AND u.is_active = 1
+                    ORDER BY u.first_name, u.last_name
+                """, (tutor_id,))
+
+                students = [dict(row) for row in cursor.fetchall()]
+                return students
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения учеников для расписания: {e}")
             return []
-        finally:
-            if connection:
-                connection.close()
 
     def create_schedule_entry(self, tutor_id, student_id, day_of_week, start_time, end_time, topic_id=None):
         """Создание новой записи в расписании"""
-        connection = self.get_connection()
-        if not connection:
-            return False
-
         try:
-            cursor = connection.cursor()
-
-            # Если тема не указана, создаем тему по умолчанию
-            if not topic_id:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+
+                # Если тема не указана, создаем тему по умолчанию
+                if not topic_id:
+                    cursor.execute("""
+                        INSERT INTO topics (title, description, created_by)
+                        VALUES (?, ?, ?)
+                    """, (f'Занятие со студентом {student_id}', 'Индивидуальное занятие', tutor_id))
+                    topic_id = cursor.lastrowid
+
+                # Создаем запись в расписании
                 cursor.execute("""
-                    INSERT INTO topics (title, description, created_by)
-                    VALUES (?, ?, ?)
-                """, (f'Занятие со студентом {student_id}', 'Индивидуальное занятие', tutor_id))
-                topic_id = cursor.lastrowid
-
-            # Создаем запись в расписании
-            cursor.execute("""
-                INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status)
-                VALUES (?, ?, ?, ?, ?, ?, 'active')
-            """, (student_id, tutor_id, topic_id, day_of_week, start_time, end_time))
+                    INSERT INTO schedule (student_id, tutor_id, topic_id, day_of_week, start_time, end_time, status)
+                    VALUES (?, ?, ?, ?, ?, ?, 'active')
+                """, (student_id, tutor_id, topic_id, day_of_week, start_time, end_time))
 
-            schedule_id = cursor.lastrowid
-            connection.commit()
+                schedule_id = cursor.lastrowid
+                connection.commit()
 
             print(f"✅ Создано занятие в расписании: ID {schedule_id}")
             return schedule_id
 
         except sqlite3.Error as e:
+            # Незафиксированные изменения откатываются при возврате соединения в пул
             print(f"❌ Ошибка создания занятия: {e}")
-            connection.rollback()
             return False
-        finally:
-            if connection:
-                connection.close()
 
     def get_schedule_for_date(self, tutor_id, date):
         """Получение расписания для конкретной даты - ВКЛЮЧАЕТ РЕГУЛЯРНЫЕ ЗАНЯТИЯ"""
-        connection = self.get_connection()
-        if not connection:
-            return []
+        return self.get_schedule_day_view(tutor_id, date)['lessons']
+
+    def get_schedule_statistics(self, tutor_id, date):
+        """Получение статистики расписания"""
+        return self.get_schedule_day_view(tutor_id, date)['stats']
+
+    def get_schedule_day_view(self, tutor_id, date):
+        """Расписание и статистика на дату одним запросом.
+
+        Регулярные занятия на день недели и разовые занятия на дату
+        выбираются одним UNION ALL, длительность считается в SQL, а
+        статистика собирается за один проход по полученным строкам.
+        """
+        from datetime import datetime
+        day_of_week = WEEKDAYS[datetime.strptime(date, '%Y-%m-%d').weekday()]
 
         try:
-            # Определяем день недели для даты
-            from datetime import datetime
-            date_obj = datetime.strptime(date, '%Y-%m-%d')
-            day_map = {
-                0: 'monday',
-                1: 'tuesday',
-                2: 'wednesday',
-                3: 'thursday',
-                4: 'friday',
-                5: 'saturday',
-                6: 'sunday'
-            }
-            day_of_week = day_map[date_obj.weekday()]
-
-            cursor = connection.cursor()
-
-            # Получаем ВСЕ активные регулярные занятия на этот день недели
-            cursor.execute("""
-                SELECT 
-                    s.id,
-                    s.day_of_week,
-                    s.start_time,
-                    s.end_time,
-                    s.status,
-                    s.lesson_type,
-                    u.first_name,
-                    u.last_name,
-                    u.exam_type,
-                    u.lesson_price,
-                    t.title as topic_title
-                FROM schedule s
-                JOIN users u ON s.student_id = u.id
-                LEFT JOIN topics t ON s.topic_id = t.id
-                WHERE s.tutor_id = ? 
-                AND s.day_of_week = ? 
-                AND s.status = 'active'
-                AND (s.lesson_type = 'regular' OR s.lesson_type IS NULL)
-                ORDER BY s.start_time
-            """, (tutor_id, day_of_week))
-
-            regular_lessons = [dict(row) for row in cursor.fetchall()]
-
-            # Также получаем разовые занятия на конкретную дату
-            cursor.execute("""
-                SELECT 
-                    s.id,
-                    s.day_of_week,
-                    s.start_time,
-                    s.end_time,
-                    s.status,
-                    s.lesson_type,
-                    u.first_name,
-                    u.last_name,
-                    u.exam_type,
-                    u.lesson_price,
-                    t.title as topic_title,
-                    sl.lesson_date
-                FROM schedule s
-                JOIN single_lessons sl ON s.id = sl.schedule_id
-                JOIN users u ON s.student_id = u.id
-                LEFT JOIN topics t ON s.topic_id = t.id
-                WHERE s.tutor_id = ? 
-                AND sl.lesson_date = ?
-                AND s.status = 'active'
-                AND s.lesson_type = 'single'
-                ORDER BY s.start_time
-            """, (tutor_id, date))
-
-            single_lessons = [dict(row) for row in cursor.fetchall()]
-
-            # Объединяем регулярные и разовые занятия
-            all_lessons = regular_lessons + single_lessons
-
-            print(
-                f"📅 На {date} ({day_of_week}): {len(regular_lessons)} регулярных + {len(single_lessons)} разовых = {len(all_lessons)} занятий")
-
-            return all_lessons
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT * FROM (
+                        SELECT 
+                            s.id,
+                            s.day_of_week,
+                            s.start_time,
+                            s.end_time,
+                            s.status,
+                            s.lesson_type,
+                            u.first_name,
+                            u.last_name,
+                            u.exam_type,
+                            u.lesson_price,
+                            t.title as topic_title,
+                            NULL as lesson_date,
+                            (strftime('%s', s.end_time) - strftime('%s', s.start_time)) / 3600.0 as duration_hours
+                        FROM schedule s
+                        JOIN users u ON s.student_id = u.id
+                        LEFT JOIN topics t ON s.topic_id = t.id
+                        WHERE s.tutor_id = :tutor_id 
+                        AND s.day_of_week = :day_of_week 
+                        AND s.status = 'active'
+                        AND (s.lesson_type = 'regular' OR s.lesson_type IS NULL)
+
+                        UNION ALL
+
+                        SELECT 
+                            s.id,
+                            s.day_of_week,
+                            s.start_time,
+                            s.end_time,
+                            s.status,
+                            s.lesson_type,
+                            u.first_name,
+                            u.last_name,
+                            u.exam_type,
+                            u.lesson_price,
+                            t.title as topic_title,
+                            sl.lesson_date,
+                            (strftime('%s', s.end_time) - strftime('%s', s.start_time)) / 3600.0 as duration_hours
+                        FROM single_lessons sl
+                        JOIN schedule s ON s.id = sl.schedule_id
+                        JOIN users u ON s.student_id = u.id
+                        LEFT JOIN topics t ON s.topic_id = t.id
+                        WHERE sl.lesson_date = :date
+                        AND s.tutor_id = :tutor_id 
+                        AND s.status = 'active'
+                        AND s.lesson_type = 'single'
+                    )
+                    -- Сначала регулярные, затем разовые занятия, каждые по времени начала
+                    ORDER BY lesson_date IS NOT NULL, start_time
+                """, {'tutor_id': tutor_id, 'day_of_week': day_of_week, 'date': date})
+
+                lessons = [dict(row) for row in cursor.fetchall()]
 
         except sqlite3.Error as e:
             print(f"❌ Ошибка получения расписания на дату: {e}")
-            return []
-        finally:
-            if connection:
-                connection.close()
+            return {'lessons': [], 'stats': {}}
 
-    def get_schedule_statistics(self, tutor_id, date):
-        """Получение статистики расписания"""
-        connection = self.get_connection()
-        if not connection:
+        single_count = sum(1 for lesson in lessons if lesson['lesson_date'] is not None)
+        print(
+            f"📅 На {date} ({day_of_week}): {len(lessons) - single_count} регулярных + {single_count} разовых = {len(lessons)} занятий")
+
+        return {'lessons': lessons, 'stats': self._summarize_lessons(lessons)}
+
+    def get_schedule_for_range(self, tutor_id, date_from, date_to):
+        """Расписание и статистика по дням за период одним запросом.
+
+        Регулярные занятия выбираются один раз и раскладываются по дням
+        периода по day_of_week, разовые - по lesson_date.
+        """
+        from datetime import date, timedelta
+
+        first_day = date.fromisoformat(date_from)
+        last_day = date.fromisoformat(date_to)
+        if last_day < first_day:
+            raise ValueError('Дата окончания периода раньше даты начала')
+        if (last_day - first_day).days >= MAX_SCHEDULE_RANGE_DAYS:
+            raise ValueError(f'Период не может быть длиннее {MAX_SCHEDULE_RANGE_DAYS} дней')
+
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT * FROM (
+                        SELECT 
+                            s.id,
+                            s.day_of_week,
+                            s.start_time,
+                            s.end_time,
+                            s.status,
+                            s.lesson_type,
+                            u.first_name,
+                            u.last_name,
+                            u.exam_type,
+                            u.lesson_price,
+                            t.title as topic_title,
+                            NULL as lesson_date,
+                            (strftime('%s', s.end_time) - strftime('%s', s.start_time)) / 3600.0 as duration_hours
+                        FROM schedule s
+                        JOIN users u ON s.student_id = u.id
+                        LEFT JOIN topics t ON s.topic_id = t.id
+                        WHERE s.tutor_id = :tutor_id 
+                        AND s.status = 'active'
+                        AND (s.lesson_type = 'regular' OR s.lesson_type IS NULL)
+
+                        UNION ALL
+
+                        SELECT 
+                            s.id,
+                            s.day_of_week,
+                            s.start_time,
+                            s.end_time,
+                            s.status,
+                            s.lesson_type,
+                            u.first_name,
+                            u.last_name,
+                            u.exam_type,
+                            u.lesson_price,
+                            t.title as topic_title,
+                            sl.lesson_date,
+                            (strftime('%s', s.end_time) - strftime('%s', s.start_time)) / 3600.0 as duration_hours
+                        FROM single_lessons sl
+                        JOIN schedule s ON s.id = sl.schedule_id
+                        JOIN users u ON s.student_id = u.id
+                        LEFT JOIN topics t ON s.topic_id = t.id
+                        WHERE sl.lesson_date BETWEEN :date_from AND :date_to
+                        AND s.tutor_id = :tutor_id 
+                        AND s.status = 'active'
+                        AND s.lesson_type = 'single'
+                    )
+                    ORDER BY lesson_date IS NOT NULL, start_time
+                """, {'tutor_id': tutor_id, 'date_from': first_day.isoformat(), 'date_to': last_day.isoformat()})
+
+                rows = [dict(row) for row in cursor.fetchall()]
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения расписания за период: {e}")
             return {}
 
+        regular_by_weekday = {day: [] for day in WEEKDAYS}
+        single_by_date = {}
+        for row in rows:
+            if row['lesson_date'] is None:
+                if row['day_of_week'] in regular_by_weekday:
+                    regular_by_weekday[row['day_of_week']].append(row)
+            else:
+                single_by_date.setdefault(row['lesson_date'], []).append(row)
+
+        days = {}
+        current = first_day
+        while current <= last_day:
+            date_key = current.isoformat()
+            # Копии строк, чтобы у каждого дня были независимые словари
+            lessons = [dict(lesson) for lesson in
+                       regular_by_weekday[WEEKDAYS[current.weekday()]] + single_by_date.get(date_key, [])]
+            days[date_key] = {'lessons': lessons, 'stats': self._summarize_lessons(lessons)}
+            current += timedelta(days=1)
+
+        print(f"📅 Период {date_from} - {date_to}: {len(days)} дней, {len(rows)} строк расписания")
+        return days
+
+    def _summarize_lessons(self, lessons):
+        """Статистика дня (количество, экзамены, часы, доход) за один проход"""
+        oge_count = 0
+        ege_count = 0
+        total_hours = 0
+        income_forecast = 0
+        for lesson in lessons:
+            if lesson['exam_type'] == 'oge':
+                oge_count += 1
+            elif lesson['exam_type'] == 'ege':
+                ege_count += 1
+            total_hours += lesson['duration_hours'] or 0
+            income_forecast += lesson['lesson_price'] or 0
+
+        return {
+            'lessons_count': len(lessons),
+            'oge_count': oge_count,
+            'ege_count': ege_count,
+            'total_hours': round(total_hours, 1),
+            'income_forecast': income_forecast
+        }
+
+    def create_test_job(self, user_id, material_name, material_text, force_fresh=False, material_id=None):
+        """Создание задачи генерации теста в статусе queued; возвращает id задачи"""
+        job_id = uuid.uuid4().hex
         try:
-            cursor = connection.cursor()
+            with self.connection() as connection:
+                connection.execute("""
+                    INSERT INTO test_jobs (id, user_id, material_name, material_id, material_text, force_fresh)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (job_id, user_id, material_name, material_id, material_text, int(force_fresh)))
+                connection.commit()
+
+            print(f"📝 Задача генерации теста {job_id} поставлена в очередь")
+            return job_id
 
-            # Получаем занятия на указанную дату
-            schedule = self.get_schedule_for_date(tutor_id, date)
-            lessons_count = len(schedule)
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка создания задачи генерации теста: {e}")
+            return False
 
-            # Считаем распределение по экзаменам
-            oge_count = sum(1 for lesson in schedule if lesson.get('exam_type') == 'oge')
-            ege_count = sum(1 for lesson in schedule if lesson.get('exam_type') == 'ege')
+    def get_test_job(self, job_id):
+        """Задача генерации теста по id (None, если не найдена)"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("""
+                    SELECT id, user_id, material_name, material_id, status, result, error, attempts, from_cache,
+                           test_id, created_at, started_at, finished_at
+                    FROM test_jobs WHERE id = ?
+                """, (job_id,)).fetchone()
+                return dict(row) if row else None
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения задачи генерации теста: {e}")
+            return None
+
+    def get_test_job_material(self, job_id, user_id):
+        """Текст материала задачи пользователя (None, если задача чужая или не найдена)"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("SELECT material_text FROM test_jobs WHERE id = ? AND user_id = ?",
+                                         (job_id, user_id)).fetchone()
+                return row['material_text'] if row else None
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения материала задачи: {e}")
+            return None
 
-            # Считаем общее время и прогноз дохода
-            total_minutes = 0
-            total_income = 0
+    def start_test_job(self, job_id, owner=None):
+        """Перевод задачи из queued в running с арендой владельца owner.
 
-            for lesson in schedule:
-                # Вычисляем длительность занятия
-                start_time = datetime.strptime(lesson['start_time'], '%H:%M')
-                end_time = datetime.strptime(lesson['end_time'], '%H:%M')
-                duration = (end_time - start_time).seconds / 3600  # в часах
-                total_minutes += duration
+        Возвращает {'user_id', 'material_name', 'material_id', 'material_text', 'force_fresh'} или None,
+        если задачу уже взял другой обработчик.
+        """
+        try:
+            with self.connection() as connection:
+                cursor = connection.execute("""
+                    UPDATE test_jobs
+                    SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1,
+                        owner = ?, heartbeat_at = ?
+                    WHERE id = ? AND status = 'queued'
+                """, (owner, time.time(), job_id))
+                if cursor.rowcount != 1:
+                    return None
+                row = connection.execute("""
+                    SELECT user_id, material_name, material_id, material_text, force_fresh
+                    FROM test_jobs WHERE id = ?
+                """, (job_id,)).fetchone()
+                connection.commit()
+                return dict(row)
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка запуска задачи генерации теста: {e}")
+            return None
+
+    def finish_test_job(self, job_id, result=None, error=None, from_cache=False, owner=None):
+        """Сохранение результата (status done) или ошибки (status failed).
+
+        С owner результат сохраняется, только если задача еще выполняется
+        этим владельцем (аренду не забрал другой процесс); False - не сохранен.
+        """
+        try:
+            with self.connection() as connection:
+                query = """
+                    UPDATE test_jobs
+                    SET status = ?, result = ?, error = ?, from_cache = ?, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """
+                params = ['failed' if error else 'done', result, error, int(from_cache), job_id]
+                if owner is not None:
+                    query += " AND status = 'running' AND owner = ?"
+                    params.append(owner)
+                cursor = connection.execute(query, params)
+                connection.commit()
+            return cursor.rowcount == 1
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка сохранения задачи генерации теста: {e}")
+            return False
 
-                # Получаем стоимость занятия ученика
+    def renew_test_job_leases(self, owner):
+        """Продление аренды выполняющихся задач владельца; количество задач"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.execute(
+                    "UPDATE test_jobs SET heartbeat_at = ? WHERE status = 'running' AND owner = ?",
+                    (time.time(), owner))
+                connection.commit()
+                return cursor.rowcount
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка продления аренды задач генерации тестов: {e}")
+            return 0
+
+    def requeue_unfinished_test_jobs(self, lease_seconds=TEST_JOB_LEASE_SECONDS):
+        """Возврат в очередь прерванных задач: running, владелец которых не продлевал
+        аренду дольше lease_seconds. Задачи живых процессов не трогаются.
+        Возвращает id всех задач в очереди по порядку."""
+        try:
+            with self.connection() as connection:
+                connection.execute("""
+                    UPDATE test_jobs SET status = 'queued', owner = NULL
+                    WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+                """, (time.time() - lease_seconds,))
+                rows = connection.execute(
+                    "SELECT id FROM test_jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+                connection.commit()
+                return [row['id'] for row in rows]
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка восстановления очереди генерации тестов: {e}")
+            return []
+
+    def get_cached_test(self, cache_key):
+        """Тест из кэша по ключу (None, если нет); отмечает использование для LRU"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("SELECT result FROM test_cache WHERE cache_key = ?",
+                                         (cache_key,)).fetchone()
+                if row is None:
+                    return None
+                connection.execute("UPDATE test_cache SET hits = hits + 1, last_used = ? WHERE cache_key = ?",
+                                   (time.time(), cache_key))
+                connection.commit()
+                return row['result']
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка чтения кэша тестов: {e}")
+            return None
+
+    def save_cached_test(self, cache_key, model, material_name, result, max_bytes=TEST_CACHE_MAX_BYTES):
+        """Сохранение теста в кэш с вытеснением давно не использованных записей сверх max_bytes"""
+        try:
+            with self.connection() as connection:
+                connection.execute("""
+                    INSERT OR REPLACE INTO test_cache (cache_key, model, material_name, result, size_bytes, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (cache_key, model, material_name, result, len(result.encode('utf-8')), time.time()))
+
+                # Оставляем самые свежие записи, пока их суммарный размер не превышает max_bytes
+                evicted = connection.execute("""
+                    DELETE FROM test_cache WHERE cache_key IN (
+                        SELECT cache_key FROM (
+                            SELECT cache_key,
+                                   SUM(size_bytes) OVER (ORDER BY last_used DESC
+                                                         ROWS UNBOUNDED PRECEDING) as used_bytes
+                            FROM test_cache
+                        )
+                        WHERE used_bytes > ?
+                    )
+                """, (max_bytes,)).rowcount
+                connection.commit()
+
+            if evicted:
+                print(f"🧹 Из кэша тестов вытеснено записей: {evicted}")
+            return True
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка записи в кэш тестов: {e}")
+            return False
+
+    def invalidate_cached_tests(self, material_name=None):
+        """Удаление тестов из кэша: по материалу или всех; возвращает число записей"""
+        try:
+            with self.connection() as connection:
+                if material_name is None:
+                    deleted = connection.execute("DELETE FROM test_cache").rowcount
+                else:
+                    deleted = connection.execute("DELETE FROM test_cache WHERE material_name = ?",
+                                                 (material_name,)).rowcount
+                connection.commit()
+
+            print(f"🧹 Из кэша тестов удалено записей: {deleted}")
+            return deleted
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка очистки кэша тестов: {e}")
+            return 0
+
+    def save_generated_test(self, questions, material_name=None, material_id=None, created_by=None, title=None):
+        """Сохранение разобранного теста (llm.test_parser.parse_test) в банк вопросов.
+
+        Вопрос, почти совпадающий с уже имеющимся вопросом того же материала,
+        не добавляется повторно - тест ссылается на существующий.
+        Возвращает id теста или False.
+        """
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
                 cursor.execute("""
-                    SELECT lesson_price FROM users WHERE id = ?
-                """, (lesson.get('student_id'),))
-                student = cursor.fetchone()
-                if student:
-                    total_income += student['lesson_price']
+                    INSERT INTO tests (material_name, material_id, title, source, created_by)
+                    VALUES (?, ?, ?, 'llm', ?)
+                """, (material_name, material_id, title, created_by))
+                test_id = cursor.lastrowid
+
+                existing = self._bank_questions(cursor, material_name, material_id)
+                added = 0
+                question_ids = []
+                for question in questions:
+                    question_id = self._find_duplicate_question(existing, question['normalized'])
+                    if question_id is None:
+                        cursor.execute("""
+                            INSERT INTO questions (material_name, material_id, text, normalized, correct_option)
+                            VALUES (?, ?, ?, ?, ?)
+                        """, (material_name, material_id, question['text'], question['normalized'],
+                              question['correct']))
+                        question_id = cursor.lastrowid
+                        cursor.executemany("INSERT INTO options (question_id, letter, text) VALUES (?, ?, ?)",
+                                           [(question_id, letter, text)
+                                            for letter, text in sorted(question['options'].items())])
+                        existing.append((question_id, set(question['normalized'].split())))
+                        added += 1
+                    if question_id not in question_ids:
+                        question_ids.append(question_id)
+
+                cursor.executemany("INSERT INTO test_questions (test_id, position, question_id) VALUES (?, ?, ?)",
+                                   [(test_id, position, question_id)
+                                    for position, question_id in enumerate(question_ids, start=1)])
+                connection.commit()
 
-            return {
-                'lessons_count': lessons_count,
-                'oge_count': oge_count,
-                'ege_count': ege_count,
-                'total_hours': round(total_minutes, 1),
-                'income_forecast': total_income
-            }
+            print(f"📚 Тест {test_id} сохранен в банк: новых вопросов {added}, "
+                  f"повторов {len(questions) - added}")
+            return test_id
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка сохранения теста в банк: {e}")
+            return False
+
+    def _bank_questions(self, cursor, material_name, material_id):
+        """(id, набор слов) вопросов банка для материала"""
+        if material_id is not None:
+            cursor.execute("SELECT id, normalized FROM questions WHERE material_id = ?", (material_id,))
+        else:
+            cursor.execute("SELECT id, normalized FROM questions WHERE material_name IS ?", (material_name,))
+        return [(row['id'], set(row['normalized'].split())) for row in cursor.fetchall()]
+
+    def _find_duplicate_question(self, existing, normalized):
+        words = set(normalized.split())
+        for question_id, other in existing:
+            if similar_words(words, other):
+                return question_id
+        return None
+
+    def assemble_test(self, material_name=None, material_id=None, count=7, created_by=None):
+        """Новый тест из банка без обращения к модели: реже использованные
+        вопросы материала первыми. Возвращает id теста или None, если в банке
+        нет вопросов по материалу."""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                if material_id is not None:
+                    cursor.execute("""
+                        SELECT id FROM questions WHERE material_id = ?
+                        ORDER BY times_used, random() LIMIT ?
+                    """, (material_id, count))
+                else:
+                    cursor.execute("""
+                        SELECT id FROM questions WHERE material_name IS ?
+                        ORDER BY times_used, random() LIMIT ?
+                    """, (material_name, count))
+                question_ids = [row['id'] for row in cursor.fetchall()]
+                if not question_ids:
+                    return None
+
+                cursor.execute("""
+                    INSERT INTO tests (material_name, material_id, title, source, created_by)
+                    VALUES (?, ?, ?, 'bank', ?)
+                """, (material_name, material_id, 'Тест из банка вопросов', created_by))
+                test_id = cursor.lastrowid
+                cursor.executemany("INSERT INTO test_questions (test_id, position, question_id) VALUES (?, ?, ?)",
+                                   [(test_id, position, question_id)
+                                    for position, question_id in enumerate(question_ids, start=1)])
+                cursor.executemany("UPDATE questions SET times_used = times_used + 1 WHERE id = ?",
+                                   [(question_id,) for question_id in question_ids])
+                connection.commit()
+
+            print(f"📚 Собран тест {test_id} из {len(question_ids)} вопросов банка")
+            return test_id
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка сборки теста из банка: {e}")
+            return None
+
+    def get_test(self, test_id):
+        """Тест с вопросами и вариантами ответов (None, если не найден)"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT id, material_name, material_id, title, source, created_by, created_at
+                    FROM tests WHERE id = ?
+                """, (test_id,))
+                test = cursor.fetchone()
+                if test is None:
+                    return None
+
+                cursor.execute("""
+                    SELECT tq.position, q.id as question_id, q.text, q.correct_option,
+                           o.letter, o.text as option_text
+                    FROM test_questions tq
+                    JOIN questions q ON q.id = tq.question_id
+                    JOIN options o ON o.question_id = q.id
+                    WHERE tq.test_id = ?
+                    ORDER BY tq.position, o.letter
+                """, (test_id,))
+
+                questions = []
+                for row in cursor.fetchall():
+                    if not questions or questions[-1]['position'] != row['position']:
+                        questions.append({
+                            'position': row['position'],
+                            'id': row['question_id'],
+                            'text': row['text'],
+                            'correct_option': row['correct_option'],
+                            'options': []
+                        })
+                    questions[-1]['options'].append({'letter': row['letter'], 'text': row['option_text']})
+
+                test = dict(test)
+                test['questions'] = questions
+                return test
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения теста: {e}")
+            return None
+
+    def get_question_bank_summary(self):
+        """Количество вопросов банка по материалам"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT material_name, material_id, COUNT(*) as questions
+                    FROM questions
+                    GROUP BY material_name, material_id
+                    ORDER BY material_name, material_id
+                """)
+                return [dict(row) for row in cursor.fetchall()]
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения банка вопросов: {e}")
+            return []
+
+    def get_text_materials(self):
+        """Загруженные материалы с извлеченным текстом для заблаговременной генерации
+        тестов: сначала популярные, при равенстве - новые (без самого текста)"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT id, title, file_type, created_at, download_count
+                    FROM materials
+                    WHERE text_status = 'done'
+                    ORDER BY download_count DESC, created_at DESC
+                """)
+                return [dict(row) for row in cursor.fetchall()]
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения текстовых материалов: {e}")
+            return []
+
+    def get_material_text(self, material_id):
+        """Текст материала и состояние извлечения:
+        {'id', 'tutor_id', 'title', 'text_status', 'text_error', 'extracted_text'} или None"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("""
+                    SELECT id, tutor_id, title, text_status, text_error, extracted_text
+                    FROM materials
+                    WHERE id = ?
+                """, (material_id,)).fetchone()
+                return dict(row) if row else None
 
         except sqlite3.Error as e:
-            print(f"❌ Ошибка получения статистики расписания: {e}")
+            print(f"❌ Ошибка получения текста материала: {e}")
+            return None
+
+    def get_material_file(self, material_id):
+        """Файл материала для извлечения текста: {'id', 'file_path', 'file_type'} или None"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("SELECT id, file_path, file_type FROM materials WHERE id = ?",
+                                         (material_id,)).fetchone()
+                return dict(row) if row else None
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения файла материала: {e}")
+            return None
+
+    def get_pending_text_materials(self):
+        """id материалов, текст которых еще не извлечен, по порядку загрузки"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT id FROM materials WHERE text_status = 'pending' ORDER BY id")
+                return [row['id'] for row in cursor.fetchall()]
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка получения материалов без текста: {e}")
+            return []
+
+    def find_text_by_hash(self, content_hash):
+        """Уже извлеченный текст файла с таким SHA-256: (text_status, extracted_text) или None"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("""
+                    SELECT text_status, extracted_text
+                    FROM materials
+                    WHERE content_hash = ? AND text_status IN ('done', 'empty')
+                    LIMIT 1
+                """, (content_hash,)).fetchone()
+                return (row['text_status'], row['extracted_text']) if row else None
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка поиска текста по содержимому: {e}")
+            return None
+
+    def save_material_text(self, material_ids, content_hash, status, text=None, error=None):
+        """Результат извлечения текста для материалов material_ids (один файл может быть
+        загружен несколько раз); True при успехе"""
+        try:
+            with self.connection() as connection:
+                connection.executemany("""
+                    UPDATE materials
+                    SET content_hash = ?, text_status = ?, extracted_text = ?, text_error = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, [(content_hash, status, text, error, material_id) for material_id in material_ids])
+                connection.commit()
+                return True
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка сохранения текста материала: {e}")
+            return False
+
+    def search_materials(self, user_id, role, query=None, exam_type=None, category=None, limit=20, offset=0):
+        """Материалы, доступные пользователю (свои у репетитора, репетитора - у ученика).
+
+        С запросом query - полнотекстовый поиск (materials_fts) по названию,
+        описанию и извлеченному тексту: слова ищутся по началу, результаты
+        упорядочены по bm25, у каждого есть snippet - HTML-фрагмент с
+        найденными словами в <mark>. Без запроса - новые первыми.
+        exam_type oge/ege включает материалы для обоих экзаменов.
+        Возвращает {'materials': [...], 'total': число} или None при ошибке.
+        """
+        terms = SEARCH_TERM.findall((query or '').lower())[:MAX_SEARCH_TERMS]
+        columns = ', '.join(f'm.{column}' for column in MATERIAL_COLUMNS)
+
+        if role == 'tutor':
+            conditions, params = ['m.tutor_id = ?'], [user_id]
+        else:
+            conditions, params = ['m.tutor_id = (SELECT created_by FROM users WHERE id = ?)'], [user_id]
+        if exam_type in ('oge', 'ege'):
+            conditions.append("m.exam_type IN (?, 'both')")
+            params.append(exam_type)
+        elif exam_type == 'both':
+            conditions.append("m.exam_type = 'both'")
+        if category:
+            conditions.append('m.category = ?')
+            params.append(category)
+        where = ' AND '.join(conditions)
+
+        try:
+            with self.connection() as connection:
+                if terms:
+                    # Слова запроса - в кавычках, поэтому синтаксис FTS5 в запросе не работает
+                    match = ' '.join(f'"{term}"*' for term in terms)
+                    # CROSS JOIN закрепляет порядок: сначала совпадения из индекса, затем фильтры.
+                    # Иначе планировщик идет по idx_materials_tutor_id и повторяет MATCH для
+                    # каждого материала репетитора (секунды вместо миллисекунд)
+                    rows = connection.execute(f"""
+                        SELECT {columns}, COUNT(*) OVER () AS total
+                        FROM materials_fts
+                        CROSS JOIN materials m ON m.id = materials_fts.rowid
+                        WHERE materials_fts MATCH ? AND materials_fts.rank MATCH '{SEARCH_RANK}' AND {where}
+                        ORDER BY materials_fts.rank
+                        LIMIT ? OFFSET ?
+                    """, [match] + params + [limit, offset]).fetchall()
+                else:
+                    rows = connection.execute(f"""
+                        SELECT {columns}, COUNT(*) OVER () AS total
+                        FROM materials m
+                        WHERE {where}
+                        ORDER BY m.created_at DESC
+                        LIMIT ? OFFSET ?
+                    """, params + [limit, offset]).fetchall()
+
+                materials = [dict(row) for row in rows]
+                total = materials[0]['total'] if materials else 0
+                if not materials and offset:
+                    # Страница за последней: общее число - отдельным запросом
+                    total = self.search_materials(user_id, role, query, exam_type, category, 1, 0)['total']
+                for material in materials:
+                    del material['total']
+
+                if terms and materials:
+                    # Фрагменты строятся только для страницы: snippet() FTS5 разбирал бы текст целиком
+                    ids = [material['id'] for material in materials]
+                    texts = dict(connection.execute(
+                        f"SELECT id, extracted_text FROM materials WHERE id IN ({', '.join('?' * len(ids))})",
+                        ids).fetchall())
+                    pattern = re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, terms)) + r')\w*', re.IGNORECASE)
+                    for material in materials:
+                        material['snippet'] = _snippet(pattern, material['title'], material['description'],
+                                                       texts.get(material['id']))
+                return {'materials': materials, 'total': total}
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка поиска материалов: {e}")
+            return None
+
+    def get_test_job_counts(self):
+        """Сколько тестов запрашивали по каждому материалу llm/materials: {имя: число}"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    SELECT material_name, COUNT(*) as jobs
+                    FROM test_jobs
+                    WHERE material_name IS NOT NULL
+                    GROUP BY material_name
+                """)
+                return {row['material_name']: row['jobs'] for row in cursor.fetchall()}
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка подсчета задач генерации тестов: {e}")
             return {}
-        finally:
-            if connection:
-                connection.close()
\ No newline at end of file
+
+    def get_session(self, session_id):
+        """Серверная сессия: (сериализованные данные, expires_at, версия) или None, если ее нет или она истекла"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute(
+                    "SELECT data, expires_at, version FROM sessions WHERE id = ? AND expires_at > ?",
+                    (session_id, time.time())).fetchone()
+                return (row['data'], row['expires_at'], row['version']) if row else None
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка чтения сессии: {e}")
+            return None
+
+    def get_session_version(self, session_id):
+        """Версия действующей сессии (None, если ее нет или она истекла)"""
+        try:
+            with self.connection() as connection:
+                row = connection.execute("SELECT version FROM sessions WHERE id = ? AND expires_at > ?",
+                                         (session_id, time.time())).fetchone()
+                return row['version'] if row else None
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка чтения версии сессии: {e}")
+            return None
+
+    def save_session(self, session_id, data, expires_at):
+        """Сохранение сессии; возвращает ее новую версию (False при ошибке)"""
+        try:
+            with self.connection() as connection:
+                connection.execute("""
+                    INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at,
+                                                  version = version + 1, updated_at = CURRENT_TIMESTAMP
+                """, (session_id, data, expires_at))
+                # Транзакция записи еще открыта - другой процесс не мог изменить версию
+                version = connection.execute("SELECT version FROM sessions WHERE id = ?",
+                                             (session_id,)).fetchone()['version']
+                connection.commit()
+            return version
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка сохранения сессии: {e}")
+            return False
+
+    def delete_session(self, session_id):
+        try:
+            with self.connection() as connection:
+                connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                connection.commit()
+            return True
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка удаления сессии: {e}")
+            return False
+
+    def delete_expired_sessions(self):
+        """Удаление истекших сессий; возвращает их количество"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+                connection.commit()
+                return cursor.rowcount
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка удаления истекших сессий: {e}")
+            return 0
+
+    def set_test_job_test(self, job_id, test_id):
+        """Привязка разобранного теста к задаче генерации"""
+        try:
+            with self.connection() as connection:
+                connection.execute("UPDATE test_jobs SET test_id = ? WHERE id = ?", (test_id, job_id))
+                connection.commit()
+            return True
+
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка привязки теста к задаче: {e}")
+            return False
@@ -0,0 +1,83 @@
+"""Приведение баз, созданных до появления миграций, к схеме 0001.
+
+Таблицы таких баз уже существовали, поэтому CREATE TABLE IF NOT EXISTS
+из 0001 не добавил в них новые колонки. Здесь же выполняется то, что
+раньше делалось при каждом запуске: проверка пользователя tutor и
+первичное заполнение tutor_stats.
+"""
+
+
+def upgrade(db, connection):
+    cursor = connection.cursor()
+
+    cursor.execute("PRAGMA table_info(users)")
+    if 'exam_type' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE users ADD COLUMN exam_type VARCHAR(10) CHECK (exam_type IN ('oge', 'ege'))")
+
+    cursor.execute("PRAGMA table_info(schedule)")
+    if 'lesson_type' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE schedule ADD COLUMN lesson_type VARCHAR(10) DEFAULT 'regular'")
+
+    cursor.execute("PRAGMA table_info(income)")
+    if 'schedule_id' not in [column[1] for column in cursor.fetchall()]:
+        _rebuild_income(cursor)
+
+    # Репетитор по умолчанию должен быть активен и иметь пароль по умолчанию
+    cursor.execute("""
+        UPDATE users
+        SET password_hash = 'tutor',
+            is_active = 1,
+            role = 'tutor'
+        WHERE username = 'tutor'
+    """)
+
+    if db.rebuild_tutor_stats() is False:
+        raise RuntimeError('Не удалось заполнить tutor_stats')
+
+
+def _rebuild_income(cursor):
+    """Перестройка старой таблицы income (lesson_id вместо schedule_id, без status).
+
+    Платеж привязывается к расписанию урока lesson_id. Платежи, урок
+    которых не найден, перенести нельзя (schedule_id NOT NULL) - они
+    остаются в таблице income_legacy.
+    """
+    cursor.execute("ALTER TABLE income RENAME TO income_legacy")
+    # Индексы переехали вместе с таблицей; под этими именами они нужны новой income
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'income_legacy' "
+                   "AND sql IS NOT NULL")
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'DROP INDEX "{name}"')
+
+    cursor.execute("""
+        CREATE TABLE income (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            schedule_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            amount DECIMAL(10,2) NOT NULL,
+            payment_date DATE NOT NULL,
+            month_year VARCHAR(7) NOT NULL,
+            status VARCHAR(20) DEFAULT 'paid' CHECK (status IN ('paid', 'pending', 'overdue')),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (schedule_id) REFERENCES schedule(id) ON DELETE CASCADE,
+            FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_income_month ON income(month_year)")
+    cursor.execute("""
+        INSERT INTO income (id, schedule_id, student_id, amount, payment_date, month_year, status, created_at)
+        SELECT i.id, l.schedule_id, i.student_id, i.amount, i.payment_date, i.month_year, 'paid', i.created_at
+        FROM income_legacy i
+        JOIN lessons l ON l.id = i.lesson_id
+        JOIN schedule s ON s.id = l.schedule_id
+        JOIN users u ON u.id = i.student_id
+    """)
+    cursor.execute("DELETE FROM income_legacy WHERE id IN (SELECT id FROM income)")
+
+    cursor.execute("SELECT COUNT(*) FROM income_legacy")
+    left = cursor.fetchone()[0]
+    if left:
+        print(f"⚠️ Платежей без урока в расписании: {left}, они оставлены в income_legacy")
+    else:
+        cursor.execute("DROP TABLE income_legacy")
+
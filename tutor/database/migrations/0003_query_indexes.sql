@@ -0,0 +1,24 @@
+-- Составные и частичные индексы под основные запросы Database и app.py.
+-- Проверка: python -m bench.check_query_plans (из директории tutor/)
+
+-- Ученики репетитора: created_by + role + is_active, сортировка по created_at
+CREATE INDEX IF NOT EXISTS idx_users_tutor_students ON users(created_by, role, is_active, created_at);
+-- Заменен idx_users_tutor_students (тот же префикс)
+DROP INDEX IF EXISTS idx_users_created_by;
+
+-- Активное расписание репетитора по дню недели и типу занятия
+CREATE INDEX IF NOT EXISTS idx_schedule_active_tutor_day ON schedule(tutor_id, day_of_week, lesson_type)
+    WHERE status = 'active';
+
+-- Разовые занятия по дате; schedule_id нужен для соединения и каскадного удаления
+CREATE INDEX IF NOT EXISTS idx_single_lessons_date ON single_lessons(lesson_date, schedule_id);
+CREATE INDEX IF NOT EXISTS idx_single_lessons_schedule_id ON single_lessons(schedule_id);
+
+-- Доходы по слоту расписания и дате оплаты; student_id - для каскадного удаления
+CREATE INDEX IF NOT EXISTS idx_income_schedule_date ON income(schedule_id, payment_date);
+CREATE INDEX IF NOT EXISTS idx_income_student_id ON income(student_id);
+
+-- Материалы репетитора в порядке создания
+CREATE INDEX IF NOT EXISTS idx_materials_tutor_created ON materials(tutor_id, created_at);
+-- Заменен idx_materials_tutor_created (тот же префикс)
+DROP INDEX IF EXISTS idx_materials_tutor_id;
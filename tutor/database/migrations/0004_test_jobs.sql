@@ -0,0 +1,20 @@
+-- Фоновые задачи генерации тестов (services/test_job_service.py).
+-- Состояние хранится в базе, чтобы результаты и очередь пережили перезапуск.
+CREATE TABLE IF NOT EXISTS test_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    material_name VARCHAR(100),
+    material_text TEXT NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Незавершенные задачи при запуске приложения, по порядку постановки
+CREATE INDEX IF NOT EXISTS idx_test_jobs_status ON test_jobs(status, created_at);
+-- Задачи пользователя
+CREATE INDEX IF NOT EXISTS idx_test_jobs_user ON test_jobs(user_id, created_at);
@@ -0,0 +1,22 @@
+-- Кэш сгенерированных тестов. Ключ - sha256 запроса к модели
+-- (текст материала в промпте build_prompt, модель, параметры выборки),
+-- см. llm_client.cache_key. Вытеснение LRU по суммарному размеру.
+CREATE TABLE IF NOT EXISTS test_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    model VARCHAR(100) NOT NULL,
+    material_name VARCHAR(100),
+    result TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used REAL NOT NULL
+);
+
+-- Вытеснение: обход от недавно использованных к давним с суммой размеров
+CREATE INDEX IF NOT EXISTS idx_test_cache_lru ON test_cache(last_used, size_bytes);
+-- Сброс кэша по материалу
+CREATE INDEX IF NOT EXISTS idx_test_cache_material ON test_cache(material_name);
+
+-- Задача может требовать свежую генерацию и может быть выполнена из кэша
+ALTER TABLE test_jobs ADD COLUMN force_fresh INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE test_jobs ADD COLUMN from_cache INTEGER NOT NULL DEFAULT 0;
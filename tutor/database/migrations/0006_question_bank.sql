@@ -0,0 +1,51 @@
+-- Банк вопросов: тесты, разобранные из ответов модели (llm/test_parser.py),
+-- и тесты, собранные из уже имеющихся вопросов без обращения к модели.
+-- Вопросы привязаны к материалу: файлу llm/materials (material_name)
+-- или загруженному материалу (material_id).
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    material_name VARCHAR(100),
+    material_id INTEGER REFERENCES materials(id) ON DELETE SET NULL,
+    title VARCHAR(255),
+    source VARCHAR(10) NOT NULL DEFAULT 'llm' CHECK (source IN ('llm', 'bank')),
+    created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    material_name VARCHAR(100),
+    material_id INTEGER REFERENCES materials(id) ON DELETE SET NULL,
+    text TEXT NOT NULL,
+    -- Отсортированные уникальные слова формулировки: поиск повторов при вставке
+    normalized TEXT NOT NULL,
+    correct_option CHAR(1) NOT NULL,
+    times_used INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS options (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    letter CHAR(1) NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (question_id, letter)
+);
+
+CREATE TABLE IF NOT EXISTS test_questions (
+    test_id INTEGER NOT NULL REFERENCES tests(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    PRIMARY KEY (test_id, position)
+);
+
+-- Вопросы материала, редко использованные - первыми (сборка теста и поиск повторов)
+CREATE INDEX IF NOT EXISTS idx_questions_material_name ON questions(material_name, times_used);
+CREATE INDEX IF NOT EXISTS idx_questions_material_id ON questions(material_id, times_used);
+-- Каскадное удаление вопросов
+CREATE INDEX IF NOT EXISTS idx_test_questions_question ON test_questions(question_id);
+CREATE INDEX IF NOT EXISTS idx_tests_material_id ON tests(material_id);
+CREATE INDEX IF NOT EXISTS idx_tests_created_by ON tests(created_by);
+
+-- Тест, разобранный из результата задачи генерации
+ALTER TABLE test_jobs ADD COLUMN test_id INTEGER REFERENCES tests(id) ON DELETE SET NULL;
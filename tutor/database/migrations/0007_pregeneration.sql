@@ -0,0 +1,7 @@
+-- Заблаговременная генерация тестов (services/pregeneration_service.py)
+
+-- Текстовые материалы в порядке приоритета: популярные, затем новые
+CREATE INDEX IF NOT EXISTS idx_materials_pregeneration ON materials(file_type, download_count, created_at);
+
+-- Популярность материалов llm/materials: число запрошенных по ним тестов
+CREATE INDEX IF NOT EXISTS idx_test_jobs_material ON test_jobs(material_name);
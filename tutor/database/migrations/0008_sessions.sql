@@ -0,0 +1,11 @@
+-- Серверные сессии (services/session_service.py). В cookie хранится
+-- только случайный id, данные сессии - здесь в сериализованном виде.
+CREATE TABLE IF NOT EXISTS sessions (
+    id VARCHAR(64) PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Удаление истекших сессий
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
@@ -0,0 +1,18 @@
+-- Текст загруженных материалов (services/extraction_service.py).
+-- Извлекается из файла один раз в фоне; content_hash - SHA-256 файла,
+-- по нему текст повторно загруженного файла берется из уже извлеченного.
+ALTER TABLE materials ADD COLUMN content_hash VARCHAR(64);
+ALTER TABLE materials ADD COLUMN extracted_text TEXT;
+-- pending - ждет извлечения, done - текст есть, empty - в файле нет текста,
+-- unsupported - формат не поддерживается, failed - ошибка (см. text_error)
+ALTER TABLE materials ADD COLUMN text_status VARCHAR(12) NOT NULL DEFAULT 'pending'
+    CHECK (text_status IN ('pending', 'done', 'empty', 'unsupported', 'failed'));
+ALTER TABLE materials ADD COLUMN text_error TEXT;
+
+-- Поиск уже извлеченного текста по содержимому файла
+CREATE INDEX IF NOT EXISTS idx_materials_content_hash ON materials(content_hash);
+-- Материалы, ожидающие извлечения (при запуске приложения), и материалы с текстом
+-- в порядке заблаговременной генерации: популярные, затем новые
+CREATE INDEX IF NOT EXISTS idx_materials_text_status ON materials(text_status, download_count, created_at);
+-- Заменен idx_materials_text_status: заблаговременная генерация отбирает материалы по text_status
+DROP INDEX IF EXISTS idx_materials_pregeneration;
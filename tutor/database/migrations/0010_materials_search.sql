@@ -0,0 +1,40 @@
+-- Полнотекстовый поиск по материалам (GET /api/materials/search).
+-- Индекс FTS5 без копии данных (content='materials'): хранит только
+-- словарь и позиции, текст для snippet() читается из materials.
+-- unicode61 не учитывает регистр (и кириллицы тоже), remove_diacritics 2 -
+-- диакритику латиницы (cafe = café).
+CREATE VIRTUAL TABLE IF NOT EXISTS materials_fts USING fts5(
+    title,
+    description,
+    extracted_text,
+    content = 'materials',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+-- Индекс обновляется вместе с materials; изменение счетчика скачиваний его не трогает
+CREATE TRIGGER IF NOT EXISTS trg_materials_fts_insert
+AFTER INSERT ON materials
+BEGIN
+    INSERT INTO materials_fts (rowid, title, description, extracted_text)
+    VALUES (NEW.id, NEW.title, NEW.description, NEW.extracted_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_materials_fts_delete
+AFTER DELETE ON materials
+BEGIN
+    INSERT INTO materials_fts (materials_fts, rowid, title, description, extracted_text)
+    VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.extracted_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_materials_fts_update
+AFTER UPDATE OF title, description, extracted_text ON materials
+BEGIN
+    INSERT INTO materials_fts (materials_fts, rowid, title, description, extracted_text)
+    VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.extracted_text);
+    INSERT INTO materials_fts (rowid, title, description, extracted_text)
+    VALUES (NEW.id, NEW.title, NEW.description, NEW.extracted_text);
+END;
+
+-- Индексирование уже загруженных материалов
+INSERT INTO materials_fts (materials_fts) VALUES ('rebuild');
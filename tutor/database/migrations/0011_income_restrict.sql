@@ -0,0 +1,29 @@
+-- Платежи не удаляются вместе со слотом расписания или учеником.
+-- С PRAGMA foreign_keys = ON каскад ON DELETE CASCADE действительно
+-- выполняется: удаление слота стирало бы историю доходов. Теперь такое
+-- удаление завершается ошибкой FOREIGN KEY, пока у слота или ученика есть
+-- платежи (приложение и так не удаляет их, а помечает cancelled/is_active = 0).
+-- SQLite не изменяет внешние ключи через ALTER TABLE - таблица пересоздается.
+CREATE TABLE income_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    schedule_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    payment_date DATE NOT NULL,
+    month_year VARCHAR(7) NOT NULL,
+    status VARCHAR(20) DEFAULT 'paid' CHECK (status IN ('paid', 'pending', 'overdue')),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (schedule_id) REFERENCES schedule(id) ON DELETE RESTRICT,
+    FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE RESTRICT
+);
+
+INSERT INTO income_new (id, schedule_id, student_id, amount, payment_date, month_year, status, created_at)
+SELECT id, schedule_id, student_id, amount, payment_date, month_year, status, created_at FROM income;
+
+DROP TABLE income;
+ALTER TABLE income_new RENAME TO income;
+
+-- Индексы удалены вместе со старой таблицей
+CREATE INDEX IF NOT EXISTS idx_income_month ON income(month_year);
+CREATE INDEX IF NOT EXISTS idx_income_schedule_date ON income(schedule_id, payment_date);
+CREATE INDEX IF NOT EXISTS idx_income_student_id ON income(student_id);
@@ -0,0 +1,3 @@
+-- Загруженный материал, по которому создана задача: вопросы сгенерированного
+-- теста попадают в банк с этим material_id (assemble_test по материалу)
+ALTER TABLE test_jobs ADD COLUMN material_id INTEGER REFERENCES materials(id) ON DELETE SET NULL;
@@ -0,0 +1,6 @@
+-- Владелец выполняющейся задачи генерации и время его последнего сигнала.
+-- При запуске процесс возвращает в очередь только задачи, владелец которых
+-- давно не продлевал аренду (упал или остановлен), а не задачи живых
+-- процессов (несколько воркеров, перезагрузка).
+ALTER TABLE test_jobs ADD COLUMN owner VARCHAR(64);
+ALTER TABLE test_jobs ADD COLUMN heartbeat_at REAL;
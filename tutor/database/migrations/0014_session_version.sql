@@ -0,0 +1,3 @@
+-- Версия сессии растет при каждом сохранении. LRU-кэш процесса сверяет с
+-- ней свою копию, поэтому изменения и выход в другом процессе видны сразу.
+ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,154 @@
+import math
+import os
+import threading
+import time
+
+# Сколько генераций одновременно отправляется одному серверу модели (одна
+# генерация большого материала - до LMSTUDIO_CHUNK_CONCURRENCY запросов по частям)
+MAX_IN_FLIGHT = int(os.environ.get("LMSTUDIO_MAX_IN_FLIGHT", 2))
+# Сколько генераций может ждать; следующие сразу получают 429
+MAX_QUEUE = int(os.environ.get("LMSTUDIO_MAX_QUEUE", 30))
+# Начальная оценка длительности генерации для Retry-After, секунды
+EXPECTED_SECONDS = 60.0
+# Вес последней генерации в скользящей средней длительности
+DURATION_SMOOTHING = 0.2
+
+
+class AdmissionError(Exception):
+    """Генерация не принята: очередь заполнена или у пользователя уже есть генерация в очереди"""
+
+    def __init__(self, message, retry_after, pending=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.pending = pending
+
+
+class Ticket:
+    """Место генерации в очереди"""
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.ready = False
+        # id задачи TestJobService; None - потоковая генерация без задачи
+        self.job_id = None
+
+
+class AdmissionController:
+    """Допуск генераций к модели.
+
+    Одновременно выполняется не больше max_in_flight генераций, остальные
+    ждут в очереди по порядку постановки (не больше max_queue). У каждого
+    пользователя - не больше одной генерации в очереди или в работе.
+    Отказ - AdmissionError с оценкой Retry-After по средней длительности
+    генерации.
+    """
+
+    def __init__(self, max_in_flight=None, max_queue=None, expected_seconds=EXPECTED_SECONDS):
+        self.max_in_flight = max(1, max_in_flight or MAX_IN_FLIGHT)
+        self.max_queue = MAX_QUEUE if max_queue is None else max_queue
+        self.average_seconds = expected_seconds
+        self._waiting = []
+        self._running = set()
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.rejected = 0
+
+    def enqueue(self, user_id=None, force=False) -> Ticket:
+        """Постановка в очередь. force - без ограничений (восстановленные после
+        перезапуска задачи, фоновая генерация)."""
+        with self._cond:
+            if not force:
+                if user_id is not None:
+                    for ticket in self._waiting + list(self._running):
+                        if ticket.user_id == user_id:
+                            self.rejected += 1
+                            raise AdmissionError('Предыдущий тест еще генерируется', self._retry_after(), ticket)
+                # Свободные места выполнения тоже принимают генерации (ожидание - доли секунды)
+                free = max(0, self.max_in_flight - len(self._running))
+                if len(self._waiting) >= self.max_queue + free:
+                    self.rejected += 1
+                    raise AdmissionError('Очередь генерации тестов заполнена, попробуйте позже',
+                                         self._retry_after())
+            ticket = Ticket(user_id)
+            self._waiting.append(ticket)
+            self.admitted += 1
+            return ticket
+
+    def acquire(self, ticket, timeout=None) -> bool:
+        """Ожидание своей очереди; True - генерацию можно начинать.
+
+        Место получает самый ранний из ожидающих в acquire, поэтому билет,
+        владелец которого еще не дошел до acquire, не задерживает остальных.
+        """
+        with self._cond:
+            if ticket in self._running:
+                return True
+            if ticket not in self._waiting:
+                # Билет уже освобожден (release) - встает в конец очереди
+                self._waiting.append(ticket)
+            ticket.ready = True
+            try:
+                granted = self._cond.wait_for(lambda: self._can_start(ticket), timeout)
+            finally:
+                ticket.ready = False
+            if not granted:
+                return False
+            self._waiting.remove(ticket)
+            self._running.add(ticket)
+            ticket.started_at = time.monotonic()
+            return True
+
+    def release(self, ticket):
+        """Завершение генерации или уход из очереди"""
+        with self._cond:
+            if ticket in self._running:
+                self._running.remove(ticket)
+                duration = time.monotonic() - ticket.started_at
+                self.average_seconds += DURATION_SMOOTHING * (duration - self.average_seconds)
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            else:
+                return
+            self._cond.notify_all()
+
+    def position(self, ticket):
+        """Место в очереди с 1; 0 - генерация выполняется; None - билета нет"""
+        with self._cond:
+            if ticket in self._running:
+                return 0
+            if ticket in self._waiting:
+                return self._waiting.index(ticket) + 1
+            return None
+
+    def retry_after(self) -> int:
+        with self._cond:
+            return self._retry_after()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': len(self._running),
+                'queued': len(self._waiting),
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'average_seconds': round(self.average_seconds, 1),
+            }
+
+    @property
+    def queued(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def _can_start(self, ticket):
+        if len(self._running) >= self.max_in_flight:
+            return False
+        return next(waiting for waiting in self._waiting if waiting.ready) is ticket
+
+    def _retry_after(self):
+        """Примерное время до освобождения места в очереди, секунды"""
+        rounds = len(self._waiting) // self.max_in_flight + 1
+        return max(1, math.ceil(self.average_seconds * rounds))
@@ -0,0 +1,163 @@
+import math
+import re
+
+from utils.text import similar_words
+
+# Грубая оценка: символов русского текста на один токен модели
+CHARS_PER_TOKEN = 3
+
+# Итоговое количество вопросов теста (как в full_prompt.build_prompt)
+MIN_QUESTIONS = 5
+MAX_QUESTIONS = 7
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+QUESTION_START = re.compile(r'^\s*(\d+)[.)]\s+', re.MULTILINE)
+WORD = re.compile(r'\w+')
+ANSWER = re.compile(r'правильный ответ', re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _split_oversized(paragraph, max_tokens):
+    """Абзац больше бюджета делится по строкам, длинная строка - по символам"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    for line in paragraph.splitlines():
+        for start in range(0, len(line), max_chars):
+            yield line[start:start + max_chars]
+
+
+def chunk_material(text: str, max_tokens: int):
+    """Деление материала на части не больше max_tokens по границам абзацев"""
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph] if estimate_tokens(paragraph) <= max_tokens else _split_oversized(paragraph, max_tokens)
+        for piece in pieces:
+            # Учитываем разделитель абзацев, если часть уже не пуста
+            tokens = estimate_tokens(piece if not current else '\n\n' + piece)
+            if current and current_tokens + tokens > max_tokens:
+                tokens = estimate_tokens(piece)
+                chunks.append('\n\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def questions_per_chunk(chunk_count: int) -> int:
+    """Сколько вопросов просить у каждой части, чтобы после отбора осталось MAX_QUESTIONS"""
+    return max(2, min(MAX_QUESTIONS, math.ceil(MAX_QUESTIONS / chunk_count) + 1))
+
+
+def _question_starts(test_text):
+    """Начала вопросов. Следующий вопрос начинается только после строки
+    "Правильный ответ" предыдущего, поэтому нумерованные шаги внутри
+    условия не считаются новыми вопросами.
+    """
+    starts = []
+    for match in QUESTION_START.finditer(test_text):
+        if not starts or ANSWER.search(test_text, starts[-1].end(), match.start()):
+            starts.append(match)
+    return starts
+
+
+def split_questions(test_text: str):
+    """Вопросы теста в формате "1. ... Правильный ответ: X" без номеров"""
+    starts = _question_starts(test_text)
+    if not ANSWER.search(test_text):
+        # Ответы не размечены - делим только по номерам
+        starts = list(QUESTION_START.finditer(test_text))
+    questions = []
+    for i, match in enumerate(starts):
+        end = starts[i + 1].start() if i + 1 < len(starts) else len(test_text)
+        question = test_text[match.end():end].strip()
+        if question:
+            questions.append(question)
+
+    # Вопросы без правильного ответа отбрасываются, если есть полноценные
+    complete = [question for question in questions if ANSWER.search(question)]
+    return complete or questions
+
+
+def iter_questions(fragments):
+    """Вопросы (без номеров) из потока фрагментов ответа модели.
+
+    Вопрос отдается, когда в тексте появилось начало следующего; последний -
+    по окончании потока.
+    """
+    text = ''
+    emitted = 0
+    for fragment in fragments:
+        text += fragment
+        starts = _question_starts(text)
+        while emitted + 1 < len(starts):
+            question = text[starts[emitted].end():starts[emitted + 1].start()].strip()
+            emitted += 1
+            if question:
+                yield question
+
+    starts = _question_starts(text)
+    if emitted < len(starts):
+        question = text[starts[emitted].end():].strip()
+        if question:
+            yield question
+
+
+def stem_words(question):
+    """Набор слов формулировки вопроса (первой строки) для поиска повторов"""
+    return set(WORD.findall(question.splitlines()[0].lower()))
+
+
+def is_duplicate(words, seen):
+    return any(similar_words(words, other) for other in seen)
+
+
+def merge_questions(chunk_results, max_questions=MAX_QUESTIONS):
+    """Объединение вопросов частей: без почти одинаковых формулировок,
+    по очереди из каждой части, чтобы тест покрывал весь материал.
+    Если после этого вопросов меньше MIN_QUESTIONS, возвращаются похожие,
+    но не совпадающие по набору слов.
+    Возвращает тест в исходном нумерованном формате.
+    """
+    per_chunk = [split_questions(result) for result in chunk_results]
+    selected = []
+    skipped = []
+    seen = []
+
+    for round_index in range(max(map(len, per_chunk), default=0)):
+        for questions in per_chunk:
+            if len(selected) >= max_questions:
+                break
+            if round_index >= len(questions):
+                continue
+            question = questions[round_index]
+            words = stem_words(question)
+            if is_duplicate(words, seen):
+                skipped.append((question, words))
+                continue
+            seen.append(words)
+            selected.append(question)
+
+    for question, words in skipped:
+        if len(selected) >= MIN_QUESTIONS:
+            break
+        if words not in seen:
+            seen.append(words)
+            selected.append(question)
+
+    return format_questions(selected)
+
+
+def format_questions(questions):
+    """Тест в нумерованном формате build_prompt из вопросов без номеров"""
+    return '\n\n'.join(f'{number}. {question}' for number, question in enumerate(questions, start=1))
@@ -1,12 +1,42 @@
+import hashlib
+import json
 import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout, RequestException
-from full_prompt import build_prompt
+from llm.chunking import (MAX_QUESTIONS, chunk_material, estimate_tokens, is_duplicate, iter_questions,
+                           merge_questions, questions_per_chunk, stem_words)
+from llm.full_prompt import build_prompt
+from llm.preprocess import prepare_material
+from llm.router import LLMRouter
 
-LMSTUDIO_URL = "http://127.0.0.1:12345/v1/chat/completions"
-LMSTUDIO_MODEL = "google/gemma-3-4b"
+# Настройки по умолчанию; переопределяются переменными окружения или аргументами LLMClient.
+# LMSTUDIO_URL может содержать несколько серверов через запятую
+LMSTUDIO_URL = os.environ.get("LMSTUDIO_URL", "http://127.0.0.1:12345/v1/chat/completions")
+LMSTUDIO_MODEL = os.environ.get("LMSTUDIO_MODEL", "google/gemma-3-4b")
+CONNECT_TIMEOUT = float(os.environ.get("LMSTUDIO_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("LMSTUDIO_READ_TIMEOUT", 240))
+# Бюджет токенов одной части материала и число частей, генерируемых одновременно
+CHUNK_TOKENS = int(os.environ.get("LMSTUDIO_CHUNK_TOKENS", 1200))
+CHUNK_CONCURRENCY = int(os.environ.get("LMSTUDIO_CHUNK_CONCURRENCY", 4))
 MATERIAL_FILE = "z5.txt"
 
+SYSTEM_PROMPT = "Ты — генератор тестов. Ты создаешь вопросы строго по требованиям пользователя."
+
+# Ответы сервера, после которых имеет смысл повторить запрос
+RETRY_STATUSES = (429, 502, 503, 504)
+
+EMPTY_MATERIAL_ERROR = "❌ Ошибка: материал пуст, генерировать тест не по чему."
+
+MAX_TOKENS = 4000
+# Часть материала дает меньше вопросов, поэтому и ответ короче
+CHUNK_MAX_TOKENS = 1500
+
 
 def load_material() -> str:
     if not os.path.exists(MATERIAL_FILE):
@@ -16,61 +46,416 @@ def load_material() -> str:
         return f.read()
 
 
-def generate_test_from_text(max_retries=2):
-    material_text = load_material()
-    if material_text.startswith("❌"):
-        return material_text
-    prompt = build_prompt(material_text)
-
-    payload = {
-        "model": LMSTUDIO_MODEL,
-        "messages": [
-            {"role": "system",
-             "content": "Ты — генератор тестов. Ты создаешь вопросы строго по требованиям пользователя."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.1,
-        "max_tokens": 4000
-    }
-
-    for attempt in range(max_retries + 1):
-        try:
-            response = requests.post(LMSTUDIO_URL, json=payload, timeout=240)
+class LLMError(Exception):
+    """Ошибка потоковой генерации; текст, как и у строковых ошибок, начинается с ❌"""
+
+
+class CircuitBreaker:
+    """Размыкатель: после failure_threshold сбоев подряд запросы не
+    отправляются reset_timeout секунд, затем пропускается один пробный.
+    Успешный пробный запрос замыкает цепь, неудачный - размыкает снова.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Пробный запрос; остальные ждут его результата
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Сколько секунд цепь еще будет разомкнута"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """Клиент OpenAI-совместимого сервера (LM Studio).
+
+    Использует одну requests.Session с пулом keep-alive соединений,
+    повторяет запросы с экспоненциальной задержкой и джиттером и
+    через CircuitBreaker сразу отказывает, пока сервер недоступен.
+    Ошибки, как и раньше, возвращаются строкой, начинающейся с ❌.
+
+    url - один сервер или несколько (список или строка через запятую).
+    Запросы распределяет LLMRouter; после сбоя запрос сразу повторяется
+    на другом сервере, задержка - только когда отказали все.
+
+    Материал больше chunk_tokens делится на части по абзацам; вопросы по
+    частям генерируются параллельно (не больше chunk_concurrency запросов)
+    и объединяются в один тест без повторов.
+
+    Перед отправкой материал сжимается (prepare_material: пробелы, повторы
+    строк, бюджет material_tokens); пустой материал модели не отправляется.
+    """
+
+    def __init__(self, url=None, model=None, connect_timeout=None, read_timeout=None, max_retries=2,
+                 backoff_base=1.0, backoff_max=30.0, pool_size=4, failure_threshold=5, reset_timeout=30.0,
+                 chunk_tokens=None, chunk_concurrency=None, material_tokens=None):
+        urls = url or LMSTUDIO_URL
+        if isinstance(urls, str):
+            urls = [item.strip() for item in urls.split(",") if item.strip()]
+        self.url = urls[0]
+        self.model = model or LMSTUDIO_MODEL
+        self.timeout = (connect_timeout or CONNECT_TIMEOUT, read_timeout or READ_TIMEOUT)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.chunk_tokens = chunk_tokens or CHUNK_TOKENS
+        self.chunk_concurrency = chunk_concurrency or CHUNK_CONCURRENCY
+        self.material_tokens = material_tokens
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=max(pool_size, self.chunk_concurrency))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.router = LLMRouter(urls, lambda: CircuitBreaker(failure_threshold, reset_timeout), self.session)
+        if len(urls) > 1:
+            self.router.start_health_checks()
+
+    @property
+    def in_flight(self) -> int:
+        """Сколько запросов к модели выполняется сейчас (включая чтение потоковых ответов)"""
+        with self._in_flight_lock:
+            return self._in_flight
+
+    def retry_after(self) -> float:
+        """0, если хотя бы один сервер модели принимает запросы"""
+        return self.router.retry_after()
+
+    def _track(self, delta):
+        with self._in_flight_lock:
+            self._in_flight += delta
+
+    def build_payload(self, material_text: str, questions=None) -> dict:
+        """Тело запроса к модели для генерации теста по материалу (или его части)"""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_prompt(material_text, questions) if questions
+                 else build_prompt(material_text)}
+            ],
+            "temperature": 0.1,
+            "max_tokens": CHUNK_MAX_TOKENS if questions else MAX_TOKENS
+        }
+
+    def prepare(self, material_text: str) -> str:
+        """Сжатый материал для промпта (пустая строка, если текста нет)"""
+        prepared = prepare_material(material_text, self.material_tokens)
+        if prepared and len(prepared) < len(material_text):
+            print(f"🧹 Материал сжат: {len(material_text)} → {len(prepared)} символов "
+                  f"(~{estimate_tokens(prepared)} токенов)")
+        return prepared
+
+    def cache_key(self, material_text: str) -> str:
+        """sha256 запроса к модели: сжатый материал и шаблон промпта, модель, параметры
+        выборки и бюджет частей (от него зависит, как материал будет разделен)"""
+        material_text = prepare_material(material_text, self.material_tokens)
+        payload = json.dumps({"request": self.build_payload(material_text), "chunk_tokens": self.chunk_tokens},
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def backoff(self, attempt, retry_after=None) -> float:
+        """Задержка перед повтором: full jitter от base * 2^attempt (или Retry-After сервера)"""
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def generate_test(self, material_text: str, material_name=None, max_retries=None) -> str:
+        material_text = self.prepare(material_text)
+        if not material_text:
+            return EMPTY_MATERIAL_ERROR
+        chunks = chunk_material(material_text, self.chunk_tokens)
+        if len(chunks) <= 1:
+            return self.chat(self.build_payload(material_text), max_retries)
+
+        # Время генерации близко ко времени самой медленной части
+        questions = str(questions_per_chunk(len(chunks)))
+        with ThreadPoolExecutor(max_workers=min(self.chunk_concurrency, len(chunks))) as executor:
+            results = list(executor.map(
+                lambda chunk: self.chat(self.build_payload(chunk, questions), max_retries), chunks))
+
+        succeeded = [result for result in results if not result.startswith("❌")]
+        if not succeeded:
+            return results[0]
+        merged = merge_questions(succeeded)
+        return merged or "❌ Ошибка: модель не вернула вопросов в ожидаемом формате."
+
+    def stream_test(self, material_text: str, max_retries=None, heartbeat=None):
+        """Генератор вопросов теста (без номеров) по мере их готовности.
+
+        Вопрос отдается, как только модель начала следующий. Части большого
+        материала генерируются параллельно, повторы отбрасываются, всего не
+        больше MAX_QUESTIONS. Если задан heartbeat, при простое дольше heartbeat
+        секунд отдается None (например, для keep-alive в SSE). LLMError, если
+        не удалось получить ни одного вопроса.
+        """
+        material_text = self.prepare(material_text)
+        if not material_text:
+            raise LLMError(EMPTY_MATERIAL_ERROR)
+        chunks = chunk_material(material_text, self.chunk_tokens)
+        if len(chunks) == 1:
+            payloads = [self.build_payload(material_text)]
+        else:
+            questions = str(questions_per_chunk(len(chunks)))
+            payloads = [self.build_payload(chunk, questions) for chunk in chunks]
 
-            if response.status_code == 503:
-                if attempt < max_retries:
+        events = queue.Queue()
+        stop = threading.Event()
+
+        def produce(payload):
+            outcome = ("done", None)
+            try:
+                for question in iter_questions(self.stream_chat(payload, max_retries)):
+                    if stop.is_set():
+                        break
+                    events.put(("question", question))
+            except LLMError as e:
+                outcome = ("error", str(e))
+            except Exception as e:
+                print(f"❌ Неожиданная ошибка потоковой генерации: {e}")
+                outcome = ("error", f"❌ Ошибка: {e}")
+            finally:
+                # Без завершающего события генератор ждал бы эту часть бесконечно
+                events.put(outcome)
+
+        executor = ThreadPoolExecutor(max_workers=min(self.chunk_concurrency, len(payloads)))
+        for payload in payloads:
+            executor.submit(produce, payload)
+
+        seen = []
+        emitted = 0
+        errors = []
+        finished = 0
+        try:
+            while finished < len(payloads) and emitted < MAX_QUESTIONS:
+                try:
+                    kind, value = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield None
                     continue
-                return "❌ LM Studio ответил 503 (модель не готова или перегружена)."
 
-            if response.status_code == 404:
-                return "❌ Модель не найдена. Проверь название модели в LM Studio."
+                if kind == "question":
+                    words = stem_words(value)
+                    if is_duplicate(words, seen):
+                        continue
+                    seen.append(words)
+                    emitted += 1
+                    yield value
+                else:
+                    finished += 1
+                    if kind == "error":
+                        errors.append(value)
+        finally:
+            # Остальные потоки прекращают чтение ответов модели
+            stop.set()
+            executor.shutdown(wait=False)
 
-            if response.status_code == 500:
-                return "❌ Внутренняя ошибка LM Studio (500). Перезапусти модель."
+        if not emitted:
+            raise LLMError(errors[0] if errors else "❌ Ошибка: модель не вернула вопросов в ожидаемом формате.")
 
-            response.raise_for_status()
+    def stream_chat(self, payload: dict, max_retries=None):
+        """Генератор фрагментов ответа модели (chat/completions со stream: true).
+        LLMError, если ответ получить не удалось.
+        """
+        self._log_prompt(payload)
+        self._track(1)
+        try:
+            response, error = self._send(dict(payload, stream=True), max_retries, stream=True)
+            if error:
+                raise LLMError(error)
 
+            # text/event-stream без charset requests декодировал бы как latin-1
+            response.encoding = "utf-8"
+            with response:
+                try:
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or [{}]
+                        content = choices[0].get("delta", {}).get("content")
+                        if content:
+                            yield content
+                except RequestException as e:
+                    self.router.record_failure(response.backend)
+                    raise LLMError(f"❌ Ошибка HTTP: {str(e)}")
+                except ValueError as e:
+                    raise LLMError(f"❌ Некорректный ответ модели: {str(e)}")
+                finally:
+                    self.router.release(response.backend)
+        finally:
+            self._track(-1)
+
+    def chat(self, payload: dict, max_retries=None) -> str:
+        """Ответ модели на запрос chat/completions или строка с ошибкой"""
+        self._log_prompt(payload)
+        self._track(1)
+        try:
+            response, error = self._send(payload, max_retries)
+        finally:
+            self._track(-1)
+        if error:
+            return error
+
+        try:
             data = response.json()
             content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            if not content:
-                return "❌ Ошибка: пустой ответ от модели."
+        except Exception as e:
+            return f"❌ Неожиданная ошибка: {str(e)}"
+        finally:
+            self.router.release(response.backend)
+        usage = data.get("usage") or {}
+        if usage.get("prompt_tokens"):
+            print(f"🧮 Ответ модели: {usage['prompt_tokens']} токенов промпта, "
+                  f"{usage.get('completion_tokens')} токенов ответа")
+        if not content:
+            return "❌ Ошибка: пустой ответ от модели."
 
-            return content.strip()
+        return content.strip()
 
-        except ConnectionError:
-            if attempt < max_retries:
-                continue
-            return "❌ Ошибка подключения: LM Studio не отвечает."
+    @staticmethod
+    def _log_prompt(payload):
+        # Длина промпта определяет время обработки запроса моделью
+        prompt = "".join(message.get("content", "") for message in payload.get("messages", []))
+        print(f"🧮 Запрос к модели: ~{estimate_tokens(prompt)} токенов промпта, "
+              f"max_tokens {payload.get('max_tokens')}")
 
-        except Timeout:
-            if attempt < max_retries:
-                continue
-            return "❌ Таймаут: модель слишком долго формирует ответ."
+    def _send(self, payload: dict, max_retries=None, stream=False):
+        """POST с повторами и размыкателями: (response, None) или (None, строка с ошибкой).
 
-        except RequestException as e:
-            return f"❌ Ошибка HTTP: {str(e)}"
+        Успешный response.backend - сервер, ответивший на запрос; после чтения
+        ответа его нужно вернуть через self.router.release(response.backend).
+        """
+        error = "❌ Ошибка: не удалось получить ответ от модели."
+        retry_after = None
+        max_retries = self.max_retries if max_retries is None else max_retries
+        failover = len(self.router.backends) > 1
+        tried = set()
+
+        attempt = 0
+        while attempt <= max_retries:
+            backend = self.router.acquire(exclude=tried)
+            if backend is None and tried:
+                # Все серверы уже отказали - повтор после задержки
+                attempt += 1
+                if attempt > max_retries:
+                    break
+                time.sleep(self.backoff(attempt - 1, retry_after))
+                retry_after = None
+                tried.clear()
+                backend = self.router.acquire()
+            if backend is None:
+                return None, (f"❌ LM Studio временно недоступен: повторите через "
+                              f"{self.router.retry_after():.0f} с.")
+            tried.add(backend)
+
+            try:
+                response = self.session.post(backend.url, json=payload, timeout=self.timeout, stream=stream)
+
+                if response.status_code in RETRY_STATUSES:
+                    self.router.release(backend, ok=False)
+                    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                    response.close()
+                    error = f"❌ LM Studio ответил {response.status_code} (модель не готова или перегружена)."
+                    continue
+
+                if response.status_code >= 500:
+                    self.router.release(backend, ok=False)
+                    response.close()
+                    error = f"❌ Внутренняя ошибка LM Studio ({response.status_code}). Перезапусти модель."
+                    if failover:
+                        # Другой сервер может ответить; этот исключен до конца попытки
+                        continue
+                    return None, error
+
+                # Сервер отвечает - остальные ошибки не повод размыкать цепь
+                self.router.record_success(backend)
+
+                if response.status_code == 404:
+                    self.router.release(backend)
+                    response.close()
+                    return None, "❌ Модель не найдена. Проверь название модели в LM Studio."
+
+                response.raise_for_status()
+                response.backend = backend
+                return response, None
+
+            except ConnectionError:
+                self.router.release(backend, ok=False)
+                error = "❌ Ошибка подключения: LM Studio не отвечает."
+
+            except Timeout:
+                self.router.release(backend, ok=False)
+                error = "❌ Таймаут: модель слишком долго формирует ответ."
+
+            except RequestException as e:
+                self.router.release(backend, ok=False if e.response is None else None)
+                return None, f"❌ Ошибка HTTP: {str(e)}"
+
+            except Exception as e:
+                self.router.release(backend, ok=False)
+                return None, f"❌ Неожиданная ошибка: {str(e)}"
+
+        return None, error
+
+
+def _parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# Общий клиент приложения
+default_client = LLMClient()
+
+
+def build_payload(material_text: str) -> dict:
+    return default_client.build_payload(material_text)
+
+
+def cache_key(material_text: str) -> str:
+    return default_client.cache_key(material_text)
 
-        except Exception as e:
-            return f"❌ Неожиданная ошибка: {str(e)}"
 
-    return "❌ Ошибка: не удалось получить ответ от модели."
+def generate_test_from_text(material_text=None, material_name=None, max_retries=None):
+    """Генерация теста по тексту материала (без текста - по MATERIAL_FILE)"""
+    if material_text is None:
+        material_text = load_material()
+        if material_text.startswith("❌"):
+            return material_text
+    return default_client.generate_test(material_text, material_name, max_retries)
@@ -0,0 +1,65 @@
+import os
+import re
+
+from llm.chunking import CHARS_PER_TOKEN, PARAGRAPH_BREAK, estimate_tokens
+
+# Бюджет материала на одну генерацию, токенов (больший материал обрезается по абзацам)
+MATERIAL_TOKEN_BUDGET = int(os.environ.get("LMSTUDIO_MATERIAL_TOKENS", 6000))
+
+# Повторы строк короче этого не удаляются: короткие строки ("1. ААААА", "Решение:")
+# обычно часть условия, а длинные повторы - общие определения из соседних задач
+MIN_DUPLICATE_LINE_CHARS = 40
+
+SPACES = re.compile(r'[ \t\u00a0\u2000-\u200b\u202f\u3000]+')
+BLANK_LINES = re.compile(r'\n{3,}')
+LINE_KEY = re.compile(r'\W+')
+
+
+def normalize_whitespace(text: str) -> str:
+    """Пробелы и табуляции - одним пробелом, без пробелов по краям строк,
+    не больше одной пустой строки подряд"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [SPACES.sub(' ', line).strip() for line in text.split('\n')]
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def strip_duplicate_lines(text: str, min_chars=MIN_DUPLICATE_LINE_CHARS) -> str:
+    """Удаление повторов длинных строк (без учета регистра и знаков препинания);
+    остается первое вхождение"""
+    seen = set()
+    lines = []
+    for line in text.split('\n'):
+        if len(line) >= min_chars:
+            key = LINE_KEY.sub(' ', line.lower()).strip()
+            if key in seen:
+                continue
+            seen.add(key)
+        lines.append(line)
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def trim_to_budget(text: str, max_tokens: int) -> str:
+    """Первые абзацы материала, помещающиеся в max_tokens; абзац больше
+    бюджета обрезается по символам"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    used = 0
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        tokens = estimate_tokens(paragraph if not kept else '\n\n' + paragraph)
+        if used + tokens > max_tokens:
+            if not kept:
+                kept.append(paragraph[:max_tokens * CHARS_PER_TOKEN])
+            break
+        kept.append(paragraph)
+        used += tokens
+    return '\n\n'.join(kept)
+
+
+def prepare_material(text, max_tokens=None) -> str:
+    """Материал для промпта: нормализованные пробелы, без повторов строк,
+    не больше max_tokens (по умолчанию MATERIAL_TOKEN_BUDGET). Пустая строка,
+    если в материале нет текста."""
+    if not text:
+        return ''
+    return trim_to_budget(strip_duplicate_lines(normalize_whitespace(text)), max_tokens or MATERIAL_TOKEN_BUDGET)
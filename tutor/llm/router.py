@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+import requests
+
+# Как часто проверять серверы модели (GET .../v1/models), секунды
+HEALTH_INTERVAL = float(os.environ.get("LMSTUDIO_HEALTH_INTERVAL", 10))
+HEALTH_TIMEOUT = 2.0
+
+
+class Backend:
+    """Сервер модели: адрес, число выполняющихся запросов и свой размыкатель"""
+
+    def __init__(self, url, breaker):
+        self.url = url
+        self.models_url = url.rsplit("/chat/completions", 1)[0] + "/models"
+        self.breaker = breaker
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class LLMRouter:
+    """Распределение запросов между несколькими OpenAI-совместимыми серверами.
+
+    Запрос получает доступный сервер с наименьшим числом выполняющихся
+    запросов (при равенстве - с меньшим числом запросов всего). Сервер
+    исключается, пока разомкнут его размыкатель (после серии сбоев) или
+    пока не проходит проверку GET /v1/models; любой ответ сервера на
+    проверку, кроме 5xx, возвращает его в работу.
+    """
+
+    def __init__(self, urls, breaker_factory, session=None, health_interval=HEALTH_INTERVAL):
+        if not urls:
+            raise ValueError("Не указан ни один сервер модели")
+        self.backends = [Backend(url, breaker_factory()) for url in urls]
+        self.session = session or requests.Session()
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def acquire(self, exclude=()):
+        """Сервер для запроса (его outstanding увеличивается) или None, если доступных нет"""
+        with self._lock:
+            candidates = sorted((backend for backend in self.backends
+                                 if backend not in exclude and backend.healthy),
+                                key=lambda backend: (backend.outstanding, backend.requests))
+            for backend in candidates:
+                # allow() пропускает и пробный запрос к разомкнутому давно серверу
+                if backend.breaker.allow():
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+            return None
+
+    def release(self, backend, ok=None):
+        """Завершение запроса; ok=True/False - исход для размыкателя сервера"""
+        with self._lock:
+            backend.outstanding -= 1
+        if ok is True:
+            self.record_success(backend)
+        elif ok is False:
+            self.record_failure(backend)
+
+    def record_success(self, backend):
+        backend.breaker.record_success()
+
+    def record_failure(self, backend):
+        backend.failures += 1
+        backend.breaker.record_failure()
+
+    def retry_after(self) -> float:
+        """0, если есть доступный сервер, иначе - через сколько секунд освободится первый"""
+        available = [backend for backend in self.backends if backend.healthy]
+        if not available:
+            return self.health_interval
+        return min(backend.breaker.retry_after() for backend in available)
+
+    def check_health(self):
+        """Проверка всех серверов; возвращает число доступных"""
+        for backend in self.backends:
+            try:
+                response = self.session.get(backend.models_url, timeout=HEALTH_TIMEOUT)
+                healthy = response.status_code < 500
+                response.close()
+            except requests.RequestException:
+                healthy = False
+            if healthy != backend.healthy:
+                print(f"{'✅' if healthy else '⚠️'} Сервер модели {backend.url} "
+                      f"{'снова доступен' if healthy else 'не отвечает и исключен'}")
+            backend.healthy = healthy
+        return sum(backend.healthy for backend in self.backends)
+
+    def start_health_checks(self):
+        if self._health_thread is not None:
+            return
+        self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self):
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            self.check_health()
@@ -0,0 +1,102 @@
+import threading
+
+
+class Flight:
+    """Одна выполняющаяся генерация; ожидающие получают ее результат"""
+
+    def __init__(self, key):
+        self.key = key
+        self.result = None
+        self.error = None
+        # Ведущий ушел без результата - ожидающие повторяют генерацию сами
+        self.abandoned = False
+        self.waiters = 0
+        self._done = threading.Event()
+
+    def wait(self, timeout=None) -> bool:
+        """True, когда результат готов (False - истек timeout)"""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных генераций.
+
+    Первый вызов с ключом (ведущий) выполняет работу, остальные до его
+    завершения ждут и получают тот же результат. После завершения ключ
+    освобождается: следующие вызовы берут результат уже из кэша тестов.
+    Если ведущий ушел, не получив результата (abandon), ожидающие не
+    получают ошибку: первый из них становится новым ведущим.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """(flight, True) для ведущего, (flight, False) для присоединившегося"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, flight, result=None, error=None):
+        """Завершение ведущим; будит всех ожидающих"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.result = result
+        flight.error = error
+        flight._done.set()
+
+    def abandon(self, flight):
+        """Ведущий прекратил работу без результата (например, клиент закрыл соединение)"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.abandoned = True
+        flight._done.set()
+
+    def do(self, key, fn, on_join=None):
+        """(результат fn(), shared); shared=True, если результат получен от другого вызова.
+        Исключение ведущего передается и присоединившимся. on_join вызывается
+        перед ожиданием чужого результата (например, чтобы освободить место в очереди)."""
+        while True:
+            flight, leader = self.begin(key)
+            if leader:
+                break
+            if on_join:
+                on_join()
+            flight.wait()
+            if flight.abandoned:
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(flight, error=e)
+            raise
+        self.finish(flight, result=result)
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiting': sum(flight.waiters for flight in self._flights.values()),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,55 @@
+import re
+
+from llm.chunking import WORD, split_questions
+
+OPTION_LINE = re.compile(r'^\s*([A-DА-Г])[).]\s*(.+?)\s*$')
+ANSWER_LINE = re.compile(r'правильный ответ\s*:?\s*\**\s*([A-DА-Г])', re.IGNORECASE)
+
+# Кириллические буквы вариантов, которые модель иногда путает с латинскими
+CYRILLIC_LETTERS = str.maketrans('АБВГ', 'ABCD')
+OPTION_LETTERS = ('A', 'B', 'C', 'D')
+
+
+def parse_question(block: str):
+    """Вопрос без номера -> {'text', 'options': {буква: текст}, 'correct', 'normalized'}
+    или None, если нет четырех вариантов или правильного ответа"""
+    stem = []
+    options = {}
+    correct = None
+
+    for line in block.splitlines():
+        answer = ANSWER_LINE.search(line)
+        if answer:
+            correct = answer.group(1).translate(CYRILLIC_LETTERS)
+            continue
+        option = OPTION_LINE.match(line)
+        if option:
+            options[option.group(1).translate(CYRILLIC_LETTERS)] = option.group(2)
+        elif not options:
+            # Формулировка - все строки до первого варианта
+            stem.append(line.strip())
+
+    text = '\n'.join(line for line in stem if line).strip()
+    if not text or correct not in options or set(options) != set(OPTION_LETTERS):
+        return None
+    return {'text': text, 'options': options, 'correct': correct, 'normalized': normalize_question(text)}
+
+
+def parse_test(test_text: str):
+    """Разбор теста в формате build_prompt ("1. ... A) ... Правильный ответ: X").
+    Вопросы, которые не удалось разобрать, пропускаются."""
+    questions = []
+    for block in split_questions(test_text):
+        question = parse_question(block)
+        if question:
+            questions.append(question)
+    return questions
+
+
+def question_words(text: str):
+    """Набор слов всей формулировки вопроса (для поиска почти одинаковых)"""
+    return set(WORD.findall(text.lower()))
+
+
+def normalize_question(text: str) -> str:
+    return ' '.join(sorted(question_words(text)))
@@ -0,0 +1,272 @@
+import atexit
+import hashlib
+import os
+import queue
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from database.database import Database
+
+# Сколько процессов извлекают текст одновременно
+DEFAULT_WORKERS = int(os.environ.get('TUTOR_EXTRACTION_WORKERS', min(2, os.cpu_count() or 1)))
+# Больше этого текст не сохраняется: для генерации теста все равно берется начало материала
+MAX_TEXT_CHARS = 1_000_000
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+SLIDE_NAME = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+
+
+class UnsupportedFormatError(Exception):
+    """Текст из файла такого типа извлечь нельзя"""
+
+
+class MissingDependencyError(UnsupportedFormatError):
+    """Для формата нужен не установленный пакет"""
+
+
+def file_hash(path):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_text(path, file_type):
+    """Текст файла материала (выполняется в процессе пула).
+
+    txt читается как UTF-8 или cp1251, docx и pptx разбираются как
+    OOXML-архивы, pdf - пакетом pypdf (MissingDependencyError, если он
+    не установлен). UnsupportedFormatError для остальных форматов.
+    """
+    extractor = EXTRACTORS.get(file_type)
+    if extractor is None:
+        raise UnsupportedFormatError(f'Извлечение текста из {file_type} не поддерживается')
+    return extractor(path)[:MAX_TEXT_CHARS]
+
+
+def _extract_txt(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+def _extract_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise MissingDependencyError('Для извлечения текста из PDF установите пакет pypdf')
+    reader = PdfReader(path)
+    return '\n\n'.join((page.extract_text() or '').strip() for page in reader.pages)
+
+
+def _paragraphs(root, ns):
+    """Абзацы OOXML-документа: текст элементов <t>, табуляции и переносы строк"""
+    paragraphs = []
+    for paragraph in root.iter(f'{ns}p'):
+        parts = []
+        for element in paragraph.iter():
+            if element.tag == f'{ns}t':
+                parts.append(element.text or '')
+            elif element.tag == f'{ns}tab':
+                parts.append('\t')
+            elif element.tag in (f'{ns}br', f'{ns}cr'):
+                parts.append('\n')
+        paragraphs.append(''.join(parts))
+    return paragraphs
+
+
+def _extract_docx(path):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            root = ElementTree.fromstring(archive.read('word/document.xml'))
+    except (zipfile.BadZipFile, KeyError):
+        raise UnsupportedFormatError('Файл не является документом DOCX')
+    return '\n'.join(_paragraphs(root, WORD_NS))
+
+
+def _extract_pptx(path):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            # Слайды по номеру: slide10.xml идет после slide9.xml
+            names = sorted((int(match.group(1)), name) for name in archive.namelist()
+                           for match in [SLIDE_NAME.match(name)] if match)
+            slides = [ElementTree.fromstring(archive.read(name)) for _, name in names]
+    except zipfile.BadZipFile:
+        raise UnsupportedFormatError('Файл не является презентацией PPTX')
+    return '\n\n'.join('\n'.join(paragraph for paragraph in _paragraphs(slide, DRAWING_NS) if paragraph.strip())
+                       for slide in slides)
+
+
+EXTRACTORS = {
+    'txt': _extract_txt,
+    'pdf': _extract_pdf,
+    'docx': _extract_docx,
+    'pptx': _extract_pptx,
+}
+
+
+class ExtractionService:
+    """Фоновое извлечение текста из загруженных материалов.
+
+    Материал ставится в очередь при загрузке (submit), а при запуске - все
+    материалы со статусом pending; до запуска материалы остаются pending. Поток очереди считает SHA-256 файла:
+    если файл с таким содержимым уже разбирался, текст копируется из
+    него, иначе разбор выполняет пул процессов (извлечение из PDF
+    нагружает процессор и в потоках мешало бы веб-обработчикам).
+    Одновременные загрузки одного файла разбираются один раз. Результат
+    сохраняется в колонках materials (extracted_text, text_status).
+    Разбираются только файлы из upload_dir: file_path материала,
+    созданного через API, задает клиент. Пул процессов создается при
+    первом разборе и останавливается при выходе из программы.
+    """
+
+    def __init__(self, db: Database, upload_dir, workers=DEFAULT_WORKERS, on_extracted=None):
+        self.db = db
+        self.upload_dir = upload_dir
+        self.workers = max(1, workers)
+        # Вызывается с id материала, у которого появился текст
+        self.on_extracted = on_extracted
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # SHA-256 -> id материалов, ожидающих разбора этого файла
+        self._pending = {}
+        self._executor = None
+        self._thread = None
+        self.stats = {'extracted': 0, 'reused': 0, 'empty': 0, 'unsupported': 0, 'failed': 0}
+
+    def start(self):
+        """Запуск очереди и постановка в нее материалов без текста"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._loop, name='text-extraction', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+        pending = self.db.get_pending_text_materials()
+        for material_id in pending:
+            self.submit(material_id)
+        print(f"📄 Извлечение текста материалов запущено (процессов: {self.workers}, в очереди: {len(pending)})")
+        return True
+
+    def stop(self):
+        """Остановка пула процессов; незавершенные материалы разберутся после запуска"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def submit(self, material_id):
+        if self.running:
+            self._queue.put(material_id)
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, queued=self._queue.qsize(), extracting=len(self._pending),
+                        running=self.running)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _loop(self):
+        while True:
+            material_id = self._queue.get()
+            try:
+                self._dispatch(material_id)
+            except Exception as e:
+                print(f"❌ Ошибка извлечения текста материала {material_id}: {e}")
+                self._save([material_id], None, 'failed', error=str(e))
+
+    def _dispatch(self, material_id):
+        material = self.db.get_material_file(material_id)
+        if material is None:
+            return
+        path = material['file_path']
+        if not path or not os.path.isfile(path):
+            self._save([material_id], None, 'failed', error='Файл материала не найден')
+            return
+        if os.path.commonpath([os.path.realpath(path), os.path.realpath(self.upload_dir)]) != \
+                os.path.realpath(self.upload_dir):
+            self._save([material_id], None, 'failed', error='Файл материала вне папки загрузок')
+            return
+        if material['file_type'] not in EXTRACTORS:
+            self._save([material_id], None, 'unsupported',
+                       error=f"Извлечение текста из {material['file_type']} не поддерживается")
+            return
+
+        content_hash = file_hash(path)
+        with self._lock:
+            if content_hash in self._pending:
+                self._pending[content_hash].append(material_id)
+                return
+
+        known = self.db.find_text_by_hash(content_hash)
+        if known is not None:
+            status, text = known
+            self._save([material_id], content_hash, status, text, reused=True)
+            return
+
+        with self._lock:
+            self._pending[content_hash] = [material_id]
+        future = self._pool().submit(extract_text, path, material['file_type'])
+        future.add_done_callback(lambda done: self._finish(content_hash, done))
+
+    def _finish(self, content_hash, future):
+        if future.cancelled():
+            # Пул остановлен при выходе - материалы остаются pending
+            with self._lock:
+                self._pending.pop(content_hash, None)
+            return
+        text = error = None
+        try:
+            text = future.result().strip()
+            status = 'done' if text else 'empty'
+        except MissingDependencyError as e:
+            # Материал останется pending и будет разобран после установки пакета и перезапуска
+            status, error = 'pending', str(e)
+        except UnsupportedFormatError as e:
+            status, error = 'unsupported', str(e)
+        except Exception as e:
+            status, error = 'failed', str(e)
+
+        # Пока результат не сохранен, загрузки того же файла ждут его в _pending
+        with self._lock:
+            material_ids = list(self._pending[content_hash])
+        if status == 'done':
+            print(f"📄 Текст извлечен: материалы {material_ids}, {len(text)} символов")
+        elif error:
+            print(f"⚠️ Текст материалов {material_ids} не извлечен: {error}")
+        self._save(material_ids, content_hash, status, text, error)
+        with self._lock:
+            late = self._pending.pop(content_hash)[len(material_ids):]
+        if late:
+            self._save(late, content_hash, status, text, error)
+
+    def _save(self, material_ids, content_hash, status, text=None, error=None, reused=False):
+        with self._lock:
+            key = 'reused' if reused else 'extracted' if status == 'done' else status
+            if key in self.stats:
+                self.stats[key] += len(material_ids)
+        if not self.db.save_material_text(material_ids, content_hash, status, text, error):
+            return
+        if status == 'done' and self.on_extracted:
+            for material_id in material_ids:
+                self.on_extracted(material_id)
@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import Counter, deque
+
+from database.database import Database
+
+# Размер скользящего окна: сколько последних запросов хранится по каждому маршруту
+WINDOW_SIZE = 500
+
+# Границы корзин гистограммы времени запроса, мс
+HISTOGRAM_BOUNDS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Одно и то же выражение, выполненное столько раз за запрос, - признак N+1
+N_PLUS_ONE_THRESHOLD = 10
+
+# Длина текста выражения в отчете
+STATEMENT_PREVIEW = 300
+
+
+def _normalize(sql):
+    return ' '.join(sql.split())
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RequestStats:
+    """Счетчики одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.connections = 0
+        self.connections_opened = 0
+        # Нормализованный текст выражения -> [число выполнений, время]
+        self.by_statement = {}
+
+    def add(self, sql, seconds, executed):
+        entry = self.by_statement.get(sql)
+        if entry is None:
+            entry = self.by_statement[sql] = [0, 0.0]
+        if executed:
+            entry[0] += 1
+            self.statements += 1
+        entry[1] += seconds
+        self.sql_seconds += seconds
+
+    def slowest(self):
+        """(выражение, время в секундах) с наибольшим суммарным временем"""
+        if not self.by_statement:
+            return None, 0.0
+        sql, (_, seconds) = max(self.by_statement.items(), key=lambda item: item[1][1])
+        return sql, seconds
+
+    def most_repeated(self):
+        """(выражение, число выполнений) для самого часто повторяемого выражения"""
+        if not self.by_statement:
+            return None, 0
+        sql, (count, _) = max(self.by_statement.items(), key=lambda item: item[1][0])
+        return sql, count
+
+
+class PerfService:
+    """Замеры запросов Flask: время, число SQL-выражений, время SQL,
+    самое медленное выражение и выданные соединения.
+
+    Подключается к Database как наблюдатель (db.observer) и хранит
+    скользящее окно последних WINDOW_SIZE запросов для каждого маршрута.
+    """
+
+    def __init__(self, db: Database, window_size=WINDOW_SIZE):
+        self.db = db
+        self.window_size = window_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._routes = {}
+        db.observer = self
+
+    # Наблюдатель Database
+
+    def _current(self):
+        return getattr(self._local, 'stats', None)
+
+    def on_execute(self, sql, seconds):
+        stats = self._current()
+        if stats is not None:
+            stats.add(_normalize(sql), seconds, executed=True)
+
+    def on_fetch(self, sql, seconds):
+        stats = self._current()
+        if stats is not None:
+            stats.add(_normalize(sql), seconds, executed=False)
+
+    def on_checkout(self, opened):
+        stats = self._current()
+        if stats is not None:
+            stats.connections += 1
+            stats.connections_opened += int(opened)
+
+    # Жизненный цикл запроса
+
+    def start_request(self):
+        self._local.stats = RequestStats()
+
+    def finish_request(self, route):
+        """Завершение замера; возвращает сводку запроса или None"""
+        stats = self._current()
+        self._local.stats = None
+        if stats is None:
+            return None
+
+        slowest_sql, slowest_seconds = stats.slowest()
+        repeated_sql, repeated_count = stats.most_repeated()
+        sample = {
+            'total_ms': (time.perf_counter() - stats.started) * 1000,
+            'sql_ms': stats.sql_seconds * 1000,
+            'statements': stats.statements,
+            'connections': stats.connections,
+            'connections_opened': stats.connections_opened,
+            'slowest_sql': slowest_sql,
+            'slowest_sql_ms': slowest_seconds * 1000,
+            'repeated_sql': repeated_sql,
+            'repeated_count': repeated_count,
+        }
+
+        with self._lock:
+            route_stats = self._routes.get(route)
+            if route_stats is None:
+                route_stats = self._routes[route] = {'requests': 0, 'window': deque(maxlen=self.window_size)}
+            route_stats['requests'] += 1
+            route_stats['window'].append(sample)
+        return sample
+
+    @staticmethod
+    def server_timing(sample):
+        """Значение заголовка Server-Timing для сводки запроса"""
+        return (f"app;dur={sample['total_ms']:.2f}, "
+                f"sql;dur={sample['sql_ms']:.2f};desc=\"{sample['statements']} statements\", "
+                f"conn;desc=\"{sample['connections']} checkouts, {sample['connections_opened']} opened\"")
+
+    # Отчет
+
+    def report(self):
+        """Сводка по маршрутам за скользящее окно, самые медленные (p95) первыми"""
+        with self._lock:
+            routes = {route: (route_stats['requests'], list(route_stats['window']))
+                      for route, route_stats in self._routes.items()}
+
+        result = []
+        for route, (requests, window) in routes.items():
+            total = sorted(sample['total_ms'] for sample in window)
+            sql = sorted(sample['sql_ms'] for sample in window)
+            statements = [sample['statements'] for sample in window]
+
+            histogram = Counter()
+            for value in total:
+                bucket = next((f'<{bound}ms' for bound in HISTOGRAM_BOUNDS_MS if value < bound),
+                              f'>={HISTOGRAM_BOUNDS_MS[-1]}ms')
+                histogram[bucket] += 1
+
+            slowest = max(window, key=lambda sample: sample['slowest_sql_ms'])
+            repeated = max(window, key=lambda sample: sample['repeated_count'])
+            result.append({
+                'route': route,
+                'requests': requests,
+                'window': len(window),
+                'total_ms': {
+                    'p50': round(_percentile(total, 0.5), 3),
+                    'p95': round(_percentile(total, 0.95), 3),
+                    'p99': round(_percentile(total, 0.99), 3),
+                    'max': round(total[-1], 3),
+                },
+                'sql_ms': {
+                    'p50': round(_percentile(sql, 0.5), 3),
+                    'p95': round(_percentile(sql, 0.95), 3),
+                    'max': round(sql[-1], 3),
+                },
+                'statements': {
+                    'mean': round(sum(statements) / len(statements), 2),
+                    'max': max(statements),
+                },
+                'connections_opened': sum(sample['connections_opened'] for sample in window),
+                'histogram': {bucket: histogram[bucket] for bucket in
+                              [f'<{bound}ms' for bound in HISTOGRAM_BOUNDS_MS] + [f'>={HISTOGRAM_BOUNDS_MS[-1]}ms']
+                              if histogram[bucket]},
+                'slowest_statement': {
+                    'sql': (slowest['slowest_sql'] or '')[:STATEMENT_PREVIEW],
+                    'ms': round(slowest['slowest_sql_ms'], 3),
+                },
+                'most_repeated_statement': {
+                    'sql': (repeated['repeated_sql'] or '')[:STATEMENT_PREVIEW],
+                    'count': repeated['repeated_count'],
+                },
+                'suspected_n_plus_one': repeated['repeated_count'] >= N_PLUS_ONE_THRESHOLD,
+            })
+
+        result.sort(key=lambda entry: entry['total_ms']['p95'], reverse=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
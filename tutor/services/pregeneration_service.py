@@ -0,0 +1,217 @@
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database.database import Database
+from llm.llm_client import LLMClient
+from llm.preprocess import prepare_material
+from services.test_job_service import MATERIALS_DIR, TestJobService
+
+# Сколько материалов генерируется одновременно; больше 1 отнимает модель у учеников
+DEFAULT_CONCURRENCY = 1
+# Пауза между полными проходами по материалам (новые загрузки подхватываются на следующем)
+DEFAULT_INTERVAL = 600
+# Как часто проверять, освободилась ли модель
+IDLE_POLL_SECONDS = 5
+
+
+class PregenerationService:
+    """Заблаговременная генерация тестов по всем материалам.
+
+    Проходит по llm/materials/*.txt и загруженным материалам с извлеченным
+    текстом (таблица materials, ExtractionService), начиная с популярных и новых, и кэширует тесты, которых
+    еще нет в test_cache. Очередной материал берется в работу, только когда
+    модель простаивает: нет задач в очереди TestJobService и запросов
+    основного клиента. У планировщика свой LLMClient, поэтому его запросы
+    не учитываются как чужая нагрузка.
+    """
+
+    def __init__(self, db: Database, job_service: TestJobService, client=None,
+                 concurrency=DEFAULT_CONCURRENCY, interval=DEFAULT_INTERVAL):
+        self.db = db
+        self.job_service = job_service
+        self.client = client or LLMClient()
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = self._empty_status()
+
+    @staticmethod
+    def _empty_status():
+        return {
+            'state': 'stopped',
+            'total': 0,
+            'generated': 0,
+            'cached': 0,
+            'failed': 0,
+            'skipped': 0,
+            'current': [],
+            'errors': [],
+            'pass_started': None,
+            'pass_finished': None,
+        }
+
+    def start(self):
+        """Запуск планировщика; первый проход начинается сразу"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._status['state'] = 'starting'
+            self._thread = threading.Thread(target=self._loop, name='test-pregeneration', daemon=True)
+            self._thread.start()
+        print(f"🗓️ Заблаговременная генерация тестов запущена (потоков: {self.concurrency})")
+        return True
+
+    def trigger(self):
+        """Внеочередной проход (например, после загрузки материала)"""
+        self._wake.set()
+
+    def status(self):
+        with self._lock:
+            status = dict(self._status, current=list(self._status['current']), errors=list(self._status['errors']))
+        done = status['generated'] + status['cached'] + status['failed'] + status['skipped']
+        status['done'] = done
+        status['percent'] = round(100 * done / status['total'], 1) if status['total'] else 100.0
+        status['running'] = self._thread is not None
+        return status
+
+    def plan(self):
+        """Материалы в порядке генерации: популярные, при равенстве - новые.
+
+        Популярность файла llm/materials - число запрошенных по нему тестов,
+        загруженного материала - число скачиваний.
+        """
+        job_counts = self.db.get_test_job_counts()
+        items = []
+        for path in glob.glob(os.path.join(MATERIALS_DIR, '*.txt')):
+            name = os.path.splitext(os.path.basename(path))[0]
+            items.append({
+                'key': name,
+                'material_name': name,
+                'material_id': None,
+                'path': path,
+                'views': job_counts.get(name, 0),
+                'created': os.path.getmtime(path),
+            })
+
+        for material in self.db.get_text_materials():
+            items.append({
+                'key': f"material:{material['id']}",
+                'material_name': None,
+                'material_id': material['id'],
+                'path': None,
+                'views': material['download_count'] or 0,
+                'created': _timestamp(material['created_at']),
+            })
+
+        items.sort(key=lambda item: (item['views'], item['created']), reverse=True)
+        return items
+
+    def model_idle(self):
+        """Модель свободна: нет интерактивных запросов и ожидающих задач"""
+        return (self.job_service.pending_count() == 0
+                and self.job_service.admission.queued == 0
+                and self.job_service.client.in_flight == 0
+                and self.client.retry_after() == 0)
+
+    def run_pass(self):
+        """Один проход по всем материалам; возвращает итоговый статус"""
+        items = self.plan()
+        with self._lock:
+            self._status.update(self._empty_status(), state='running', total=len(items),
+                                pass_started=datetime.now().isoformat(timespec='seconds'))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self._process, items))
+
+        with self._lock:
+            self._status['state'] = 'sleeping'
+            self._status['pass_finished'] = datetime.now().isoformat(timespec='seconds')
+        status = self.status()
+        print(f"🗓️ Проход заблаговременной генерации завершен: новых {status['generated']}, "
+              f"из кэша {status['cached']}, ошибок {status['failed']}")
+        return status
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_pass()
+            except Exception as e:
+                print(f"❌ Ошибка заблаговременной генерации: {e}")
+            self._wake.wait(timeout=self.interval)
+            self._wake.clear()
+
+    def _wait_until_idle(self):
+        while not self.model_idle():
+            with self._lock:
+                self._status['state'] = 'waiting'
+            time.sleep(IDLE_POLL_SECONDS)
+        with self._lock:
+            self._status['state'] = 'running'
+
+    def _process(self, item):
+        # Пустые материалы (например, z16.txt) модели не отправляются
+        if item['path']:
+            material_text = _read_text(item['path'])
+        else:
+            material = self.db.get_material_text(item['material_id'])
+            material_text = material['extracted_text'] if material else None
+        if not material_text or not prepare_material(material_text):
+            self._record(item, 'skipped', 'Пустой материал')
+            return
+
+        key = self.client.cache_key(material_text)
+        if self.db.get_cached_test(key) is not None:
+            self._record(item, 'cached')
+            return
+
+        self._wait_until_idle()
+        with self._lock:
+            self._status['current'].append(item['key'])
+        try:
+            print(f"🗓️ Заблаговременная генерация теста: {item['key']}")
+            # Кэш и банк заполняет TestJobService; такая же идущая генерация не повторяется
+            result, _, shared = self.job_service.generate(material_text, item['material_name'],
+                                                          material_id=item['material_id'], client=self.client)
+        finally:
+            with self._lock:
+                self._status['current'].remove(item['key'])
+
+        # llm_client сообщает об ошибках строкой, начинающейся с ❌
+        if not result or result.startswith('❌'):
+            self._record(item, 'failed', result or 'Пустой ответ модели')
+            return
+        self._record(item, 'cached' if shared else 'generated')
+
+    def _record(self, item, outcome, error=None):
+        with self._lock:
+            self._status[outcome] += 1
+            if error:
+                self._status['errors'].append({'material': item['key'], 'error': error})
+
+
+def _read_text(path):
+    """Текст файла в UTF-8 (или cp1251, в которой часто сохраняют файлы в Windows)"""
+    for encoding in ('utf-8', 'cp1251'):
+        try:
+            with open(path, 'r', encoding=encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            continue
+        except OSError as e:
+            print(f"⚠️ Не удалось прочитать материал {path}: {e}")
+            return None
+    return None
+
+
+def _timestamp(value):
+    """created_at из SQLite ('YYYY-MM-DD HH:MM:SS') в секунды"""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
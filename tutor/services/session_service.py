@@ -0,0 +1,243 @@
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from database.database import Database
+
+# Сессий в памяти процесса перед SQLite
+DEFAULT_CACHE_SIZE = 1024
+# Как часто удалять истекшие сессии из базы
+SWEEP_INTERVAL = 600
+SESSION_ID = re.compile(r'^[\w-]{32,64}$')
+
+
+class SessionStore:
+    """Хранилище серверных сессий. Данные - dict, который сериализует само хранилище.
+
+    load(session_id) -> (data, expires_at, version) или None; save возвращает
+    новую версию (ложное значение при ошибке); version(session_id) - текущая
+    версия или None; delete; sweep() удаляет истекшие сессии и возвращает
+    их количество.
+    """
+
+    def load(self, session_id):
+        raise NotImplementedError
+
+    def version(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, data, expires_at):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def sweep(self):
+        return 0
+
+
+class SqliteSessionStore(SessionStore):
+    """Сессии в таблице sessions основной базы"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.serializer = TaggedJSONSerializer()
+
+    def load(self, session_id):
+        row = self.db.get_session(session_id)
+        if row is None:
+            return None
+        data, expires_at, version = row
+        try:
+            return self.serializer.loads(data), expires_at, version
+        except ValueError:
+            return None
+
+    def version(self, session_id):
+        return self.db.get_session_version(session_id)
+
+    def save(self, session_id, data, expires_at):
+        return self.db.save_session(session_id, self.serializer.dumps(data), expires_at)
+
+    def delete(self, session_id):
+        return self.db.delete_session(session_id)
+
+    def sweep(self):
+        return self.db.delete_expired_sessions()
+
+
+class LRUSessionStore(SessionStore):
+    """LRU-кэш сессий процесса перед другим хранилищем.
+
+    Запись идет в оба места сразу, поэтому после перезапуска сессии
+    читаются из store. Копия в кэше используется, только если ее версия
+    совпадает с версией в store: при попадании читается один номер версии
+    вместо данных, а изменения и выход в другом процессе сервера видны
+    сразу.
+    """
+
+    def __init__(self, store: SessionStore, max_entries=DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[session_id]
+                entry = None
+
+        if entry is not None:
+            version = self.store.version(session_id)
+            with self._lock:
+                if version == entry[2]:
+                    if session_id in self._entries:
+                        self._entries.move_to_end(session_id)
+                    self.hits += 1
+                    # Копия: изменения сессии в обработчике не должны менять кэш до save
+                    return dict(entry[0]), entry[1], entry[2]
+                # Сессию изменил или удалил другой процесс
+                self._entries.pop(session_id, None)
+
+        with self._lock:
+            self.misses += 1
+        entry = self.store.load(session_id)
+        if entry is not None:
+            self._remember(session_id, *entry)
+        return entry
+
+    def version(self, session_id):
+        return self.store.version(session_id)
+
+    def save(self, session_id, data, expires_at):
+        version = self.store.save(session_id, data, expires_at)
+        if version:
+            self._remember(session_id, dict(data), expires_at, version)
+        return version
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+        return self.store.delete(session_id)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            for session_id in [sid for sid, (_, expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[session_id]
+        return self.store.sweep()
+
+    def _remember(self, session_id, data, expires_at, version):
+        with self._lock:
+            self._entries[session_id] = (data, expires_at, version)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Сессия Flask, данные которой хранятся на сервере"""
+
+    def __init__(self, initial=None, session_id=None, expires_at=None, new=False):
+        def on_update(session):
+            session.modified = True
+            session.accessed = True
+
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.previous_id = None
+
+    def regenerate(self):
+        """Новый id с теми же данными (после входа, против фиксации сессии)"""
+        if self.previous_id is None and not self.new:
+            self.previous_id = self.session_id
+        self.session_id = _new_session_id()
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Сессии на сервере: в cookie только случайный непрозрачный id.
+
+    Неизвестный или истекший id из cookie не используется повторно - для
+    сессии выдается новый. Запросы, не изменившие сессию (в том числе к
+    статическим файлам), ничего не пишут; срок продлевается, когда прошла
+    половина app.permanent_session_lifetime. Истекшие сессии удаляются не
+    чаще раза в SWEEP_INTERVAL секунд.
+    """
+
+    def __init__(self, store: SessionStore, sweep_interval=SWEEP_INTERVAL):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self._sweep_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if session_id and SESSION_ID.match(session_id):
+            entry = self.store.load(session_id)
+            if entry is not None:
+                data, expires_at, _ = entry
+                return ServerSession(data, session_id, expires_at)
+        return ServerSession(session_id=_new_session_id(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.previous_id:
+            self.store.delete(session.previous_id)
+            session.previous_id = None
+
+        if not session:
+            # Сессия очищена (выход) - удаляем запись и cookie
+            if session.modified and not session.new:
+                self.store.delete(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        refresh = session.expires_at is not None and session.expires_at - now < lifetime / 2
+        if not (session.modified or refresh):
+            return
+
+        session.expires_at = now + lifetime
+        self.store.save(session.session_id, dict(session), session.expires_at)
+        response.set_cookie(name, session.session_id, expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        with self._sweep_lock:
+            if time.monotonic() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = time.monotonic()
+        deleted = self.store.sweep()
+        if deleted:
+            print(f"🧹 Удалено истекших сессий: {deleted}")
+
+
+def _new_session_id():
+    return secrets.token_urlsafe(32)
@@ -0,0 +1,276 @@
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+from database.database import TEST_JOB_LEASE_SECONDS, Database
+from llm.admission import MAX_IN_FLIGHT, AdmissionController, AdmissionError
+from llm.llm_client import default_client
+from llm.preprocess import prepare_material
+from llm.single_flight import SingleFlight
+from llm.test_parser import parse_test
+
+# Материалы, доступные по имени (z5 -> llm/materials/z5.txt)
+MATERIALS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'llm', 'materials')
+MATERIAL_NAME = re.compile(r'^[\w-]+$')
+
+# Сколько тестов генерируется одновременно (по умолчанию - сколько допускает admission)
+DEFAULT_WORKERS = None
+
+
+class TestJobService:
+    """Фоновая генерация тестов.
+
+    Задачи сохраняются в таблице test_jobs и выполняются пулом из
+    max_workers потоков, поэтому веб-обработчики не ждут модель.
+    Потоки-демоны не задерживают остановку приложения: прерванные задачи
+    остаются в базе и возвращаются в очередь при следующем запуске (resume).
+    Выполняемые задачи арендуются процессом (owner) и продлеваются, пока он
+    жив, поэтому resume другого воркера не забирает их повторно.
+
+    Готовые тесты кэшируются в test_cache по ключу LLMClient.cache_key;
+    задача с тестом из кэша завершается сразу, без обращения к модели.
+    Новые тесты разбираются и сохраняются в банк вопросов (save_to_bank).
+
+    Одновременные генерации с одним ключом кэша объединяются (flights):
+    модель вызывается один раз, остальные задачи получают тот же тест.
+    Генерации допускаются к модели через admission (не больше
+    max_in_flight одновременно, ограниченная очередь, одна задача в очереди
+    на пользователя); эту же очередь проходит потоковая генерация.
+    По умолчанию max_in_flight - LMSTUDIO_MAX_IN_FLIGHT на каждый сервер
+    модели клиента.
+    """
+
+    def __init__(self, db: Database, client=None, max_workers=DEFAULT_WORKERS, admission=None):
+        self.db = db
+        self.client = client or default_client
+        self._queue = queue.Queue()
+        self.flights = SingleFlight()
+        self.admission = admission or AdmissionController(MAX_IN_FLIGHT * len(self.client.router.backends))
+        # id задачи -> билет в очереди admission; меняют и веб-обработчики, и потоки задач
+        self._tickets = {}
+        self._tickets_lock = threading.Lock()
+        # Владелец аренды выполняемых задач: процесс и экземпляр сервиса
+        self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        # id задач, которые выполняет этот процесс (под _tickets_lock)
+        self._running = set()
+        self._lease_thread = threading.Thread(target=self._renew_leases, name='test-job-lease', daemon=True)
+        self._lease_thread.start()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f'test-job-{i}', daemon=True)
+            for i in range(max_workers or self.admission.max_in_flight)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @staticmethod
+    def load_material(material_name):
+        """Текст материала llm/materials/<material_name>.txt или None"""
+        if not material_name or not MATERIAL_NAME.match(material_name):
+            return None
+        path = os.path.join(MATERIALS_DIR, f'{material_name}.txt')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def load_uploaded_material(self, material_id, extracting=True):
+        """Извлеченный текст загруженного материала (ExtractionService).
+        extracting - запущено ли извлечение текста. ValueError, если материала
+        нет или его текст недоступен."""
+        material = self.db.get_material_text(material_id)
+        if material is None:
+            raise ValueError('Материал не найден')
+        if material['text_status'] == 'pending':
+            # text_error у pending - не установлен пакет для формата (см. ExtractionService)
+            if material['text_error']:
+                raise ValueError(material['text_error'])
+            if not extracting:
+                raise ValueError('Извлечение текста материалов отключено на сервере')
+            raise ValueError('Текст материала еще извлекается, попробуйте позже')
+        if material['text_status'] != 'done':
+            raise ValueError(material['text_error'] or 'В материале нет текста для генерации теста')
+        return material['extracted_text']
+
+    def submit(self, user_id, material_text=None, material_name=None, force_fresh=False, material_id=None):
+        """Постановка задачи в очередь; возвращает id задачи.
+
+        Без material_text материал читается по имени из llm/materials.
+        material_id - загруженный материал, из которого взят текст: вопросы
+        теста сохраняются в банк с этим материалом.
+        Если тест есть в кэше и не запрошена свежая генерация (force_fresh),
+        задача сразу получает статус done. ValueError, если материал не
+        найден или пуст; AdmissionError (с job_id уже ожидающей задачи
+        пользователя, если она есть), если очередь генерации не принимает задачу.
+        """
+        if not material_text:
+            material_text = self.load_material(material_name)
+        # Пустой (или только из пробелов) материал отклоняется до обращения к модели
+        if not material_text or not prepare_material(material_text):
+            raise ValueError('Не указан материал для генерации теста')
+
+        cached = None if force_fresh else self.db.get_cached_test(self.client.cache_key(material_text))
+        if cached is not None:
+            job_id = self._create_job(user_id, material_name, material_text, force_fresh, material_id)
+            self.db.finish_test_job(job_id, result=cached, from_cache=True)
+            print(f"⚡ Тест {job_id} взят из кэша")
+            return job_id
+
+        try:
+            ticket = self.admission.enqueue(user_id)
+        except AdmissionError as e:
+            # Билет потоковой генерации (без задачи) - job_id None
+            e.job_id = e.pending.job_id if e.pending is not None else None
+            raise
+        try:
+            job_id = self._create_job(user_id, material_name, material_text, force_fresh, material_id)
+        except RuntimeError:
+            self.admission.release(ticket)
+            raise
+        self._add_ticket(job_id, ticket)
+        self._queue.put(job_id)
+        return job_id
+
+    def _create_job(self, user_id, material_name, material_text, force_fresh, material_id):
+        job_id = self.db.create_test_job(user_id, material_name, material_text, force_fresh, material_id)
+        if not job_id:
+            raise RuntimeError('Не удалось создать задачу генерации теста')
+        return job_id
+
+    def _add_ticket(self, job_id, ticket):
+        ticket.job_id = job_id
+        with self._tickets_lock:
+            self._tickets[job_id] = ticket
+
+    def _ticket(self, job_id):
+        with self._tickets_lock:
+            return self._tickets.get(job_id)
+
+    def position(self, job_id):
+        """Место задачи в очереди генерации с 1; 0 - выполняется; None - задачи нет в очереди"""
+        ticket = self._ticket(job_id)
+        return self.admission.position(ticket) if ticket else None
+
+    def resume(self):
+        """Возврат в очередь задач, не завершенных до перезапуска"""
+        job_ids = self.db.requeue_unfinished_test_jobs()
+        for job_id in job_ids:
+            # Уже принятые задачи не проверяются на ограничения очереди
+            self._add_ticket(job_id, self.admission.enqueue(force=True))
+            self._queue.put(job_id)
+        if job_ids:
+            print(f"🔄 Возобновлено задач генерации тестов: {len(job_ids)}")
+        return len(job_ids)
+
+    def pending_count(self):
+        return self._queue.qsize()
+
+    def _renew_leases(self):
+        # Продление заметно чаще срока аренды: задержка одного продления не отдает задачи
+        while True:
+            time.sleep(TEST_JOB_LEASE_SECONDS / 4)
+            with self._tickets_lock:
+                running = bool(self._running)
+            if running:
+                self.db.renew_test_job_leases(self.owner)
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"❌ Ошибка задачи генерации теста {job_id}: {e}")
+                self.db.finish_test_job(job_id, error=f'Неожиданная ошибка: {e}')
+            finally:
+                with self._tickets_lock:
+                    ticket = self._tickets.pop(job_id, None)
+                if ticket:
+                    self.admission.release(ticket)
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = self.db.start_test_job(job_id, owner=self.owner)
+        if job is None:
+            return
+        with self._tickets_lock:
+            self._running.add(job_id)
+        try:
+            self._generate_job(job_id, job)
+        finally:
+            with self._tickets_lock:
+                self._running.discard(job_id)
+
+    def _finish(self, job_id, **kwargs):
+        """Сохранение результата задачи, если аренду не забрал другой процесс"""
+        if self.db.finish_test_job(job_id, owner=self.owner, **kwargs):
+            return True
+        print(f"⚠️ Задача {job_id} выполняется другим процессом, результат не сохранен")
+        return False
+
+    def _generate_job(self, job_id, job):
+        # Пока задача ждала в очереди, такой же тест мог сгенерировать другой обработчик
+        key = self.client.cache_key(job['material_text'])
+        cached = None if job['force_fresh'] else self.db.get_cached_test(key)
+        if cached is not None:
+            if self._finish(job_id, result=cached, from_cache=True):
+                print(f"⚡ Тест {job_id} взят из кэша")
+            return
+
+        print(f"📝 Генерация теста {job_id} ({job['material_name'] or 'текст'})...")
+        result, test_id, shared = self.generate(job['material_text'], job['material_name'], job['user_id'],
+                                                material_id=job['material_id'], ticket=self._ticket(job_id))
+
+        # llm_client сообщает об ошибках строкой, начинающейся с ❌
+        if not result or result.startswith('❌'):
+            if self._finish(job_id, error=result or 'Пустой ответ модели'):
+                print(f"❌ Тест {job_id} не сгенерирован: {result}")
+            return
+
+        # Тест, полученный от такой же одновременной генерации, для задачи - из кэша
+        if not self._finish(job_id, result=result, from_cache=shared):
+            return
+        if test_id:
+            self.db.set_test_job_test(job_id, test_id)
+        print(f"✅ Тест {job_id} {'получен от такой же генерации' if shared else 'сгенерирован'}")
+
+    def generate(self, material_text, material_name=None, user_id=None, material_id=None, client=None,
+                 ticket=None):
+        """Генерация теста с сохранением в кэш и банк: (тест или строка с ❌, id теста, shared).
+
+        Если тест с тем же ключом кэша уже генерируется, ждет его и
+        возвращает shared=True, не обращаясь к модели и освободив место в
+        очереди. Иначе ждет очереди admission по билету ticket (без билета -
+        вне ограничений очереди, как фоновая генерация).
+        """
+        client = client or self.client
+        key = client.cache_key(material_text)
+        ticket = ticket or self.admission.enqueue(force=True)
+
+        def run():
+            self.admission.acquire(ticket)
+            try:
+                result = client.generate_test(material_text, material_name=material_name)
+            finally:
+                self.admission.release(ticket)
+            if not result or result.startswith('❌'):
+                return result, None
+            self.db.save_cached_test(key, client.model, material_name, result)
+            return result, self.save_to_bank(result, material_name, user_id, material_id)
+
+        try:
+            (result, test_id), shared = self.flights.do(key, run, on_join=lambda: self.admission.release(ticket))
+        finally:
+            self.admission.release(ticket)
+        return result, test_id, shared
+
+    def save_to_bank(self, test_text, material_name=None, user_id=None, material_id=None):
+        """Разбор теста и сохранение вопросов в банк; id теста или None"""
+        questions = parse_test(test_text)
+        if not questions:
+            print("⚠️ Не удалось разобрать вопросы теста для банка")
+            return None
+        return self.db.save_generated_test(questions, material_name=material_name, material_id=material_id,
+                                           created_by=user_id) or None
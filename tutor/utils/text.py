@@ -0,0 +1,8 @@
+# Вопросы, у которых столько общих слов в формулировке, считаются дубликатами
+DUPLICATE_SIMILARITY = 0.75
+
+
+def similar_words(words, other):
+    """Почти одинаковые формулировки: доля общих слов двух наборов не меньше DUPLICATE_SIMILARITY"""
+    union = words | other
+    return bool(union) and len(words & other) / len(union) >= DUPLICATE_SIMILARITY